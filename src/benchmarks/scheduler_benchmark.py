@@ -0,0 +1,354 @@
+"""
+Benchmark del programador FSRS.
+
+Genera poblaciones sintéticas de tarjetas (los tres `State`) y calificaciones
+(todos los `Rating`) y mide tarjetas por segundo de `learning_scheduler` y de
+las variantes rápidas. Los resultados se escriben en JSON para comparar entre
+versiones. Que las variantes den lo mismo que `learning_scheduler` lo
+comprueba tests/test_fsrs_scheduler.py con las mismas poblaciones.
+
+Uso (desde src/):
+    python -m benchmarks.scheduler_benchmark --output scheduler_benchmark.json
+
+Con `--baseline anterior.json` también muestra cuánto más rápida es cada
+variante que en esa corrida.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import numpy as np
+
+from tools.fsrs_scheduler import (
+    NO_STEP,
+    PER_CARD_LIMIT,
+    Scheduler,
+    from_datetime64,
+    learning_scheduler,
+    learning_scheduler_batch,
+    to_datetime64,
+)
+from utils.fsrs_config import Rating, State
+
+_US_PER_DAY = 86_400_000_000
+
+# construido una vez, como el de `get_scheduler`: las variantes `scheduler*`
+# miden solo la calificación, sin recalcular las constantes
+_SCHEDULER = Scheduler()
+
+
+@dataclass
+class CardPopulation:
+    state: np.ndarray
+    stability: np.ndarray
+    difficulty: np.ndarray
+    step: np.ndarray
+    last_review: np.ndarray  # datetime64[us], NaT = nunca revisada
+
+    def __len__(self):
+        return self.state.shape[0]
+
+    def take(self, index) -> CardPopulation:
+        return CardPopulation(
+            self.state[index],
+            self.stability[index],
+            self.difficulty[index],
+            self.step[index],
+            self.last_review[index],
+        )
+
+
+def make_population(n: int, now: datetime, seed: int = 0) -> CardPopulation:
+    """Tarjetas en los tres estados, con y sin repaso previo, repasadas hoy o hace meses."""
+    rng = np.random.default_rng(seed)
+    state = rng.integers(State.Learning, State.Relearning + 1, n)
+    step = np.where(state == State.Review, NO_STEP, rng.integers(0, 3, n))
+    # algunas tarjetas en aprendizaje o reaprendizaje sin paso asignado
+    step = np.where((state != State.Review) & (rng.random(n) < 0.1), NO_STEP, step)
+
+    elapsed_us = np.where(
+        rng.random(n) < 0.3,
+        rng.integers(0, _US_PER_DAY, n),             # repasadas hoy (corto plazo)
+        rng.integers(0, 400 * _US_PER_DAY, n),       # repasadas hace días
+    )
+    last_review = to_datetime64([now])[0] - elapsed_us.astype("timedelta64[us]")
+    last_review[rng.random(n) < 0.1] = np.datetime64("NaT")
+
+    return CardPopulation(
+        state=state,
+        stability=rng.uniform(0.1, 365.0, n),
+        difficulty=rng.uniform(1.0, 10.0, n),
+        step=step,
+        last_review=last_review,
+    )
+
+
+def make_rating_stream(n: int, length: int, seed: int = 0) -> np.ndarray:
+    """Calificaciones (length, n); cada fila contiene todos los `Rating`."""
+    rng = np.random.default_rng(seed)
+    ratings = rng.integers(Rating.Again, Rating.Easy + 1, (length, n))
+    ratings[:, :len(Rating)] = np.array(list(Rating))
+    return ratings
+
+
+def _cards(population: CardPopulation, ratings) -> list[tuple[SimpleNamespace, Rating]]:
+    """Tarjetas y calificaciones como las recibe el camino escalar."""
+    last_reviews = from_datetime64(population.last_review)
+    return [
+        (
+            SimpleNamespace(
+                state=State(int(population.state[i])),
+                stability=float(population.stability[i]),
+                difficulty=float(population.difficulty[i]),
+                step=None if population.step[i] == NO_STEP else int(population.step[i]),
+                last_review=last_reviews[i],
+            ),
+            Rating(int(ratings[i])),
+        )
+        for i in range(len(population))
+    ]
+
+
+def _scalar_review(card, rating: Rating, review_datetime: datetime) -> tuple:
+    return learning_scheduler(
+        state=card.state,
+        stability=card.stability,
+        difficulty=card.difficulty,
+        rating=rating,
+        days_since_last_review=None,
+        review_datetime=review_datetime,
+        last_review=card.last_review,
+        step=card.step,
+    )
+
+
+def _per_card_columns(review, population: CardPopulation, ratings, review_datetime: datetime):
+    results = [review(card, rating, review_datetime) for card, rating in _cards(population, ratings)]
+    return {
+        "days_since_last_review": np.array([r[2] for r in results], dtype=np.int64),
+        "due": to_datetime64([r[3] for r in results]),
+        "stability": np.array([r[4] for r in results], dtype=np.float64),
+        "difficulty": np.array([r[5] for r in results], dtype=np.float64),
+        "state": np.array([r[6] for r in results], dtype=np.int64),
+        "step": np.array([NO_STEP if r[8] is None else r[8] for r in results], dtype=np.int64),
+    }
+
+
+def scalar_columns(population: CardPopulation, ratings, review_datetime: datetime):
+    """Aplica `learning_scheduler` tarjeta por tarjeta y devuelve columnas comparables."""
+    return _per_card_columns(_scalar_review, population, ratings, review_datetime)
+
+
+def _batch_columns(population: CardPopulation, ratings, review_datetime: datetime):
+    result = learning_scheduler_batch(
+        state=population.state,
+        stability=population.stability,
+        difficulty=population.difficulty,
+        step=population.step,
+        last_review=population.last_review,
+        rating=ratings,
+        review_datetime=review_datetime,
+    )
+    return {
+        "days_since_last_review": result[2],
+        "due": result[3],
+        "stability": result[4],
+        "difficulty": result[5],
+        "state": result[6],
+        "step": result[8],
+    }
+
+
+def _scheduler_columns(population: CardPopulation, ratings, review_datetime: datetime):
+    return _per_card_columns(_SCHEDULER.review, population, ratings, review_datetime)
+
+
+def _scheduler_many_columns(population: CardPopulation, ratings, review_datetime: datetime):
+    result = _SCHEDULER.review_many(
+        state=population.state,
+        stability=population.stability,
+        difficulty=population.difficulty,
+        step=population.step,
+        last_review=population.last_review,
+        rating=ratings,
+        now=review_datetime,
+    )
+    return {
+        "days_since_last_review": result[2],
+        "due": result[3],
+        "stability": result[4],
+        "difficulty": result[5],
+        "state": result[6],
+        "step": result[8],
+    }
+
+
+def _scheduler_groups_columns(population: CardPopulation, ratings, review_datetime: datetime):
+    """`review_many` sobre grupos de `PER_CARD_LIMIT` tarjetas, como en una sesión de estudio."""
+    groups = [
+        _scheduler_many_columns(
+            population.take(slice(start, start + PER_CARD_LIMIT)),
+            ratings[start:start + PER_CARD_LIMIT],
+            review_datetime,
+        )
+        for start in range(0, len(population), PER_CARD_LIMIT)
+    ]
+    return {column: np.concatenate([group[column] for group in groups]) for column in groups[0]}
+
+
+# variantes rápidas de `learning_scheduler` (tests/test_fsrs_scheduler.py las compara con `scalar_columns`)
+VARIANTS = {
+    "batch": _batch_columns,
+    "scheduler": _scheduler_columns,
+    "scheduler_many": _scheduler_many_columns,
+    "scheduler_groups": _scheduler_groups_columns,
+}
+# variantes que procesan tarjeta por tarjeta (se miden sobre una muestra)
+_PER_CARD_REVIEWS = {"scalar": _scalar_review, "scheduler": _SCHEDULER.review}
+
+
+# tarjetas mínimas por medición: los grupos chicos se califican varias veces seguidas
+_MIN_CARDS_PER_TIMING = 20_000
+
+
+def _timed_call(name: str, function, population: CardPopulation, ratings, now: datetime):
+    """Lo que se mide de cada variante; las tarjetas del camino escalar se arman antes de medir."""
+    if name in _PER_CARD_REVIEWS:
+        review = _PER_CARD_REVIEWS[name]
+        cards = _cards(population, ratings)
+        return lambda: [review(card, rating, now) for card, rating in cards]
+    return lambda: function(population, ratings, now)
+
+
+def _cards_per_second(call, cards: int, repeats: int) -> float:
+    calls = max(1, _MIN_CARDS_PER_TIMING // cards)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            call()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return cards / best
+
+
+def run_benchmark(sizes, repeats: int, seed: int, scalar_limit: int) -> list[dict]:
+    now = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+    results = []
+    for size in sizes:
+        population = make_population(size, now, seed)
+        ratings = make_rating_stream(size, 1, seed)[0]
+        variants = {"scalar": scalar_columns, **VARIANTS}
+        for name, function in variants.items():
+            # los caminos escalares son lentos: se miden sobre una muestra
+            sample = population.take(slice(0, scalar_limit)) if name in _PER_CARD_REVIEWS else population
+            sample_ratings = ratings[:len(sample)]
+            results.append({
+                "variant": name,
+                "cards": size,
+                "cards_per_second": _cards_per_second(
+                    _timed_call(name, function, sample, sample_ratings, now), len(sample), repeats
+                ),
+            })
+    return results
+
+
+# (variante, referencia): lo que se gana al reutilizar el `Scheduler`
+_SPEEDUPS = (("scheduler", "scalar"), ("scheduler_many", "batch"))
+
+
+def speedups(throughput: list[dict]) -> list[dict]:
+    """Cuántas veces más rápida es cada variante `scheduler*` que la función equivalente, por tamaño."""
+    speed = {(row["variant"], row["cards"]): row["cards_per_second"] for row in throughput}
+    return [
+        {
+            "variant": variant,
+            "reference": reference,
+            "cards": cards,
+            "speedup": speed[variant, cards] / speed[reference, cards],
+        }
+        for cards in sorted({row["cards"] for row in throughput})
+        for variant, reference in _SPEEDUPS
+    ]
+
+
+def compare_runs(baseline: list[dict], throughput: list[dict]) -> list[dict]:
+    """Cuántas veces más rápida es cada variante que en una corrida anterior (mismas variantes y tamaños)."""
+    before = {(row["variant"], row["cards"]): row["cards_per_second"] for row in baseline}
+    return [
+        {
+            "variant": row["variant"],
+            "cards": row["cards"],
+            "speedup": row["cards_per_second"] / before[row["variant"], row["cards"]],
+        }
+        for row in throughput
+        if (row["variant"], row["cards"]) in before
+    ]
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="5,20,1000,10000,50000",
+                        help="tamaños de población separados por comas")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scalar-limit", type=int, default=5000,
+                        help="máximo de tarjetas para medir el camino escalar")
+    parser.add_argument("--output", default="scheduler_benchmark.json")
+    parser.add_argument("--baseline", help="JSON de una corrida anterior para comparar tarjetas por segundo")
+    args = parser.parse_args(argv)
+
+    throughput = run_benchmark(
+        [int(size) for size in args.sizes.split(",")], args.repeats, args.seed, args.scalar_limit
+    )
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "throughput": throughput,
+        "speedups": speedups(throughput),
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["baseline"] = {
+            "revision": baseline.get("revision"),
+            "speedups": compare_runs(baseline["throughput"], throughput),
+        }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for row in throughput:
+        print(f"{row['variant']:>16} {row['cards']:>8} cards  {row['cards_per_second']:>14,.0f} cards/s")
+    for row in report["speedups"]:
+        print(f"{row['variant']:>16} {row['cards']:>8} cards  {row['speedup']:>6.2f}x vs {row['reference']}")
+    if args.baseline:
+        revision = report["baseline"]["revision"] or args.baseline
+        for row in report["baseline"]["speedups"]:
+            print(f"{row['variant']:>16} {row['cards']:>8} cards  {row['speedup']:>6.2f}x vs {revision}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,90 @@
-import os
+from io import BytesIO
+
 import pandas as pd
 import streamlit as st
 
-from tools.sql_tool import open_deck, deck_selection, update_card, get_card
-from components.study_section import study_deck_connection
+from tools.deck_migration import migrate_deck_files
+from tools.deck_snapshot import FORMATS, export_deck, import_deck
+from tools.fsrs_optimizer import optimize_deck
+from tools.sql_tool import (
+    open_deck,
+    deck_selection,
+    update_card,
+    get_card,
+    get_scheduler,
+    save_scheduler_settings,
+    delete_card,
+    close_due_queue,
+    delete_deck,
+    rebuild_stats,
+)
+from components.study_section import render_deck_stats, study_deck_connection
+
+SEARCH_LIMIT = 50
 
 @st.cache_resource(show_spinner="Opening deck database...")
 def manage_deck_connection(deck_name: str):
     db_path, session = open_deck(deck_name)
     return db_path, session
 
+def _parse_steps(text: str) -> list[float]:
+    """Pasos escritos en minutos separados por espacios -> segundos."""
+    try:
+        return [float(minutes) * 60 for minutes in text.split()]
+    except ValueError:
+        raise ValueError("Steps must be numbers separated by spaces") from None
+
+def render_migration_panel(db_files):
+    deck_files = [name for name in db_files if name.endswith(".db")]
+    if not deck_files:
+        return
+    with st.expander("Move deck files into the shared database", icon=":material/merge:"):
+        st.write(f"Deck files: {', '.join(deck_files)}")
+        st.caption("Each file becomes a deck of the shared database and is renamed to *.db.migrated")
+        if st.button("Migrate decks"):
+            with st.spinner("Migrating decks..."):
+                report = migrate_deck_files()
+            # las sesiones abiertas apuntan a los archivos viejos
+            study_deck_connection.clear()
+            manage_deck_connection.clear()
+            for key in ("studying_db", "studying_deck", "manage_db", "manage_deck"):
+                st.session_state.pop(key, None)
+            for name, result in report.items():
+                if isinstance(result, int):
+                    st.success(f"{name}: {result} cards migrated")
+                else:
+                    st.warning(f"{name}: {result}")
+
+def render_snapshot_panel(session, deck: str):
+    with st.expander("Export / import deck snapshot", icon=":material/swap_vert:"):
+        file_format = st.selectbox("Format", FORMATS)
+        include_history = st.checkbox("Include review history", value=True)
+        if st.button("Prepare export"):
+            cards_file = BytesIO()
+            history_file = BytesIO() if include_history else None
+            with st.spinner("Exporting deck..."):
+                cards, reviews = export_deck(session, cards_file, history_file, file_format=file_format)
+            st.session_state.snapshot_files = (file_format, cards_file.getvalue(), history_file and history_file.getvalue())
+            st.caption(f"{cards} cards and {reviews} reviews exported")
+        if "snapshot_files" in st.session_state:
+            file_format, cards_data, history_data = st.session_state.snapshot_files
+            name = deck.removesuffix(".db")
+            st.download_button("Download cards", cards_data, f"{name}_cards.{file_format}")
+            if history_data is not None:
+                st.download_button("Download history", history_data, f"{name}_history.{file_format}")
+
+        st.markdown("---")
+        cards_upload = st.file_uploader("Cards snapshot", type=["parquet", "feather", "arrow"])
+        history_upload = st.file_uploader("History snapshot (optional)", type=["parquet", "feather", "arrow"])
+        if cards_upload is not None and st.button("Import snapshot"):
+            with st.spinner("Importing snapshot..."):
+                cards, reviews = import_deck(session, cards_upload, history_upload)
+            st.success(f"{cards} cards and {reviews} reviews added")
+
 def database_section():
     st.write("Select Database")
     db_files = deck_selection()
+    render_migration_panel(db_files)
     deck = st.selectbox(
         "Select a deck to manipulate",
         options=db_files
@@ -22,6 +94,7 @@ def database_section():
             if "manage_db" in st.session_state and st.session_state.manage_deck is not None:
                 st.session_state.manage_db.close()
             st.session_state.manage_deck = deck
+            st.session_state.pop("snapshot_files", None)
             db_path, session = manage_deck_connection(deck)
             st.session_state.db_path_to_delete = db_path
             st.session_state.manage_db = session
@@ -34,8 +107,10 @@ def database_section():
         st.write("Search word")
         user_query = st.text_input("Search for a word")
         user_query = user_query.strip()
-        # Check if the word exists (case-sensitive)
-        cards, card_names = get_card(st.session_state.manage_db, user_query)
+        # búsqueda indexada, limitada a las mejores coincidencias
+        cards, card_names = get_card(st.session_state.manage_db, user_query, limit=SEARCH_LIMIT)
+        if len(card_names) == SEARCH_LIMIT:
+            st.caption(f"Showing the first {SEARCH_LIMIT} matches, type more letters to narrow the search")
         if card_names:
             card_name = st.selectbox("Select a matching word", card_names)
             card_index = card_names.index(card_name)
@@ -75,18 +150,19 @@ def database_section():
                 with col1:
                     if st.button("Overwrite Word"):
                         new_word = df.at[0, "overwrite_word"]
-                        update_card(st.session_state.manage_db, card.word, new_word=new_word)
-                        manage_deck_connection.clear()
-                        st.rerun()
+                        if update_card(st.session_state.manage_db, card.word, new_word=new_word):
+                            manage_deck_connection.clear()
+                            st.rerun()
+                        st.warning(f"Word '{card.word}' is no longer in the deck")
                 with col2:
                     if st.button("Reset All Values"):
-                        update_card(st.session_state.manage_db, card.word, restore=True)
-                        manage_deck_connection.clear()
-                        st.rerun()
+                        if update_card(st.session_state.manage_db, card.word, restore=True):
+                            manage_deck_connection.clear()
+                            st.rerun()
+                        st.warning(f"Word '{card.word}' is no longer in the deck")
                 with col3:
                     if st.button("Delete Word"):
-                        st.session_state.manage_db.delete(card)
-                        st.session_state.manage_db.commit()
+                        delete_card(st.session_state.manage_db, card)
                         manage_deck_connection.clear()  # 🔁 Limpia el caché
                         st.rerun()
             else:
@@ -94,6 +170,62 @@ def database_section():
         else:
             st.warning("No results found")
         
+        # statistics section
+        st.markdown("---")
+        st.write("Deck statistics")
+        render_deck_stats(st.session_state.manage_db)
+        if st.button("Rebuild statistics", help="Recount the statistics from the cards if they look wrong"):
+            rebuild_stats(st.session_state.manage_db)
+            st.rerun()
+
+        # snapshot section
+        st.markdown("---")
+        render_snapshot_panel(st.session_state.manage_db, st.session_state.manage_deck)
+
+        # scheduler settings section
+        st.markdown("---")
+        st.write("Scheduler settings")
+        scheduler = get_scheduler(st.session_state.manage_db)
+        with st.form("scheduler_settings_form"):
+            desired_retention = st.slider(
+                "Desired retention", 0.70, 0.97, float(scheduler.desired_retention), 0.01,
+                help="Higher values mean more frequent reviews.",
+            )
+            learning_steps = st.text_input(
+                "Learning steps (minutes)",
+                value=" ".join(f"{step.total_seconds() / 60:g}" for step in scheduler.learning_steps),
+            )
+            relearning_steps = st.text_input(
+                "Relearning steps (minutes)",
+                value=" ".join(f"{step.total_seconds() / 60:g}" for step in scheduler.re_learning_steps),
+            )
+            maximum_interval = st.number_input(
+                "Maximum interval (days)", 1, 36500, int(scheduler.maximum_interval)
+            )
+            if st.form_submit_button("Save settings"):
+                try:
+                    save_scheduler_settings(
+                        st.session_state.manage_db,
+                        desired_retention=desired_retention,
+                        learning_steps=_parse_steps(learning_steps),
+                        relearning_steps=_parse_steps(relearning_steps),
+                        maximum_interval=maximum_interval,
+                    )
+                    st.success("Settings saved")
+                except ValueError as e:
+                    st.error(str(e))
+
+        # FSRS parameters section
+        st.markdown("---")
+        st.write("Fit FSRS parameters to your review history")
+        if st.button("Optimize parameters"):
+            try:
+                with st.spinner("Fitting parameters..."):
+                    _, initial_loss, final_loss = optimize_deck(st.session_state.manage_db)
+                st.success(f"Parameters saved (log loss {initial_loss:.4f} → {final_loss:.4f})")
+            except ValueError as e:
+                st.warning(str(e))
+
         # delete section
         @st.dialog("⚠️ Confirm deletion")
         def confirm_deletion():
@@ -103,12 +235,14 @@ def database_section():
                     del st.session_state.studying_db
                     study_deck_connection.clear()
                     st.session_state.studying_deck = None
+                close_due_queue(st.session_state.manage_db)
                 st.session_state.manage_db.close()
+                manage_deck_connection.clear()
                 st.session_state.manage_db = None
                 st.session_state.delete_db = True
                 
-                # Delete the database file
-                os.remove(st.session_state.db_path_to_delete)
+                # Delete the database file (o las filas del deck en la base compartida)
+                delete_deck(st.session_state.manage_deck)
                 st.session_state.manage_deck = None
                 st.rerun()
         st.markdown("---")
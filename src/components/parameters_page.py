@@ -1,5 +1,6 @@
 import streamlit as st
 import json
+import torch
 from pathlib import Path
 
 
@@ -16,6 +17,12 @@ def user_preferences():
     else:
         st.title("🔧 Configuración Inicial")
         st.write("Por favor, introduce los ajustes necesarios para comenzar.")
+        cpu_mode = not torch.cuda.is_available()
+        if cpu_mode:
+            st.info(
+                "No se detectó una GPU: el modelo se ejecutará en la CPU, con los pesos base "
+                "(no FP8) en la precisión que elijas. Se recomiendan Qwen3-0.6B o Qwen3-1.7B."
+            )
         with st.form("config_form", clear_on_submit=False):
             model = st.radio(
                 "Selecciona un modelo LLM para generar texto",
@@ -30,10 +37,23 @@ def user_preferences():
                 help="Los modelos pequeños podrían tener problemas para seguir instrucciones, como generar la palabra exacta, y, por lo tanto, tardar más. Los modelos más grandes son mejores siguiendo instrucciones, pudiendo llegar a ser más rápidos. Además al tener vocabulario más amplio, generan textos más ricos y variados. **El modelo Qwen3-4B-FP8 es el que alcanza el mejor equilibrio.**",
             )
             voice = st.pills("Voz", ["femenina", "masculina"], default="femenina")
-            
+            # solo se usa sin GPU (ver `load_text_model`)
+            cpu_precision = "int8"
+            if cpu_mode:
+                cpu_precision = st.radio(
+                    "Precisión del modelo en la CPU",
+                    ["int8", "bfloat16", "float32"],
+                    captions=[
+                        "Más rápido y ocupa menos memoria (recomendado)",
+                        "Si la CPU no lo soporta se usa float32",
+                        "Más lento, sin pérdida de precisión",
+                    ],
+                )
+
             config = {
                 "model": model,
                 "voice": voice,
+                "cpu_precision": cpu_precision,
             }
             submitted = st.form_submit_button("Guardar configuración")
             if submitted:
@@ -1,23 +1,39 @@
-import random
-from dataclasses import dataclass
+import io
+import queue
+from contextlib import closing
+from dataclasses import dataclass, replace
 from datetime import datetime, timezone
 from enum import Enum
+from threading import Condition, Event, Thread
 from typing import List
 
+import pandas as pd
 import streamlit as st
 
-from tools.fsrs_scheduler import learning_scheduler
-from tools.llm_tools import generate_audio, generate_text
+from tools.forecast import forecast_deck
+from tools.fsrs_scheduler import NO_STEP, from_datetime64, to_datetime64
+from tools.importer import import_file
+from tools.llm_tools import generate_audio, generate_paragraphs
+from tools.paragraph_cache import CACHE_AUDIO, CACHE_POLICIES, get_paragraphs, get_prepared_groups, paragraph_key, put_paragraph
+from tools.pregeneration import forget_deck, interactive, remember_config, start_pregeneration
 from tools.sql_tool import (
-    Deck,
+    CardRow,
     add_cards,
+    deck_key,
     deck_selection,
+    due_counts,
+    flush_reviews,
+    get_due_cards,
+    get_deck_stats,
+    get_scheduler,
     new_deck_db,
+    next_due,
+    next_due_cards,
     open_deck,
-    update_card,
+    review_cards,
 )
 from tools.validator_tool import validate_words
-from utils.config import Rating
+from utils.config import MODEL_NAME, Rating, State
 
 """
 we have 3 studying sessions states:
@@ -55,12 +71,15 @@ class StudyConfig:
     group_size: int
     temperature: float
     text_length: str
+    session_limit: int = 50
+    order: str = "random"
+    paragraph_cache: str = "reuse"  # ver CACHE_POLICIES
 
 
 @dataclass
 class Batch:
     words: list[str]
-    cards: list[Deck]
+    cards: list[CardRow]
     text: str
     audio: bytes
 
@@ -86,9 +105,14 @@ def _state():
 
 def reset_session_state(full: bool = False):
     s = _state()
+    # los párrafos que se estaban generando para la sesión anterior ya no hacen falta
+    pipeline = s.pop("pipeline", None)
+    if pipeline is not None:
+        pipeline.cancel()
     s.batches = []
     s.current_index = 0
     s.repeat_counter = 0
+    s.pop("review_again", None)
     if full:
         s.phase = Phase.CONFIG
         s.pop("study_config", None)
@@ -98,36 +122,199 @@ def reset_session_state(full: bool = False):
 ######## ======================= cards section ======================= ########
 ###############################################################################
 
-def _get_overdue_entries_grouped(session, group_size: int) -> List[List[Deck]]:
-    now = datetime.now(timezone.utc)
-    results = session.query(Deck).filter(Deck.due < now).all()
-    random.shuffle(results)
+def _get_overdue_entries_grouped(session, group_size: int, limit: int | None = None, order: str = "random", exclude: set[int] = frozenset()) -> List[List[CardRow]]:
+    limit_with_exclude = None if limit is None else limit + len(exclude)
+    if order == "due":
+        # por vencimiento: los ids salen del índice en memoria del deck, sin recorrer `due`
+        results = next_due_cards(session, limit=limit_with_exclude)
+    else:
+        # la base de datos elige y ordena las tarjetas; solo se cargan las que se van a mostrar
+        results = get_due_cards(session, limit=limit_with_exclude, order=order)
+    # sin las tarjetas que ya tienen grupo (se pidieron de más para compensarlas)
+    results = [card for card in results if card.id not in exclude][:limit]
     # Agrupar de a `group_size` elementos
     return [results[i:i+group_size] for i in range(0, len(results), group_size)]
 
-def build_batches(session, study_config: StudyConfig) -> List[Batch]:
+def _prepared_batches(session, study_config: StudyConfig, limit: int | None) -> List[Batch]:
+    # grupos preparados en segundo plano (ver tools.pregeneration) con todas sus tarjetas vencidas
+    prepared = get_prepared_groups(deck_key(session))
+    if not prepared:
+        return []
+    due = {card.id: card for card in get_due_cards(session, ids=[card_id for _, _, card_ids in prepared for card_id in card_ids])}
+    cached = get_paragraphs([key for _, key, _ in prepared])
+    batches, used = [], set()
+    for _, key, card_ids in prepared:
+        if key not in cached or used.intersection(card_ids) or not all(card_id in due for card_id in card_ids):
+            continue
+        cards = [due[card_id] for card_id in card_ids]
+        words = [card.word for card in cards]
+        # con otra configuración o con palabras editadas el párrafo ya no sirve
+        if key != paragraph_key(MODEL_NAME, study_config.topic, words, study_config.text_length, study_config.temperature):
+            continue
+        if limit is not None and len(used) + len(cards) > limit:
+            break
+        text, audio = cached[key]
+        batches.append(Batch(words=words, cards=cards, text=text, audio=audio))
+        used.update(card_ids)
+    return batches
+
+def _plan_batches(session, study_config: StudyConfig) -> tuple[List[Batch], List[List[CardRow]]]:
+    # lecturas de la base de datos, en el hilo de la sesión: los batches que salen de
+    # la caché (algunos quizá sin audio) y los grupos que hay que generar
     topic = study_config.topic
     group_size = study_config.group_size
     temperature = study_config.temperature
     text_length = study_config.text_length
-    # Obtener tarjetas de la base de datos
-    grouped_cards = _get_overdue_entries_grouped(session, group_size)
-    reordered_words, reordered_cards, texts = generate_text(topic, grouped_cards, temperature, text_length)
-    audios = generate_audio(texts)
-    # all together
+    limit = study_config.session_limit or None
     batches: list[Batch] = []
-    for words, cards, text, audio in zip(
-        reordered_words, reordered_cards, texts, audios
-    ):
-        batches.append(
-            Batch(
-                words=list(words),
-                cards=list(cards),
-                text=text,
-                audio=audio,
-            )
-        )
-    return batches
+    used: set[int] = set()
+    if study_config.paragraph_cache == "reuse":
+        batches = _prepared_batches(session, study_config, limit)
+        used = {card.id for batch in batches for card in batch.cards}
+        if limit is not None and len(used) >= limit:
+            return batches, []
+    # Obtener tarjetas de la base de datos
+    grouped_cards = _get_overdue_entries_grouped(
+        session, group_size, limit=None if limit is None else limit - len(used), order=study_config.order, exclude=used
+    )
+    # párrafos ya generados para el mismo grupo de palabras y la misma configuración
+    if study_config.paragraph_cache == "reuse":
+        keys = [
+            paragraph_key(MODEL_NAME, topic, [card.word for card in cards], text_length, temperature)
+            for cards in grouped_cards
+        ]
+        cached = get_paragraphs(keys)
+        for key, cards in zip(keys, grouped_cards):
+            if key in cached:
+                text, audio = cached[key]
+                batches.append(Batch(words=[card.word for card in cards], cards=list(cards), text=text, audio=audio))
+        grouped_cards = [cards for key, cards in zip(keys, grouped_cards) if key not in cached]
+    return batches, grouped_cards
+
+
+class BatchPipeline:
+    """
+    Arma los `Batch` de una sesión como productor/consumidor.
+
+    Los párrafos de la caché quedan listos en el acto. Los demás los genera un
+    hilo (LLM) que pasa cada párrafo validado al hilo del TTS en cuanto termina,
+    y este agrega el `Batch` a `batches` apenas tiene el audio: la primera
+    tarjeta se puede estudiar mientras se generan las demás.
+    """
+
+    def __init__(self, session, study_config: StudyConfig):
+        self.study_config = study_config
+        # la sesión de estudio usa esta misma lista; aquí solo se agregan elementos al final
+        self.batches: list[Batch] = []
+        # batches listos / esperados (los grupos que no se logran generar se descuentan)
+        self.ready = 0
+        self.total = 0
+        self.error: BaseException | None = None
+        # palabras que ningún párrafo logró incluir (ver `generate_paragraphs`)
+        self.failed_words: list[str] = []
+        self.done = False
+        self._changed = Condition()
+        self._cancelled = Event()
+        # cancela `generate_paragraphs` (ver `cancel_hook`) mientras el hilo de texto espera
+        self._cancel_generation = None
+        self._tts: queue.Queue = queue.Queue()
+        cached, self._groups = _plan_batches(session, study_config)
+        self.total = len(cached) + len(self._groups)
+        for batch in cached:
+            if batch.audio is None:
+                # guardado sin audio: pasa por el TTS
+                self._tts.put((batch, True))
+            else:
+                self._add(batch)
+        Thread(target=self._generate_audio, name="batch-audio", daemon=True).start()
+        Thread(target=self._generate_texts, name="batch-text", daemon=True).start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Espera a que haya un batch para estudiar o a que termine la generación; True si hay alguno."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.batches or self.done, timeout)
+            return bool(self.batches)
+
+    def result(self) -> List[Batch]:
+        """Espera a que terminen todos los batches."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.batches
+
+    def cancel(self):
+        """Deja de generar (p. ej. al reiniciar la sesión); los pedidos pendientes de la cola se liberan en el acto."""
+        with self._changed:
+            self._cancelled.set()
+            cancel_generation = self._cancel_generation
+        if cancel_generation is not None:
+            cancel_generation()
+
+    def _set_cancel_generation(self, cancel_generation):
+        with self._changed:
+            self._cancel_generation = cancel_generation
+            cancelled = self._cancelled.is_set()
+        # `cancel` llegó antes de que empezara la generación
+        if cancelled:
+            cancel_generation()
+
+    def _add(self, batch: Batch):
+        with self._changed:
+            self.batches.append(batch)
+            self.ready += 1
+            self._changed.notify_all()
+
+    def _generate_texts(self):
+        # productor: cada párrafo validado pasa al TTS en cuanto termina
+        config = self.study_config
+        produced = 0
+        try:
+            with closing(generate_paragraphs(
+                config.topic, self._groups, config.temperature, config.text_length,
+                cancel_hook=self._set_cancel_generation, failed_words=self.failed_words,
+            )) as paragraphs:
+                for words, cards, text in paragraphs:
+                    if self._cancelled.is_set():
+                        break
+                    self._tts.put((Batch(words=list(words), cards=list(cards), text=text, audio=None), False))
+                    produced += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._changed:
+                self.total -= len(self._groups) - produced
+            self._tts.put(None)
+
+    def _generate_audio(self):
+        # consumidor: el batch queda listo cuando tiene el audio
+        config = self.study_config
+        # el hilo de pre-generación no usa el modelo mientras se arma la sesión
+        with interactive():
+            while (item := self._tts.get()) is not None:
+                batch, cached = item
+                if self._cancelled.is_set() or self.error is not None:
+                    continue
+                try:
+                    batch.audio = generate_audio([batch.text])[0]
+                    # los guardados sin audio solo se actualizan si la caché guarda audio
+                    if not cached or CACHE_AUDIO:
+                        put_paragraph(
+                            MODEL_NAME, config.topic, batch.words, config.text_length, config.temperature,
+                            batch.text, batch.audio if CACHE_AUDIO else None,
+                        )
+                except Exception as e:
+                    self.error = e
+                    continue
+                self._add(batch)
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+
+def build_batches(session, study_config: StudyConfig) -> List[Batch]:
+    """Todos los batches de la sesión (espera a que termine `BatchPipeline`)."""
+    return BatchPipeline(session, study_config).result()
 
 def _update_index(delta):
     s = st.session_state
@@ -162,56 +349,93 @@ def update_card_state(current_cards, key):
     # Actualizar la tarjeta con el nuevo estado
     keys = {"again": Rating.Again, "easy": Rating.Easy, "good": Rating.Good, "hard": Rating.Hard}
     rating_key = keys[key]
-    for card in current_cards:
-        new_values_card = learning_scheduler(
-            state = card.state,
-            stability = card.stability,
-            difficulty = card.difficulty,
-            rating = rating_key,
-            days_since_last_review = card.days_since_last_review,
-            review_datetime = card.review_datetime,
-            last_review = card.last_review,
-            step = card.step, 
-        )
-        update_card(
-            st.session_state.studying_db,
-            word = card.word,
-            last_review = new_values_card[0],
-            review_datetime = new_values_card[1],
-            days_since_last_review = new_values_card[2],
-            due = new_values_card[3],
-            stability = new_values_card[4],
-            difficulty = new_values_card[5],
-            state = new_values_card[6],
-            rating = new_values_card[7],
-            step = new_values_card[8]
-        )
+    now = datetime.now(timezone.utc)
+    # todas las tarjetas del grupo se programan en una sola pasada
+    (
+        last_reviews,
+        review_datetimes,
+        days_since_last_reviews,
+        dues,
+        stabilities,
+        difficulties,
+        states,
+        _,
+        steps,
+    ) = get_scheduler(st.session_state.studying_db).review_many(
+        state = [card.state for card in current_cards],
+        stability = [card.stability for card in current_cards],
+        difficulty = [card.difficulty for card in current_cards],
+        step = [NO_STEP if card.step is None else card.step for card in current_cards],
+        last_review = to_datetime64([card.last_review for card in current_cards]),
+        rating = rating_key,
+        now = now,
+    )
+    # tarjetas e historial quedan en el buffer del deck y se escriben juntos
+    review_cards(
+        st.session_state.studying_db,
+        current_cards,
+        rating = rating_key,
+        last_review = from_datetime64(last_reviews),
+        review_datetime = from_datetime64(review_datetimes),
+        days_since_last_review = [int(days) for days in days_since_last_reviews],
+        due = from_datetime64(dues),
+        stability = [float(stability) for stability in stabilities],
+        difficulty = [float(difficulty) for difficulty in difficulties],
+        state = [State(state) for state in states],
+        step = [None if step == NO_STEP else int(step) for step in steps],
+    )
     if key == "again":
         s.repeat_counter += 1
 
 
+@st.fragment(run_every=2)
+def _render_pipeline_status(pipeline: BatchPipeline):
+    # se actualiza sola; las tarjetas nuevas aparecen al navegar o calificar
+    if not pipeline.done:
+        st.caption(f"Paragraphs ready: {pipeline.ready}/{pipeline.total}, generating the rest...")
+
+
 def render_cards(study_config: StudyConfig, state):
     s = state
     
     # Cargar tarjetas solo si no están en el estado o es nueva fase
     if s.phase == Phase.ACTIVE:
-        # Obtener tarjetas de la base de datos
-        s.batches = build_batches(
-            s.studying_db,
-            study_config
-        )
+        if s.pop("review_again", False):
+            # las tarjetas calificadas con Again vuelven por el índice de vencimientos
+            study_config = replace(study_config, order="due")
+        # los batches se agregan a `s.batches` a medida que se generan
+        s.pipeline = BatchPipeline(s.studying_db, study_config)
+        s.batches = s.pipeline.batches
         s.phase = Phase.STUDYING
 
+    pipeline = s.get("pipeline")
+    if pipeline is not None:
+        if not s.batches and not pipeline.done:
+            with st.spinner("Generating paragraphs..."):
+                pipeline.wait()
+        if pipeline.error is not None:
+            st.warning(f"Some paragraphs could not be generated: {pipeline.error}")
+        if pipeline.failed_words:
+            st.warning(f"Could not include these words in a paragraph: {', '.join(pipeline.failed_words)}")
+        _render_pipeline_status(pipeline)
+
     cards_len = len(s.batches)
     # Si no hay tarjetas y no tenemos un contador de repeticiones
     # significa que hemos terminado la sesión de estudio
     if cards_len == 0:
+        # fin del grupo: las calificaciones pendientes se escriben ahora
+        flush_reviews(s.studying_db)
         if s.repeat_counter == 0:
             st.success("You've finished your study session for now, congratulations! 🎉")
         else:
             st.success("Continue with the review 💪🏻")
+            next_card_due = next_due(s.studying_db)
+            if next_card_due is not None and next_card_due > datetime.now(timezone.utc):
+                minutes = (next_card_due - datetime.now(timezone.utc)).total_seconds() / 60
+                st.caption(f"Next card due in {minutes:.0f} min")
             if st.button("Review Again"):
                 s.repeat_counter = 0
+                s.review_again = True
                 s.phase = Phase.ACTIVE
                 st.rerun()
         return
@@ -263,8 +487,10 @@ def db_panel(state):
             st.write("Enter Database Name")
             db_name = st.text_input("Database Name")
             if st.button("Create Database"):
-                new_deck_db(db_name)
-                st.success(f"Database {db_name} created")
+                if new_deck_db(db_name) == "deck already exists":
+                    st.warning(f"Database {db_name} already exists")
+                else:
+                    st.success(f"Database {db_name} created")
 
         with col2:
             current_deck = s.get("studying_deck")
@@ -278,11 +504,26 @@ def db_panel(state):
                 if deck != current_deck:
                     # limpieza de la base de datos anterior
                     if s.get("studying_db") is not None:
+                        flush_reviews(s.studying_db)
                         s.get("studying_db").close()
                     s.studying_deck = deck
                     s.studying_db = study_deck_connection(deck)
                     reset_session_state(full=True)
                 st.write(f"Deck activo: {deck}")
+            counts = due_counts()
+            if counts:
+                st.caption(f"Cards due across shared decks: {sum(counts.values())}")
+
+
+def render_deck_stats(session):
+    stats = get_deck_stats(session)
+    cols = st.columns(4)
+    cols[0].metric("Cards", f"{stats.total:,}")
+    cols[1].metric("Due today", f"{stats.due_today:,}")
+    cols[2].metric("Overdue", f"{stats.overdue:,}")
+    cols[3].metric("Mean difficulty", "-" if stats.mean_difficulty is None else f"{stats.mean_difficulty:.1f}")
+    st.caption(" · ".join(f"{name}: {count:,}" for name, count in stats.by_state.items()))
+    st.bar_chart(pd.Series(stats.stability_histogram, name="cards"), x_label="stability", y_label="cards")
 
 
 def render_add_words_panel(state):
@@ -300,11 +541,51 @@ def render_add_words_panel(state):
                 add_cards(s.studying_db, words=valid_words)
                 st.success("Words successfully added")
 
+        uploaded = st.file_uploader(
+            "or import a word list (CSV, TSV or Anki text export)", type=["csv", "tsv", "txt"]
+        )
+        # streamlit vuelve a entregar el archivo en cada rerun, importarlo una sola vez
+        if uploaded is not None and st.session_state.get("imported_file_id") != uploaded.file_id:
+            with st.spinner("Importing words..."):
+                report = import_file(s.studying_db, io.TextIOWrapper(uploaded, encoding="utf-8-sig"))
+            st.session_state.imported_file_id = uploaded.file_id
+            st.success(f"{report.added} words added, {report.duplicates} duplicates skipped")
+            if report.invalid:
+                st.warning(f"{report.invalid} invalid words skipped: {', '.join(report.invalid_examples)}")
+
+
+def render_forecast_panel(state):
+    s = state
+    with st.expander("Review forecast", icon=":material/monitoring:"):
+        horizon = st.segmented_control(
+            "Days ahead", [30, 90, 365], default=30, key="forecast_horizon"
+        )
+        # la simulación corre solo al pedirla, no en cada rerun de la pestaña
+        if st.button("Run forecast", disabled=horizon is None):
+            with st.spinner("Simulating reviews..."):
+                s.forecast = deck_key(s.studying_db), horizon, forecast_deck(s.studying_db, horizon_days=horizon)
+        if s.get("forecast") is None or s.forecast[:2] != (deck_key(s.studying_db), horizon):
+            return
+        forecast = s.forecast[2]
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Expected reviews", f"{forecast.reviews.sum():,.0f}")
+        with col2:
+            st.metric("Study time per day", f"{forecast.study_minutes.mean():.0f} min")
+        st.bar_chart(
+            pd.DataFrame(
+                {"reviews": forecast.reviews, "minutes": forecast.study_minutes},
+                index=pd.to_datetime(forecast.dates),
+            ),
+            y="reviews",
+        )
+
 
 def render_config_panel(state):
     s = state
     with st.expander("Start studying the words", icon=":material/book:", expanded=True):
         st.markdown(f"Database: **{s.studying_deck}**")
+        render_deck_stats(s.studying_db)
         st.markdown("---")
         st.markdown("### Select your study parameters")
 
@@ -324,6 +605,21 @@ def render_config_panel(state):
             )
             text_length = st.pills("Select text length generation", ["short", "medium", "long"], selection_mode="single", default="short"
             )
+            session_limit = st.number_input(
+                "Cards per session", min_value=0, value=50, step=10,
+                help="0 = all due cards",
+            )
+            order = st.selectbox(
+                "Card order",
+                ["random", "due", "priority"],
+                format_func={"random": "Random", "due": "Oldest due first", "priority": "Most at risk first"}.get,
+            )
+            paragraph_cache = st.selectbox(
+                "Paragraphs",
+                CACHE_POLICIES,
+                format_func={"reuse": "Reuse saved paragraphs", "fresh": "Always generate new ones"}.get,
+                help="Saved paragraphs are reused when the words, topic, length and temperature match.",
+            )
             submitted = st.form_submit_button("Start Studying")
 
         if submitted:
@@ -332,8 +628,16 @@ def render_config_panel(state):
                 group_size=group_size,
                 temperature=temperature,
                 text_length=text_length,
+                session_limit=int(session_limit),
+                order=order,
+                paragraph_cache=paragraph_cache,
             )
             s.study_config = config
+            # los párrafos de las próximas sesiones del deck se preparan con esta configuración
+            if config.paragraph_cache == "reuse":
+                remember_config(s.studying_deck, config.topic, config.group_size, config.temperature, config.text_length)
+            else:
+                forget_deck(s.studying_deck)
             reset_session_state(full=False)
             s.phase = Phase.ACTIVE
             st.rerun()
@@ -343,6 +647,7 @@ def render_studying_session(state):
     s = state
     render_cards(study_config=s.study_config, state=s)
     if st.button("Restart Study"):
+        flush_reviews(s.studying_db)
         reset_session_state(full=True)
         st.rerun()
 
@@ -352,10 +657,12 @@ def render_studying_session(state):
 
 def study_section():
     s = _state()
+    start_pregeneration()
     db_panel(state = s)
     if "studying_db" not in s:
         return
     render_add_words_panel(state = s)
+    render_forecast_panel(state = s)
     if s.phase == Phase.CONFIG:
         render_config_panel(state = s)
     else:
@@ -0,0 +1,126 @@
+"""
+Migración de los archivos `db/<nombre>.db` (un deck por archivo) a la base de
+datos compartida (`SHARED_DB_PATH`).
+
+Cada archivo se copia con ATTACH + INSERT ... SELECT en una sola transacción:
+tarjetas, historial de repasos (con los ids de tarjeta nuevos) y configuración.
+Después el archivo se renombra a `<nombre>.db.migrated` para que deje de
+aparecer en la lista de decks.
+
+Uso (desde src/):
+    python -m tools.deck_migration [archivos ...] [--keep]
+"""
+
+from __future__ import annotations
+import argparse
+import sys
+from pathlib import Path
+from typing import Iterable
+
+from sqlalchemy import insert
+
+from tools.review_buffer import flush_all
+from tools.sql_tool import (
+    SHARED_DB_PATH,
+    Deck,
+    DeckConfig,
+    DeckInfo,
+    close_engine,
+    deck_engine,
+    shared_deck_id,
+)
+
+MIGRATED_SUFFIX = ".migrated"
+
+
+def _columns(table, exclude=()) -> list[str]:
+    return [column.name for column in table.columns if column.name not in exclude]
+
+
+def migrate_deck_file(db_path: Path, archive: bool = True) -> int:
+    """
+    Copia un archivo de deck a la base de datos compartida con el nombre del archivo.
+
+    :param archive: renombrar el archivo a `.db.migrated` al terminar.
+    :return: número de tarjetas copiadas.
+    :raises ValueError: si ya existe un deck con ese nombre en la base compartida.
+    """
+    db_path = Path(db_path)
+    name = db_path.stem
+    if shared_deck_id(name) is not None:
+        raise ValueError(f"Deck {name!r} already exists in the shared database")
+    # calificaciones pendientes en disco y esquema del archivo al día antes de copiarlo
+    flush_all()
+    deck_engine(db_path)
+    close_engine(db_path)
+
+    card_columns = ", ".join(_columns(Deck.__table__, exclude=("id", "deck_id")))
+    config_columns = ", ".join(_columns(DeckConfig.__table__, exclude=("id",)))
+    engine, _ = deck_engine(SHARED_DB_PATH)
+    with engine.connect() as conn:
+        # ATTACH y DETACH no pueden ir dentro de una transacción
+        conn.exec_driver_sql("ATTACH DATABASE ? AS source", (str(db_path),))
+        conn.commit()
+        try:
+            deck_id = conn.execute(insert(DeckInfo).values(name=name)).inserted_primary_key[0]
+            copied = conn.exec_driver_sql(
+                f"INSERT INTO deck (deck_id, {card_columns}) "
+                f"SELECT ?, {card_columns} FROM source.deck ORDER BY id",
+                (deck_id,),
+            ).rowcount
+            # las tarjetas tienen ids nuevos: el historial se enlaza por palabra
+            conn.exec_driver_sql(
+                "INSERT INTO review_log (card_id, ts, rating, elapsed_days) "
+                "SELECT card.id, log.ts, log.rating, log.elapsed_days "
+                "FROM source.review_log AS log "
+                "JOIN source.deck AS old_card ON old_card.id = log.card_id "
+                "JOIN deck AS card ON card.deck_id = ? AND card.word = old_card.word "
+                "ORDER BY log.id",
+                (deck_id,),
+            )
+            conn.exec_driver_sql(
+                f"INSERT INTO deck_config (id, {config_columns}) "
+                f"SELECT ?, {config_columns} FROM source.deck_config WHERE id = 1",
+                (deck_id,),
+            )
+            conn.commit()
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql("DETACH DATABASE source")
+            conn.commit()
+    if archive:
+        db_path.rename(db_path.with_name(db_path.name + MIGRATED_SUFFIX))
+    return copied
+
+
+def migrate_deck_files(paths: Iterable[Path] | None = None, archive: bool = True) -> dict[str, int | str]:
+    """
+    Migra varios archivos de deck (por defecto todos los `db/*.db`).
+
+    :return: por deck, las tarjetas copiadas o el motivo por el que se omitió.
+    """
+    if paths is None:
+        paths = sorted(Path("db").glob("*.db"))
+    report = {}
+    for path in paths:
+        try:
+            report[Path(path).stem] = migrate_deck_file(path, archive=archive)
+        except ValueError as e:
+            report[Path(path).stem] = str(e)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", type=Path, help="archivos de deck (por defecto db/*.db)")
+    parser.add_argument("--keep", action="store_true", help="no renombrar los archivos migrados")
+    args = parser.parse_args(argv)
+
+    report = migrate_deck_files(args.files or None, archive=not args.keep)
+    for name, result in report.items():
+        print(f"{name}: {result}")
+    return 0 if all(isinstance(result, int) for result in report.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Exportación e importación de decks en formato columnar (Parquet o Feather).
+
+Las tarjetas y, opcionalmente, el historial de repasos se escriben en
+archivos separados, por bloques (`chunk_size` filas) para que la memoria no
+crezca con el deck. `State` y `Rating` se guardan como enteros pequeños y las
+fechas como timestamps UTC, así los archivos se pueden abrir directamente con
+`pandas.read_parquet` / `pandas.read_feather`.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import Column, Integer, MetaData, Table, insert, literal, select, update
+
+from tools.sql_tool import Deck, ReviewLog, close_due_queue, flush_reviews, session_deck_id
+
+CHUNK_SIZE = 50_000
+FORMATS = ("parquet", "feather")
+
+_TIMESTAMP = pa.timestamp("us", tz="UTC")
+CARD_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("word", pa.string()),
+    ("last_review", _TIMESTAMP),
+    ("review_datetime", _TIMESTAMP),
+    ("days_since_last_review", pa.int32()),
+    ("due", _TIMESTAMP),
+    ("stability", pa.float64()),
+    ("difficulty", pa.float64()),
+    ("state", pa.int8()),
+    ("rating", pa.int8()),
+    ("step", pa.int16()),
+])
+HISTORY_SCHEMA = pa.schema([
+    ("card_id", pa.int64()),
+    ("ts", pa.timestamp("s", tz="UTC")),
+    ("rating", pa.int8()),
+    ("elapsed_days", pa.int32()),
+])
+
+
+def _file_format(target, file_format: str | None) -> str:
+    # por la extensión del archivo (ruta o archivo subido) si no se indica
+    if file_format is None:
+        name = str(getattr(target, "name", target))
+        file_format = "feather" if Path(name).suffix.lower() in (".feather", ".arrow") else "parquet"
+    if file_format not in FORMATS:
+        raise ValueError(f"file_format must be one of {FORMATS}")
+    return file_format
+
+
+class _BatchWriter:
+    """Escribe RecordBatches en Parquet o Feather (Arrow IPC) sin juntar todo en memoria."""
+
+    def __init__(self, sink, schema: pa.Schema, file_format: str):
+        if file_format == "parquet":
+            self._writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        else:
+            self._writer = pa.ipc.new_file(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    def write(self, batch: pa.RecordBatch):
+        if batch.num_rows:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        self._writer.close()
+
+
+def _read_batches(source, file_format: str, chunk_size: int):
+    if file_format == "parquet":
+        yield from pq.ParquetFile(source).iter_batches(batch_size=chunk_size)
+    else:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            yield reader.get_batch(i)
+
+
+def _card_batch(rows) -> pa.RecordBatch:
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(CARD_SCHEMA, columns):
+        if field.name in ("state", "rating"):
+            values = [None if value is None else int(value) for value in values]
+        # las fechas naive de la base de datos están en UTC, como asume pyarrow
+        arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=CARD_SCHEMA)
+
+
+def export_deck(
+    session,
+    cards_sink,
+    history_sink=None,
+    file_format: str | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> tuple[int, int]:
+    """
+    Exporta las tarjetas del deck (y el historial si se indica `history_sink`).
+
+    :param cards_sink: ruta o archivo binario de destino de las tarjetas.
+    :param file_format: "parquet" o "feather"; por defecto según la extensión.
+    :return: (tarjetas, repasos) exportados.
+    """
+    file_format = _file_format(cards_sink, file_format)
+    flush_reviews(session)
+    deck_id = session_deck_id(session)
+    table = Deck.__table__
+
+    cards = 0
+    writer = _BatchWriter(cards_sink, CARD_SCHEMA, file_format)
+    try:
+        query = (
+            select(*(table.c[name] for name in CARD_SCHEMA.names))
+            .where(table.c.deck_id == deck_id)
+            .order_by(table.c.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        for rows in session.execute(query).partitions():
+            writer.write(_card_batch(rows))
+            cards += len(rows)
+    finally:
+        writer.close()
+
+    reviews = 0
+    if history_sink is not None:
+        writer = _BatchWriter(history_sink, HISTORY_SCHEMA, file_format)
+        try:
+            query = (
+                select(ReviewLog.card_id, ReviewLog.ts, ReviewLog.rating, ReviewLog.elapsed_days)
+                .join(Deck, Deck.id == ReviewLog.card_id)
+                .where(Deck.deck_id == deck_id)
+                .order_by(ReviewLog.id)
+                .execution_options(yield_per=chunk_size)
+            )
+            for rows in session.execute(query).partitions():
+                card_ids, ts, ratings, elapsed_days = zip(*rows)
+                writer.write(pa.RecordBatch.from_arrays(
+                    [
+                        pa.array(card_ids, pa.int64()),
+                        pa.array(ts, pa.int64()).cast(HISTORY_SCHEMA.field("ts").type),
+                        pa.array(ratings, pa.int8()),
+                        pa.array(elapsed_days, pa.int32()),
+                    ],
+                    schema=HISTORY_SCHEMA,
+                ))
+                reviews += len(rows)
+        finally:
+            writer.close()
+    return cards, reviews
+
+
+def _staging_tables() -> tuple[Table, Table]:
+    metadata = MetaData()
+    staging = Table(
+        "snapshot_cards",
+        metadata,
+        Column("old_id", Integer, primary_key=True),
+        # 1 si la palabra ya estaba en el deck: la tarjeta no se importa y su historial tampoco
+        Column("existing", Integer, nullable=False, server_default="0"),
+        *(Column(column.name, column.type) for column in Deck.__table__.columns if column.name not in ("id", "deck_id")),
+        prefixes=["TEMPORARY"],
+    )
+    staging_log = Table(
+        "snapshot_review_log",
+        metadata,
+        Column("seq", Integer, primary_key=True),
+        *(Column(column.name, column.type) for column in ReviewLog.__table__.columns if column.name != "id"),
+        prefixes=["TEMPORARY"],
+    )
+    return staging, staging_log
+
+
+def _insert_columns(conn, table: Table, columns: dict[str, list]) -> None:
+    # executemany directo al driver: los valores pasan por el bind processor de cada
+    # tipo columna por columna, sin el costo por fila de un insert() de SQLAlchemy
+    processed = []
+    for name, values in columns.items():
+        processor = table.c[name].type.dialect_impl(conn.dialect).bind_processor(conn.dialect)
+        processed.append(values if processor is None else [processor(value) for value in values])
+    names = ", ".join(columns)
+    marks = ", ".join("?" * len(columns))
+    conn.exec_driver_sql(f"INSERT INTO {table.name} ({names}) VALUES ({marks})", list(zip(*processed)))
+
+
+def import_deck(
+    session,
+    cards_source,
+    history_source=None,
+    file_format: str | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> tuple[int, int]:
+    """
+    Importa un snapshot en el deck de la sesión con inserciones por bloques, en una transacción.
+
+    Las palabras que ya están en el deck se conservan como están y su historial
+    del snapshot se omite (reimportar no lo duplica). El historial de las
+    tarjetas agregadas se enlaza por palabra (los ids del snapshot no se reutilizan).
+
+    :return: (tarjetas, repasos) agregados.
+    """
+    file_format = _file_format(cards_source, file_format)
+    flush_reviews(session)
+    deck_id = session_deck_id(session)
+    conn = session.connection()
+    # las filas se cargan primero en tablas temporales (executemany sin triggers) y
+    # pasan a `deck` y `review_log` con un solo INSERT ... SELECT cada una
+    staging, staging_log = _staging_tables()
+    for table in (staging, staging_log):
+        # las tablas temporales de una importación fallida siguen en la conexión
+        table.drop(conn, checkfirst=True)
+        table.create(conn)
+    try:
+        for batch in _read_batches(cards_source, file_format, chunk_size):
+            columns = {name: batch.column(name).to_pylist() for name in batch.schema.names}
+            columns["old_id"] = columns.pop("id")
+            _insert_columns(conn, staging, columns)
+        card = Deck.__table__
+        conn.execute(
+            update(staging)
+            .where(select(card.c.id).where(card.c.deck_id == deck_id, card.c.word == staging.c.word).exists())
+            .values(existing=1)
+        )
+        card_columns = [column.name for column in staging.columns if column.name not in ("old_id", "existing")]
+        cards = conn.execute(
+            insert(Deck.__table__).prefix_with("OR IGNORE").from_select(
+                ["deck_id", *card_columns],
+                select(literal(deck_id), *(staging.c[name] for name in card_columns)).order_by(staging.c.old_id),
+            )
+        ).rowcount
+
+        reviews = 0
+        if history_source is not None:
+            for batch in _read_batches(history_source, _file_format(history_source, file_format), chunk_size):
+                columns = {name: batch.column(name).to_pylist() for name in batch.schema.names}
+                # `ts` se guarda en segundos desde epoch
+                columns["ts"] = batch.column("ts").cast(pa.int64()).to_pylist()
+                _insert_columns(conn, staging_log, columns)
+            # el historial se enlaza por palabra con los ids nuevos, solo el de las tarjetas
+            # agregadas: reimportar en el mismo deck no duplica el historial
+            reviews = conn.execute(
+                insert(ReviewLog).from_select(
+                    ["card_id", "ts", "rating", "elapsed_days"],
+                    select(card.c.id, staging_log.c.ts, staging_log.c.rating, staging_log.c.elapsed_days)
+                    .join(staging, staging.c.old_id == staging_log.c.card_id)
+                    .join(card, (card.c.deck_id == deck_id) & (card.c.word == staging.c.word))
+                    .where(staging.c.existing == 0)
+                    .order_by(staging_log.c.seq),
+                )
+            ).rowcount
+        staging_log.drop(conn)
+        staging.drop(conn)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    # el índice de vencimientos se vuelve a cargar con las tarjetas nuevas
+    close_due_queue(session)
+    return cards, reviews
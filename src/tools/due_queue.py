@@ -0,0 +1,121 @@
+"""
+Índice en memoria de las tarjetas de un deck ordenadas por `due`.
+
+Se carga una vez por deck abierto y se mantiene al día desde las funciones de
+escritura de `sql_tool`, así la sesión de estudio no necesita recorrer la
+tabla para saber qué tarjetas vencieron.
+"""
+
+from __future__ import annotations
+import heapq
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Iterable
+
+
+def _timestamp(due: datetime) -> float:
+    # las fechas leídas de SQLite vienen sin zona horaria y están en UTC
+    if due.tzinfo is None:
+        due = due.replace(tzinfo=timezone.utc)
+    return due.timestamp()
+
+
+class DueQueue:
+    """
+    Heap de (due, card_id) con borrado perezoso.
+
+    Actualizar una tarjeta agrega una entrada nueva; la anterior queda obsoleta
+    y se descarta al llegar a la cima del heap.
+    """
+
+    def __init__(self, entries: Iterable[tuple[int, datetime | None]] = ()):
+        self._due: dict[int, float] = {}
+        for card_id, due in entries:
+            if due is not None:
+                self._due[card_id] = _timestamp(due)
+        self._heap = [(ts, card_id) for card_id, ts in self._due.items()]
+        heapq.heapify(self._heap)
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def push(self, card_id: int, due: datetime | None) -> None:
+        """Agrega una tarjeta o cambia su fecha de vencimiento."""
+        with self._lock:
+            if due is None:
+                self._due.pop(card_id, None)
+                return
+            ts = _timestamp(due)
+            if self._due.get(card_id) == ts:
+                return
+            self._due[card_id] = ts
+            heapq.heappush(self._heap, (ts, card_id))
+            self._compact()
+
+    def remove(self, card_id: int) -> None:
+        with self._lock:
+            self._due.pop(card_id, None)
+            self._compact()
+
+    def _compact(self) -> None:
+        # reconstruye el heap cuando las entradas obsoletas superan a las válidas
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [(ts, card_id) for card_id, ts in self._due.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_valid(self) -> tuple[float, int] | None:
+        while self._heap:
+            ts, card_id = heapq.heappop(self._heap)
+            if self._due.get(card_id) == ts:
+                return ts, card_id
+        return None
+
+    def next_due(self, limit: int | None = None, now: datetime | None = None) -> list[int]:
+        """
+        Ids de las próximas `limit` tarjetas por orden de vencimiento, en O(k log n).
+
+        :param now: si se indica, solo las tarjetas vencidas antes de ese momento.
+        """
+        deadline = None if now is None else _timestamp(now)
+        taken = []
+        with self._lock:
+            while limit is None or len(taken) < limit:
+                entry = self._pop_valid()
+                if entry is None:
+                    break
+                if deadline is not None and entry[0] >= deadline:
+                    heapq.heappush(self._heap, entry)
+                    break
+                taken.append(entry)
+            for entry in taken:
+                heapq.heappush(self._heap, entry)
+        return [card_id for _, card_id in taken]
+
+    def peek(self) -> datetime | None:
+        """Fecha de vencimiento más próxima."""
+        with self._lock:
+            entry = self._pop_valid()
+            if entry is None:
+                return None
+            heapq.heappush(self._heap, entry)
+        return datetime.fromtimestamp(entry[0], tz=timezone.utc)
+
+
+# un índice por deck abierto (clave: URL de la base de datos)
+_queues: dict[str, DueQueue] = {}
+_queues_lock = Lock()
+
+
+def loaded_queue(key: str) -> DueQueue | None:
+    return _queues.get(key)
+
+
+def register_queue(key: str, queue: DueQueue) -> DueQueue:
+    with _queues_lock:
+        return _queues.setdefault(key, queue)
+
+
+def discard_queue(key: str) -> None:
+    with _queues_lock:
+        _queues.pop(key, None)
@@ -0,0 +1,237 @@
+"""
+Pronóstico de la carga de repasos de un deck.
+
+Simula (Monte Carlo) los repasos futuros de todas las tarjetas con el mismo
+programador FSRS que usa la app y devuelve cuántos repasos habrá cada día y
+el tiempo de estudio esperado.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from threading import Lock
+
+import numpy as np
+from sqlalchemy import select
+
+from tools.fsrs_scheduler import NO_STEP, Scheduler, to_datetime64
+from tools.sql_tool import Deck, deck_key, deck_version, get_scheduler, pending_reviews, session_deck_id
+from utils.fsrs_config import DECAY, FACTOR, State
+
+# probabilidades de calificación (Again, Hard, Good, Easy) en aprendizaje
+LEARNING_RATING_PROB = (0.24, 0.094, 0.495, 0.171)
+# probabilidades de (Hard, Good, Easy) cuando se recuerda una tarjeta en Review
+REVIEW_RATING_PROB = (0.224, 0.631, 0.145)
+# segundos por repaso según la calificación (Again, Hard, Good, Easy)
+LEARNING_COSTS = (33.79, 24.3, 13.68, 6.5)
+REVIEW_COSTS = (23.0, 11.68, 7.33, 5.6)
+
+# límite de pasadas por día simulado (pasos de aprendizaje de minutos)
+_MAX_SAME_DAY_PASSES = 10
+_US_PER_DAY = 86_400_000_000
+_CACHE_SIZE = 32
+
+
+@dataclass(frozen=True)
+class Forecast:
+    dates: np.ndarray          # datetime64[D], un elemento por día
+    reviews: np.ndarray        # repasos esperados por día
+    study_minutes: np.ndarray  # minutos de estudio esperados por día
+
+
+@dataclass
+class DeckColumns:
+    state: np.ndarray
+    stability: np.ndarray
+    difficulty: np.ndarray
+    step: np.ndarray
+    last_review: np.ndarray
+    due: np.ndarray
+
+
+_cache: OrderedDict = OrderedDict()
+_cache_lock = Lock()
+_COLUMNS = ("state", "stability", "difficulty", "step", "last_review", "due")
+
+
+def load_deck_columns(session, pending: dict[int, dict] | None = None) -> DeckColumns:
+    """
+    Carga en una sola consulta las columnas de programación del deck.
+
+    :param pending: calificaciones sin escribir (ver `pending_reviews`); reemplazan
+        a las filas leídas, así no hace falta escribir el buffer antes.
+    """
+    table = Deck.__table__
+    rows = session.execute(
+        select(table.c.id, *(table.c[name] for name in _COLUMNS)).where(Deck.deck_id == session_deck_id(session))
+    ).all()
+    if pending:
+        rows = [
+            (row[0], *(pending[row[0]][name] for name in _COLUMNS)) if row[0] in pending else row
+            for row in rows
+        ]
+    _, state, stability, difficulty, step, last_review, due = zip(*rows) if rows else ((),) * (len(_COLUMNS) + 1)
+    return DeckColumns(
+        state=np.array(state, dtype=np.int64),
+        stability=np.array(stability, dtype=np.float64),
+        difficulty=np.array(difficulty, dtype=np.float64),
+        step=np.array([NO_STEP if value is None else value for value in step], dtype=np.int64),
+        last_review=to_datetime64(last_review),
+        due=to_datetime64(due),
+    )
+
+
+def _sample_ratings(rng, state, stability, last_review, review_datetime):
+    n = state.shape[0]
+    ratings = rng.choice(4, size=n, p=LEARNING_RATING_PROB) + 1
+    costs = np.asarray(LEARNING_COSTS)[ratings - 1]
+
+    review = (state == State.Review) & ~np.isnat(last_review)
+    if review.any():
+        elapsed_days = np.maximum(
+            (review_datetime[review] - last_review[review]).astype(np.int64) // _US_PER_DAY, 0
+        )
+        retrievability = (1 + FACTOR * elapsed_days / stability[review]) ** DECAY
+        recalled = rng.random(retrievability.shape[0]) < retrievability
+        review_ratings = np.where(
+            recalled,
+            rng.choice(3, size=recalled.shape[0], p=REVIEW_RATING_PROB) + 2,
+            1,
+        )
+        ratings[review] = review_ratings
+        costs[review] = np.asarray(REVIEW_COSTS)[review_ratings - 1]
+    return ratings, costs
+
+
+def simulate_reviews(
+    columns: DeckColumns,
+    horizon_days: int = 365,
+    n_simulations: int = 4,
+    seed: int = 0,
+    start: datetime | None = None,
+    scheduler: Scheduler | None = None,
+) -> Forecast:
+    """
+    Simula los repasos de las tarjetas durante `horizon_days` días.
+
+    Cada día se repasan todas las tarjetas vencidas; las calificaciones se
+    muestrean a partir de la retrievability de cada tarjeta y el nuevo estado se
+    calcula con `Scheduler.review_many`. Las `n_simulations` corridas se
+    vectorizan juntas y el resultado es su promedio.
+
+    :param columns: columnas del deck, ver `load_deck_columns`.
+    :param scheduler: programador del deck; por defecto uno con la configuración estándar.
+    """
+    if start is None:
+        start = datetime.now(timezone.utc)
+    if scheduler is None:
+        scheduler = Scheduler()
+    start = to_datetime64([start])[0]
+    first_day = start.astype("datetime64[D]")
+    dates = first_day + np.arange(horizon_days)
+
+    rng = np.random.default_rng(seed)
+    n = columns.state.shape[0]
+    sim_index = np.repeat(np.arange(n_simulations), n)
+    state = np.tile(columns.state, n_simulations)
+    stability = np.tile(columns.stability, n_simulations)
+    difficulty = np.tile(columns.difficulty, n_simulations)
+    step = np.tile(columns.step, n_simulations)
+    last_review = np.tile(columns.last_review, n_simulations)
+    due = np.tile(columns.due, n_simulations)
+
+    reviews = np.zeros((n_simulations, horizon_days))
+    seconds = np.zeros((n_simulations, horizon_days))
+
+    # las tarjetas atrasadas (o sin fecha) se repasan hoy
+    due[np.isnat(due) | (due < start)] = start
+
+    # sin piso de stability, muchos Again seguidos pueden llevarla a 0
+    with np.errstate(divide="ignore", over="ignore"):
+        for day in range(horizon_days):
+            day_end = (first_day + day + 1).astype("datetime64[us]")
+            for _ in range(_MAX_SAME_DAY_PASSES):
+                idx = np.flatnonzero(due < day_end)
+                if idx.size == 0:
+                    break
+                review_datetime = due[idx]
+                ratings, costs = _sample_ratings(
+                    rng, state[idx], stability[idx], last_review[idx], review_datetime
+                )
+                (
+                    last_review[idx],
+                    _,
+                    _,
+                    due[idx],
+                    stability[idx],
+                    difficulty[idx],
+                    state[idx],
+                    _,
+                    step[idx],
+                ) = scheduler.review_many(
+                    state=state[idx],
+                    stability=stability[idx],
+                    difficulty=difficulty[idx],
+                    step=step[idx],
+                    last_review=last_review[idx],
+                    rating=ratings,
+                    now=review_datetime,
+                )
+                reviews[:, day] += np.bincount(sim_index[idx], minlength=n_simulations)
+                seconds[:, day] += np.bincount(sim_index[idx], weights=costs, minlength=n_simulations)
+            else:
+                # lo que no se repasó hoy queda para mañana
+                due[due < day_end] = day_end
+
+    return Forecast(
+        dates=dates,
+        reviews=reviews.mean(axis=0),
+        study_minutes=seconds.mean(axis=0) / 60,
+    )
+
+
+def forecast_deck(
+    session,
+    horizon_days: int = 365,
+    n_simulations: int = 4,
+    seed: int = 0,
+) -> Forecast:
+    """
+    Pronostica los repasos diarios de un deck.
+
+    El resultado se guarda en caché por deck y se reutiliza mientras el deck no
+    cambie: la clave lleva el contador de escrituras del deck (`deck_version`),
+    las calificaciones que siguen en el buffer, la configuración del programador
+    (la fila de `DeckConfig`) y el día de inicio. El buffer no se escribe.
+    """
+    today = datetime.now(timezone.utc).date()
+    scheduler = get_scheduler(session)
+    pending = pending_reviews(session)
+    key = (
+        deck_key(session),
+        deck_version(session),
+        frozenset((card_id, row["review_datetime"]) for card_id, row in pending.items()),
+        repr(scheduler.settings()),
+        today,
+        horizon_days,
+        n_simulations,
+        seed,
+    )
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    forecast = simulate_reviews(
+        load_deck_columns(session, pending),
+        horizon_days=horizon_days,
+        n_simulations=n_simulations,
+        seed=seed,
+        scheduler=scheduler,
+    )
+    with _cache_lock:
+        _cache[key] = forecast
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return forecast
@@ -0,0 +1,233 @@
+"""
+Ajuste de los pesos FSRS de un deck a partir de su historial de repasos.
+
+Reproduce en PyTorch las mismas transiciones de `learning_scheduler` y
+minimiza la log-loss entre la retrievability predicha y si la tarjeta se
+recordó (cualquier calificación distinta de Again). Las secuencias de
+repasos se procesan por lotes de tarjetas, todas las tarjetas del lote en
+paralelo paso a paso.
+
+Solo se ajustan los pesos w6-w18. w0-w5 dan en FSRS el estado de una tarjeta
+nueva, pero la app crea todas las tarjetas con `INITIAL_CARDS_VALUES` y el
+programador no los lee: cada secuencia empieza desde esos valores.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+import torch
+from sqlalchemy import select
+
+from tools.sql_tool import Deck, ReviewLog, flush_reviews, get_parameters, save_parameters, session_deck_id
+from utils.fsrs_config import DEFAULT_PARAMETERS, DECAY, FACTOR, INITIAL_CARDS_VALUES, Rating
+
+# límites de cada peso durante el ajuste
+PARAMETER_BOUNDS = (
+    (0.001, 100.0),
+    (0.001, 100.0),
+    (0.001, 100.0),
+    (0.001, 100.0),
+    (1.0, 10.0),
+    (0.001, 4.0),
+    (0.001, 4.0),
+    (0.001, 0.75),
+    (0.0, 4.5),
+    (0.0, 0.8),
+    (0.001, 3.5),
+    (0.001, 5.0),
+    (0.001, 0.25),
+    (0.001, 0.9),
+    (0.0, 4.0),
+    (0.0, 1.0),
+    (1.0, 6.0),
+    (0.0, 2.0),
+    (0.0, 2.0),
+)
+
+# pesos que se ajustan (ver la descripción del módulo)
+FITTED_PARAMETERS = slice(6, 19)
+
+# mínimo de repasos con al menos un día transcurrido para ajustar
+MIN_REVIEWS = 100
+_STABILITY_MIN = 0.01
+
+
+def load_review_sequences(session) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Carga el historial del deck como secuencias por tarjeta.
+
+    :return: (ratings, elapsed_days, lengths); los dos primeros con forma
+        (tarjetas, repasos máximos) y rellenos con 0 tras el final de cada secuencia.
+    """
+    flush_reviews(session)
+    rows = session.execute(
+        select(ReviewLog.card_id, ReviewLog.rating, ReviewLog.elapsed_days)
+        .join(Deck, Deck.id == ReviewLog.card_id)
+        .where(Deck.deck_id == session_deck_id(session))
+        .order_by(ReviewLog.card_id, ReviewLog.ts, ReviewLog.id)
+    ).all()
+    if not rows:
+        empty = np.zeros((0, 0), dtype=np.int64)
+        return empty, empty, np.zeros(0, dtype=np.int64)
+
+    card_ids, ratings, elapsed_days = (np.asarray(column, dtype=np.int64) for column in zip(*rows))
+    _, starts, lengths = np.unique(card_ids, return_index=True, return_counts=True)
+    card_index = np.repeat(np.arange(lengths.shape[0]), lengths)
+    position = np.arange(card_ids.shape[0]) - np.repeat(starts, lengths)
+
+    padded_ratings = np.zeros((lengths.shape[0], lengths.max()), dtype=np.int64)
+    padded_elapsed = np.zeros_like(padded_ratings)
+    padded_ratings[card_index, position] = ratings
+    padded_elapsed[card_index, position] = elapsed_days
+    return padded_ratings, padded_elapsed, lengths
+
+
+def _sequence_loss(w: torch.Tensor, ratings: torch.Tensor, elapsed_days: torch.Tensor, mask: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
+    """Suma de la log-loss y número de repasos evaluados para un lote de secuencias."""
+    batch_size, max_length = ratings.shape
+    # estado inicial de una tarjeta nueva
+    stability = torch.full((batch_size,), INITIAL_CARDS_VALUES["stability"], dtype=w.dtype)
+    difficulty = torch.full((batch_size,), INITIAL_CARDS_VALUES["difficulty"], dtype=w.dtype)
+
+    total_loss = torch.zeros((), dtype=w.dtype)
+    total_count = torch.zeros((), dtype=w.dtype)
+    for t in range(max_length):
+        rating = ratings[:, t]
+        elapsed = elapsed_days[:, t]
+        active = mask[:, t]
+        long_term = elapsed >= 1
+
+        retrievability = (1 + FACTOR * elapsed / stability) ** DECAY
+        retrievability = retrievability.clamp(1e-4, 1 - 1e-4)
+        recalled = (rating > Rating.Again).to(w.dtype)
+        evaluated = (active & long_term).to(w.dtype)
+        loss = -(recalled * torch.log(retrievability) + (1 - recalled) * torch.log(1 - retrievability))
+        total_loss = total_loss + (loss * evaluated).sum()
+        total_count = total_count + evaluated.sum()
+
+        short_term_stability = stability * torch.exp(w[17] * (rating - 3 + w[18]))
+        forget_stability = torch.minimum(
+            w[11]
+            * difficulty ** -w[12]
+            * ((stability + 1) ** w[13] - 1)
+            * torch.exp((1 - retrievability) * w[14]),
+            stability / torch.exp(w[17] * w[18]),
+        )
+        hard_penalty = torch.where(rating == Rating.Hard, w[15], torch.ones_like(w[15]))
+        easy_bonus = torch.where(rating == Rating.Easy, w[16], torch.ones_like(w[16]))
+        recall_stability = stability * (
+            1
+            + torch.exp(w[8])
+            * (11 - difficulty)
+            * stability ** -w[9]
+            * (torch.exp((1 - retrievability) * w[10]) - 1)
+            * hard_penalty
+            * easy_bonus
+        )
+        next_stability = torch.where(
+            long_term,
+            torch.where(rating == Rating.Again, forget_stability, recall_stability),
+            short_term_stability,
+        ).clamp(min=_STABILITY_MIN)
+
+        delta_difficulty = -(w[6] * (rating - 3))
+        next_difficulty = w[7] * difficulty + (1 - w[7]) * (
+            difficulty + (10.0 - difficulty) * delta_difficulty / 9.0
+        )
+        next_difficulty = next_difficulty.clamp(1.0, 10.0)
+
+        stability = torch.where(active, next_stability, stability)
+        difficulty = torch.where(active, next_difficulty, difficulty)
+
+    return total_loss, total_count
+
+
+def _clamp_parameters(w: torch.Tensor) -> None:
+    with torch.no_grad():
+        for i, (low, high) in enumerate(PARAMETER_BOUNDS[FITTED_PARAMETERS]):
+            w[i].clamp_(low, high)
+
+
+def _batches(lengths: np.ndarray, batch_size: int) -> list[np.ndarray]:
+    # agrupar tarjetas de longitud parecida reduce el relleno
+    order = np.argsort(lengths, kind="stable")
+    return [order[i:i + batch_size] for i in range(0, order.shape[0], batch_size)]
+
+
+def _total_loss(w, batches) -> float:
+    with torch.no_grad():
+        loss, count = zip(*(_sequence_loss(w, *batch) for batch in batches))
+    return float(sum(loss) / max(float(sum(count)), 1.0))
+
+
+def fit_parameters(
+    ratings: np.ndarray,
+    elapsed_days: np.ndarray,
+    lengths: np.ndarray,
+    initial_parameters = DEFAULT_PARAMETERS,
+    epochs: int = 5,
+    batch_size: int = 1024,
+    learning_rate: float = 4e-2,
+    seed: int = 0,
+) -> tuple[tuple, float, float]:
+    """
+    Ajusta los pesos FSRS w6-w18 a las secuencias de repasos; w0-w5 se devuelven
+    como en `initial_parameters`.
+
+    :return: (pesos, loss inicial, loss final). Si el ajuste no mejora la loss
+        se devuelven los pesos iniciales.
+    """
+    generator = torch.Generator().manual_seed(seed)
+
+    def to_batch(index):
+        length = int(lengths[index].max())
+        batch_ratings = torch.from_numpy(ratings[index, :length])
+        batch_elapsed = torch.from_numpy(elapsed_days[index, :length]).to(torch.float64)
+        mask = torch.arange(length)[None, :] < torch.from_numpy(lengths[index])[:, None]
+        return batch_ratings, batch_elapsed, mask
+
+    batches = [to_batch(index) for index in _batches(lengths, batch_size)]
+
+    initial = torch.tensor(initial_parameters, dtype=torch.float64)
+    fitted = initial[FITTED_PARAMETERS].clone().requires_grad_(True)
+
+    def weights():
+        return torch.cat([initial[:FITTED_PARAMETERS.start], fitted])
+
+    initial_loss = _total_loss(weights(), batches)
+    optimizer = torch.optim.Adam([fitted], lr=learning_rate)
+    for _ in range(epochs):
+        for i in torch.randperm(len(batches), generator=generator).tolist():
+            optimizer.zero_grad()
+            loss, count = _sequence_loss(weights(), *batches[i])
+            if count == 0:
+                continue
+            (loss / count).backward()
+            optimizer.step()
+            _clamp_parameters(fitted)
+
+    w = weights().detach()
+    final_loss = _total_loss(w, batches)
+    if not final_loss < initial_loss:
+        return tuple(initial_parameters), initial_loss, initial_loss
+    return (
+        tuple(initial_parameters[:FITTED_PARAMETERS.start]) + tuple(round(float(x), 5) for x in w[FITTED_PARAMETERS]),
+        initial_loss,
+        final_loss,
+    )
+
+
+def optimize_deck(session, **kwargs) -> tuple[tuple, float, float]:
+    """
+    Ajusta los pesos FSRS del deck con su historial y los guarda en el deck.
+
+    :raises ValueError: si el historial es demasiado corto.
+    """
+    ratings, elapsed_days, lengths = load_review_sequences(session)
+    mask = np.arange(ratings.shape[1])[None, :] < lengths[:, None]
+    if int(((elapsed_days >= 1) & mask).sum()) < MIN_REVIEWS:
+        raise ValueError(f"At least {MIN_REVIEWS} reviews after one day or more are needed")
+    kwargs.setdefault("initial_parameters", get_parameters(session))
+    parameters, initial_loss, final_loss = fit_parameters(ratings, elapsed_days, lengths, **kwargs)
+    save_parameters(session, parameters)
+    return parameters, initial_loss, final_loss
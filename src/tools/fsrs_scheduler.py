@@ -6,24 +6,31 @@ from __future__ import annotations
 import math
 from datetime import datetime, timezone, timedelta
 
-from utils.config import DEFAULT_PARAMETERS, DECAY, FACTOR, \
+import numpy as np
+
+from utils.fsrs_config import DEFAULT_PARAMETERS, DECAY, FACTOR, \
     State, Rating
 
+DEFAULT_DESIRED_RETENTION = 0.9
+DEFAULT_LEARNING_STEPS = (timedelta(minutes=1), timedelta(minutes=10))
+DEFAULT_RELEARNING_STEPS = (timedelta(minutes=10),)
+DEFAULT_MAXIMUM_INTERVAL = 36500
+
 
-def _short_term_stability(stability: float, rating: Rating) -> float:
+def _short_term_stability(stability: float, rating: Rating, parameters: tuple = DEFAULT_PARAMETERS) -> float:
     return stability * (
-        math.e ** (DEFAULT_PARAMETERS[17] * (rating - 3 + DEFAULT_PARAMETERS[18]))
+        math.e ** (parameters[17] * (rating - 3 + parameters[18]))
     )
 
-def _next_difficulty(difficulty: float, rating: Rating) -> float:
+def _next_difficulty(difficulty: float, rating: Rating, parameters: tuple = DEFAULT_PARAMETERS) -> float:
     def _linear_damping(delta_difficulty: float, difficulty: float) -> float:
         return (10.0 - difficulty) * delta_difficulty / 9.0
 
     def _mean_reversion(arg_1: float, arg_2: float) -> float:
-        return DEFAULT_PARAMETERS[7] * arg_1 + (1 - DEFAULT_PARAMETERS[7]) * arg_2
+        return parameters[7] * arg_1 + (1 - parameters[7]) * arg_2
 
     arg_1 = difficulty
-    delta_difficulty = -(DEFAULT_PARAMETERS[6] * (rating - 3))
+    delta_difficulty = -(parameters[6] * (rating - 3))
     arg_2 = difficulty + _linear_damping(
         delta_difficulty=delta_difficulty, difficulty=difficulty
     )
@@ -50,12 +57,13 @@ def _next_interval(desired_retention: float, maximum_interval: int, stability: f
 
     return next_interval
 
-def _next_stability(difficulty: float, stability: float, retrievability: float, rating: Rating) -> float:
+def _next_stability(difficulty: float, stability: float, retrievability: float, rating: Rating, parameters: tuple = DEFAULT_PARAMETERS) -> float:
     if rating == Rating.Again:
         next_stability = _next_forget_stability(
             difficulty=difficulty,
             stability=stability,
             retrievability=retrievability,
+            parameters=parameters,
         )
 
     elif rating in (Rating.Hard, Rating.Good, Rating.Easy):
@@ -64,6 +72,7 @@ def _next_stability(difficulty: float, stability: float, retrievability: float,
             stability=stability,
             retrievability=retrievability,
             rating=rating,
+            parameters=parameters,
         )
 
     return next_stability
@@ -80,16 +89,16 @@ def get_retrievability(stability: float, current_datetime: datetime | None, last
 
     return (1 + FACTOR * elapsed_days / stability) ** DECAY
 
-def _next_forget_stability(difficulty: float, stability: float, retrievability: float) -> float:
+def _next_forget_stability(difficulty: float, stability: float, retrievability: float, parameters: tuple = DEFAULT_PARAMETERS) -> float:
     next_forget_stability_long_term_params = (
-        DEFAULT_PARAMETERS[11]
-        * (difficulty ** -DEFAULT_PARAMETERS[12])
-        * (((stability + 1) ** (DEFAULT_PARAMETERS[13])) - 1)
-        * (math.e ** ((1 - retrievability) * DEFAULT_PARAMETERS[14]))
+        parameters[11]
+        * (difficulty ** -parameters[12])
+        * (((stability + 1) ** (parameters[13])) - 1)
+        * (math.e ** ((1 - retrievability) * parameters[14]))
     )
 
     next_forget_stability_short_term_params = stability / (
-        math.e ** (DEFAULT_PARAMETERS[17] * DEFAULT_PARAMETERS[18])
+        math.e ** (parameters[17] * parameters[18])
     )
 
     return min(
@@ -97,16 +106,16 @@ def _next_forget_stability(difficulty: float, stability: float, retrievability:
         next_forget_stability_short_term_params,
     )
 
-def _next_recall_stability(difficulty: float, stability: float, retrievability: float, rating: Rating) -> float:
-    hard_penalty = DEFAULT_PARAMETERS[15] if rating == Rating.Hard else 1
-    easy_bonus = DEFAULT_PARAMETERS[16] if rating == Rating.Easy else 1
+def _next_recall_stability(difficulty: float, stability: float, retrievability: float, rating: Rating, parameters: tuple = DEFAULT_PARAMETERS) -> float:
+    hard_penalty = parameters[15] if rating == Rating.Hard else 1
+    easy_bonus = parameters[16] if rating == Rating.Easy else 1
 
     return stability * (
         1
-        + (math.e ** (DEFAULT_PARAMETERS[8]))
+        + (math.e ** (parameters[8]))
         * (11 - difficulty)
-        * (stability ** -DEFAULT_PARAMETERS[9])
-        * ((math.e ** ((1 - retrievability) * DEFAULT_PARAMETERS[10])) - 1)
+        * (stability ** -parameters[9])
+        * ((math.e ** ((1 - retrievability) * parameters[10])) - 1)
         * hard_penalty
         * easy_bonus
     )
@@ -121,10 +130,11 @@ def learning_scheduler(
     review_datetime,
     last_review,
     step,
-    desired_retention = 0.9,
-    learning_steps = (timedelta(minutes=1), timedelta(minutes=10)),
-    re_learning_steps = (timedelta(minutes=10)),
-    maximum_interval = 36500
+    desired_retention = DEFAULT_DESIRED_RETENTION,
+    learning_steps = DEFAULT_LEARNING_STEPS,
+    re_learning_steps = DEFAULT_RELEARNING_STEPS,
+    maximum_interval = DEFAULT_MAXIMUM_INTERVAL,
+    parameters = DEFAULT_PARAMETERS
 ):
 
     if review_datetime is None:
@@ -140,11 +150,12 @@ def learning_scheduler(
         # update the card's stability and difficulty
         if  days_since_last_review is not None and days_since_last_review < 1:
             stability = _short_term_stability(
-                stability=stability, rating=rating
+                stability=stability, rating=rating, parameters=parameters
             )
             difficulty = _next_difficulty(
                 difficulty= difficulty,
-                rating=rating
+                rating=rating,
+                parameters=parameters
             )
 
         else:
@@ -157,9 +168,10 @@ def learning_scheduler(
                     stability=stability
                 ),
                 rating=rating,
+                parameters=parameters,
             )
             difficulty = _next_difficulty(
-                difficulty=difficulty, rating=rating
+                difficulty=difficulty, rating=rating, parameters=parameters
             )
 
         step = 0 if step is None else step
@@ -216,10 +228,10 @@ def learning_scheduler(
         # update the card's stability and difficulty
         if days_since_last_review is not None and days_since_last_review < 1:
             stability = _short_term_stability(
-                stability=stability, rating=rating
+                stability=stability, rating=rating, parameters=parameters
             )
             difficulty = _next_difficulty(
-                difficulty=difficulty, rating=rating
+                difficulty=difficulty, rating=rating, parameters=parameters
             )
 
         else:
@@ -227,13 +239,17 @@ def learning_scheduler(
                 difficulty=difficulty,
                 stability=stability,
                 retrievability=get_retrievability(
-                    current_datetime=review_datetime
+                    current_datetime=review_datetime,
+                    last_review=last_review,
+                    stability=stability
                 ),
                 rating=rating,
+                parameters=parameters,
             )
             difficulty = _next_difficulty(
                 difficulty=difficulty,
-                rating=rating
+                rating=rating,
+                parameters=parameters
             )
 
         # calculate the card's next interval
@@ -257,10 +273,10 @@ def learning_scheduler(
         # update the card's stability and difficulty
         if days_since_last_review is not None and days_since_last_review < 1:
             stability = _short_term_stability(
-                stability=stability, rating=rating
+                stability=stability, rating=rating, parameters=parameters
             )
             difficulty = _next_difficulty(
-                difficulty=difficulty, rating=rating
+                difficulty=difficulty, rating=rating, parameters=parameters
             )
 
         else:
@@ -268,18 +284,25 @@ def learning_scheduler(
                 difficulty=difficulty,
                 stability=stability,
                 retrievability= get_retrievability(
-                    current_datetime=review_datetime
+                    current_datetime=review_datetime,
+                    last_review=last_review,
+                    stability=stability
                 ),
                 rating=rating,
+                parameters=parameters,
             )
             difficulty = _next_difficulty(
-                difficulty=difficulty, rating=rating
+                difficulty=difficulty, rating=rating, parameters=parameters
             )
 
+        step = 0 if step is None else step
+
         # calculate the card's next interval
         ## first if-clause handles edge case where the Card in the Relearning state was previously
         ## scheduled with a Scheduler with more relearning_steps than the current Scheduler
-        if (step >= len(re_learning_steps)
+        ## (or with relearning steps when the current Scheduler has none)
+        if len(re_learning_steps) == 0 or (
+            step >= len(re_learning_steps)
             and rating in (Rating.Hard, Rating.Good, Rating.Easy)
         ):
             state = State.Review
@@ -328,4 +351,509 @@ def learning_scheduler(
     due = review_datetime + next_interval
     last_review = review_datetime
 
-    return last_review, review_datetime, days_since_last_review, due, stability, difficulty, state, rating, step
\ No newline at end of file
+    return last_review, review_datetime, days_since_last_review, due, stability, difficulty, state, rating, step
+
+################################################################################
+# ============================ Vectorized scheduler =========================== #
+################################################################################
+
+# `step` se guarda como entero; -1 representa `None` (tarjetas en Review)
+NO_STEP = -1
+
+_US_PER_DAY = 86_400_000_000
+
+# hasta este tamaño `Scheduler.review_many` califica tarjeta por tarjeta
+PER_CARD_LIMIT = 32
+
+
+def to_datetime64(values) -> np.ndarray:
+    """
+    Convierte una secuencia de datetimes (o None) a un array datetime64[us].
+    Los datetimes con zona horaria se pasan a UTC; los naive se asumen UTC.
+    None se convierte en NaT.
+    """
+    return np.array(
+        [
+            None if value is None
+            else value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo is not None
+            else value
+            for value in values
+        ],
+        dtype="datetime64[us]",
+    )
+
+
+def from_datetime64(values: np.ndarray) -> list[datetime | None]:
+    """Convierte un array datetime64 a una lista de datetimes UTC (NaT -> None)."""
+    return [
+        None if value is None else value.replace(tzinfo=timezone.utc)
+        for value in values.astype("datetime64[us]").astype(object)
+    ]
+
+
+def _steps_to_us(steps) -> np.ndarray:
+    return np.array([step // timedelta(microseconds=1) for step in steps], dtype=np.int64)
+
+
+# los miembros de los enums como int: compararlos con arrays es más barato que con el enum
+_AGAIN, _HARD, _GOOD, _EASY = (int(rating) for rating in (Rating.Again, Rating.Hard, Rating.Good, Rating.Easy))
+_LEARNING, _REVIEW, _RELEARNING = (int(state) for state in (State.Learning, State.Review, State.Relearning))
+
+
+def _to_us(interval: timedelta | None) -> int:
+    return 0 if interval is None else interval // timedelta(microseconds=1)
+
+
+# numpy evalúa pow con rutinas SIMD que pueden diferir en el último bit de
+# libm; para obtener exactamente los mismos floats que el camino escalar las
+# potencias se calculan con math.pow elemento a elemento.
+_pow_ufunc = np.frompyfunc(math.pow, 2, 1)
+
+
+def _pow(base, exponent) -> np.ndarray:
+    return _pow_ufunc(base, exponent).astype(np.float64)
+
+
+def learning_scheduler_batch(
+    state,
+    stability,
+    difficulty,
+    step,
+    last_review,
+    rating,
+    review_datetime = None,
+    desired_retention = DEFAULT_DESIRED_RETENTION,
+    learning_steps = DEFAULT_LEARNING_STEPS,
+    re_learning_steps = DEFAULT_RELEARNING_STEPS,
+    maximum_interval = DEFAULT_MAXIMUM_INTERVAL,
+    parameters = DEFAULT_PARAMETERS
+):
+    """
+    Versión vectorizada de `learning_scheduler` para muchas tarjetas a la vez.
+    Construye un `Scheduler` en cada llamada y siempre usa el camino de numpy;
+    para calificar varias veces con la misma configuración conviene usar
+    `Scheduler.review_many`.
+
+    Recibe columnas en lugar de una tarjeta y devuelve los mismos valores que
+    `learning_scheduler` (con `days_since_last_review=None`), pero como arrays:
+    (last_review, review_datetime, days_since_last_review, due, stability,
+    difficulty, state, rating, step).
+
+    :param state: array de `State` (enteros).
+    :param stability: array de floats.
+    :param difficulty: array de floats.
+    :param step: array de enteros, `NO_STEP` equivale a None.
+    :param last_review: array datetime64 (NaT si la tarjeta nunca se revisó), ver `to_datetime64`.
+    :param rating: `Rating` único o array de `Rating` (enteros).
+    :param review_datetime: datetime o datetime64 de la revisión; por defecto ahora (UTC).
+    :param parameters: pesos FSRS del deck (19 valores).
+    """
+    return Scheduler(
+        parameters=parameters,
+        desired_retention=desired_retention,
+        learning_steps=learning_steps,
+        re_learning_steps=re_learning_steps,
+        maximum_interval=maximum_interval,
+    )._review_columns(state, stability, difficulty, step, last_review, rating, review_datetime)
+
+
+################################################################################
+# ============================== Deck scheduler =============================== #
+################################################################################
+
+
+def validate_steps(learning_steps, re_learning_steps) -> None:
+    """
+    Comprueba los pasos de un programador: al menos un paso de aprendizaje y
+    todos mayores que cero (los de reaprendizaje pueden quedar vacíos).
+
+    :raises ValueError: si los pasos no son válidos.
+    """
+    if len(learning_steps) == 0:
+        raise ValueError("At least one learning step is required")
+    if any(step <= timedelta(0) for step in (*learning_steps, *re_learning_steps)):
+        raise ValueError("Steps must be greater than zero")
+
+
+def _as_utc(value: datetime) -> datetime:
+    # las fechas leídas de SQLite vienen sin zona horaria y están en UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class Scheduler:
+    """
+    Programador FSRS de un deck.
+
+    Se construye una vez con la configuración del deck y precalcula todas las
+    constantes que `learning_scheduler` y `learning_scheduler_batch` recalculan
+    en cada llamada. Da los mismos resultados que ambas.
+    """
+
+    __slots__ = (
+        "parameters",
+        "desired_retention",
+        "learning_steps",
+        "re_learning_steps",
+        "maximum_interval",
+        "_short_term_factors",
+        "_delta_difficulty",
+        "_mean_reversion_weight",
+        "_forget_short_term_divisor",
+        "_recall_factor",
+        "_interval_factor",
+        "_learning_hard_interval",
+        "_relearning_hard_interval",
+        "_short_term_factor_array",
+        "_delta_difficulty_array",
+        "_learning_steps_us",
+        "_relearning_steps_us",
+        "_learning_hard_us",
+        "_relearning_hard_us",
+    )
+
+    def __init__(
+        self,
+        parameters = DEFAULT_PARAMETERS,
+        desired_retention: float = DEFAULT_DESIRED_RETENTION,
+        learning_steps = DEFAULT_LEARNING_STEPS,
+        re_learning_steps = DEFAULT_RELEARNING_STEPS,
+        maximum_interval: int = DEFAULT_MAXIMUM_INTERVAL,
+    ):
+        validate_steps(learning_steps, re_learning_steps)
+        self.parameters = tuple(parameters)
+        self.desired_retention = desired_retention
+        self.learning_steps = tuple(learning_steps)
+        self.re_learning_steps = tuple(re_learning_steps)
+        self.maximum_interval = maximum_interval
+
+        w = self.parameters
+        # indexados por Rating (la posición 0 no se usa)
+        self._short_term_factors = tuple(
+            math.e ** (w[17] * (rating - 3 + w[18])) for rating in range(5)
+        )
+        self._delta_difficulty = tuple(-(w[6] * (rating - 3)) for rating in range(5))
+        self._mean_reversion_weight = 1 - w[7]
+        self._forget_short_term_divisor = math.e ** (w[17] * w[18])
+        self._recall_factor = math.e ** (w[8])
+        self._interval_factor = (desired_retention ** (1 / DECAY)) - 1
+        self._learning_hard_interval = self._hard_interval(self.learning_steps)
+        self._relearning_hard_interval = self._hard_interval(self.re_learning_steps)
+        # lo mismo para `review_many`
+        self._short_term_factor_array = np.array(self._short_term_factors)
+        self._delta_difficulty_array = np.array(self._delta_difficulty)
+        self._learning_steps_us = _steps_to_us(self.learning_steps)
+        self._relearning_steps_us = _steps_to_us(self.re_learning_steps)
+        self._learning_hard_us = _to_us(self._learning_hard_interval)
+        self._relearning_hard_us = _to_us(self._relearning_hard_interval)
+
+    @staticmethod
+    def _hard_interval(steps) -> timedelta | None:
+        if len(steps) == 1:
+            return steps[0] * 1.5
+        if len(steps) >= 2:
+            return (steps[0] + steps[1]) / 2.0
+        return None
+
+    @classmethod
+    def from_settings(cls, settings: dict) -> Scheduler:
+        """Construye el programador a partir de `settings()` (pasos en segundos)."""
+        return cls(
+            parameters=settings["parameters"],
+            desired_retention=settings["desired_retention"],
+            learning_steps=tuple(timedelta(seconds=s) for s in settings["learning_steps"]),
+            re_learning_steps=tuple(timedelta(seconds=s) for s in settings["relearning_steps"]),
+            maximum_interval=settings["maximum_interval"],
+        )
+
+    def settings(self) -> dict:
+        return {
+            "parameters": list(self.parameters),
+            "desired_retention": self.desired_retention,
+            "learning_steps": [step.total_seconds() for step in self.learning_steps],
+            "relearning_steps": [step.total_seconds() for step in self.re_learning_steps],
+            "maximum_interval": self.maximum_interval,
+        }
+
+    def _next_interval(self, stability: float) -> timedelta:
+        next_interval = round(float((stability / FACTOR) * self._interval_factor))
+        return timedelta(days=min(max(next_interval, 1), self.maximum_interval))
+
+    def _next_stability(self, difficulty: float, stability: float, days: int, rating: Rating) -> float:
+        w = self.parameters
+        if days < 1:
+            return stability * self._short_term_factors[rating]
+
+        retrievability = (1 + FACTOR * max(0, days) / stability) ** DECAY
+        if rating == _AGAIN:
+            return min(
+                w[11]
+                * (difficulty ** -w[12])
+                * (((stability + 1) ** (w[13])) - 1)
+                * (math.e ** ((1 - retrievability) * w[14])),
+                stability / self._forget_short_term_divisor,
+            )
+        hard_penalty = w[15] if rating == _HARD else 1
+        easy_bonus = w[16] if rating == _EASY else 1
+        return stability * (
+            1
+            + self._recall_factor
+            * (11 - difficulty)
+            * (stability ** -w[9])
+            * ((math.e ** ((1 - retrievability) * w[10])) - 1)
+            * hard_penalty
+            * easy_bonus
+        )
+
+    def _next_difficulty(self, difficulty: float, rating: Rating) -> float:
+        arg_2 = difficulty + (10.0 - difficulty) * self._delta_difficulty[rating] / 9.0
+        next_difficulty = self.parameters[7] * difficulty + self._mean_reversion_weight * arg_2
+        return min(max(next_difficulty, 1.0), 10.0)
+
+    def _step(self, steps, hard_interval, state, step, rating, stability):
+        """Pasos de Learning/Relearning; devuelve (state, step, next_interval)."""
+        if len(steps) == 0 or (step >= len(steps) and rating != _AGAIN):
+            return State.Review, None, self._next_interval(stability)
+        if rating == _AGAIN:
+            return state, 0, steps[0]
+        if rating == _HARD:
+            return state, step, hard_interval if step == 0 else steps[step]
+        if rating == _GOOD and step + 1 != len(steps):
+            return state, step + 1, steps[step + 1]
+        # Good en el último paso o Easy
+        return State.Review, None, self._next_interval(stability)
+
+    def review(self, card, rating: Rating, now: datetime | None = None) -> tuple:
+        """
+        Califica una tarjeta (cualquier objeto con state, stability, difficulty,
+        step y last_review, p. ej. `Deck`).
+
+        :return: los mismos valores que `learning_scheduler`.
+        """
+        review_datetime = datetime.now(timezone.utc) if now is None else now
+        last_review = review_datetime if card.last_review is None else card.last_review
+        if (last_review.tzinfo is None) != (review_datetime.tzinfo is None):
+            last_review, review_datetime = _as_utc(last_review), _as_utc(review_datetime)
+        days_since_last_review = (review_datetime - last_review).days
+
+        stability, difficulty, state, step, next_interval = self._review_card(
+            card.state, card.stability, card.difficulty, card.step, days_since_last_review, rating
+        )
+        return (
+            review_datetime,
+            review_datetime,
+            days_since_last_review,
+            review_datetime + next_interval,
+            stability,
+            difficulty,
+            state,
+            rating,
+            step,
+        )
+
+    def _review_card(self, state, stability, difficulty, step, days: int, rating) -> tuple:
+        """Núcleo de `review`; devuelve (stability, difficulty, state, step, next_interval)."""
+        new_stability = self._next_stability(difficulty, stability, days, rating)
+        new_difficulty = self._next_difficulty(difficulty, rating)
+
+        # una tarjeta en Learning o Relearning sin paso está en el primero
+        if state == _LEARNING:
+            state, step, next_interval = self._step(
+                self.learning_steps, self._learning_hard_interval,
+                state, 0 if step is None else step, rating, new_stability,
+            )
+        elif state == _RELEARNING:
+            state, step, next_interval = self._step(
+                self.re_learning_steps, self._relearning_hard_interval,
+                state, 0 if step is None else step, rating, new_stability,
+            )
+        elif rating == _AGAIN and self.re_learning_steps:
+            state, step, next_interval = State.Relearning, 0, self.re_learning_steps[0]
+        else:
+            next_interval = self._next_interval(new_stability)
+        return new_stability, new_difficulty, state, step, next_interval
+
+    def _next_interval_many(self, stability: np.ndarray) -> np.ndarray:
+        next_interval = (stability / FACTOR) * self._interval_factor
+        # np.rint redondea al par más cercano, igual que round()
+        next_interval = np.rint(next_interval).astype(np.int64)
+        return np.minimum(np.maximum(next_interval, 1), self.maximum_interval)
+
+    def _next_stability_many(self, difficulty: np.ndarray, stability: np.ndarray, days: np.ndarray, rating: np.ndarray) -> np.ndarray:
+        short_term = days < 1
+        if short_term.all():
+            # caso habitual al estudiar: todas repasadas hoy
+            return stability * self._short_term_factor_array[rating]
+
+        w = self.parameters
+        next_stability = np.empty_like(stability)
+        next_stability[short_term] = stability[short_term] * self._short_term_factor_array[rating[short_term]]
+
+        long_term = ~short_term
+        d, s, g = difficulty[long_term], stability[long_term], rating[long_term]
+        r = _pow(1 + FACTOR * days[long_term] / s, DECAY)
+        forget = g == _AGAIN
+        recall = ~forget
+        long_term_stability = np.empty_like(s)
+
+        fd, fs, fr = d[forget], s[forget], r[forget]
+        long_term_stability[forget] = np.minimum(
+            w[11]
+            * _pow(fd, -w[12])
+            * (_pow(fs + 1, w[13]) - 1)
+            * _pow(math.e, (1 - fr) * w[14]),
+            fs / self._forget_short_term_divisor,
+        )
+
+        rd, rs, rr, rg = d[recall], s[recall], r[recall], g[recall]
+        hard_penalty = np.where(rg == _HARD, w[15], 1.0)
+        easy_bonus = np.where(rg == _EASY, w[16], 1.0)
+        long_term_stability[recall] = rs * (
+            1
+            + self._recall_factor
+            * (11 - rd)
+            * _pow(rs, -w[9])
+            * (_pow(math.e, (1 - rr) * w[10]) - 1)
+            * hard_penalty
+            * easy_bonus
+        )
+        next_stability[long_term] = long_term_stability
+        return next_stability
+
+    def _next_difficulty_many(self, difficulty: np.ndarray, rating: np.ndarray) -> np.ndarray:
+        arg_2 = difficulty + (10.0 - difficulty) * self._delta_difficulty_array[rating] / 9.0
+        next_difficulty = self.parameters[7] * difficulty + self._mean_reversion_weight * arg_2
+        return np.minimum(np.maximum(next_difficulty, 1.0), 10.0)
+
+    def review_many(self, state, stability, difficulty, step, last_review, rating, now=None) -> tuple:
+        """
+        Versión por columnas de `review`; recibe y devuelve arrays como
+        `learning_scheduler_batch`.
+
+        Los grupos de hasta `PER_CARD_LIMIT` tarjetas (los de una sesión de
+        estudio) se califican de a una con el núcleo de `review`: con pocas
+        tarjetas las operaciones de numpy cuestan más que el cálculo. Ambos
+        caminos dan los mismos resultados.
+        """
+        return self._review_columns(
+            state, stability, difficulty, step, last_review, rating, now, per_card_limit=PER_CARD_LIMIT
+        )
+
+    def _review_columns(self, state, stability, difficulty, step, last_review, rating, now=None, per_card_limit: int = 0) -> tuple:
+        state = np.asarray(state, dtype=np.int64)
+        n = state.shape[0]
+        stability = np.asarray(stability, dtype=np.float64)
+        difficulty = np.asarray(difficulty, dtype=np.float64)
+        step = np.asarray(step, dtype=np.int64)
+        rating = np.broadcast_to(np.asarray(rating, dtype=np.int64), (n,))
+        last_review = np.asarray(last_review, dtype="datetime64[us]")
+
+        review_datetime = datetime.now(timezone.utc) if now is None else now
+        if isinstance(review_datetime, datetime):
+            review_datetime = to_datetime64([review_datetime])[0]
+        review_datetime = np.broadcast_to(
+            np.asarray(review_datetime, dtype="datetime64[us]"), (n,)
+        )
+
+        # las tarjetas sin revisión previa se tratan como revisadas ahora
+        last_review = np.where(np.isnat(last_review), review_datetime, last_review)
+        days_since_last_review = (review_datetime - last_review).astype(np.int64) // _US_PER_DAY
+
+        review = self._review_each if n <= per_card_limit else self._review_vectorized
+        new_stability, new_difficulty, new_state, new_step, interval_us = review(
+            state, stability, difficulty, step, days_since_last_review, rating
+        )
+        due = review_datetime + interval_us.astype("timedelta64[us]")
+
+        return (
+            review_datetime.copy(),
+            review_datetime.copy(),
+            days_since_last_review,
+            due,
+            new_stability,
+            new_difficulty,
+            new_state,
+            rating.copy(),
+            new_step,
+        )
+
+    def _review_each(self, state, stability, difficulty, step, days, rating) -> tuple:
+        results = [
+            self._review_card(
+                card_state, card_stability, card_difficulty,
+                None if card_step == NO_STEP else card_step, card_days, card_rating,
+            )
+            for card_state, card_stability, card_difficulty, card_step, card_days, card_rating in zip(
+                state.tolist(), stability.tolist(), difficulty.tolist(), step.tolist(), days.tolist(), rating.tolist()
+            )
+        ]
+        new_stability, new_difficulty, new_state, new_step, intervals = zip(*results) if results else ((),) * 5
+        return (
+            np.array(new_stability, dtype=np.float64),
+            np.array(new_difficulty, dtype=np.float64),
+            np.array(new_state, dtype=np.int64),
+            np.array([NO_STEP if card_step is None else card_step for card_step in new_step], dtype=np.int64),
+            np.array([_to_us(interval) for interval in intervals], dtype=np.int64),
+        )
+
+    def _review_vectorized(self, state, stability, difficulty, step, days_since_last_review, rating) -> tuple:
+        new_stability = self._next_stability_many(difficulty, stability, days_since_last_review, rating)
+        new_difficulty = self._next_difficulty_many(difficulty, rating)
+        # intervalo en días para las que quedan (o pasan) a Review
+        interval_us = self._next_interval_many(new_stability) * _US_PER_DAY
+
+        new_state = state.copy()
+        new_step = step.copy()
+        is_again = rating == _AGAIN
+        is_hard = rating == _HARD
+        is_good = rating == _GOOD
+        is_easy = rating == _EASY
+
+        # Learning y Relearning comparten la lógica de pasos
+        for current_state, steps_us, hard_us in (
+            (_LEARNING, self._learning_steps_us, self._learning_hard_us),
+            (_RELEARNING, self._relearning_steps_us, self._relearning_hard_us),
+        ):
+            mask = state == current_state
+            if not mask.any():
+                continue
+            num_steps = len(steps_us)
+            if num_steps == 0:
+                # sin pasos de reaprendizaje: la tarjeta vuelve a Review con cualquier calificación
+                new_state = np.where(mask, _REVIEW, new_state)
+                new_step = np.where(mask, NO_STEP, new_step)
+                continue
+            # sin paso asignado: primer paso, como en `learning_scheduler`
+            card_step = np.where(step == NO_STEP, 0, step)
+
+            # pasos fuera de rango (programador con más pasos que el actual)
+            graduate = mask & (card_step >= num_steps) & ~is_again
+            in_steps = mask & ~graduate
+            last_step = card_step + 1 == num_steps
+            graduate |= in_steps & is_easy
+            graduate |= in_steps & is_good & last_step
+            advance = in_steps & is_good & ~last_step
+            again = in_steps & is_again
+            hard = in_steps & is_hard
+
+            safe_step = np.minimum(np.maximum(card_step, 0), num_steps - 1)
+            next_step = np.minimum(card_step + 1, num_steps - 1)
+            hard_interval = np.where(card_step == 0, hard_us, steps_us[safe_step])
+
+            interval_us = np.where(again, steps_us[0], interval_us)
+            interval_us = np.where(hard, hard_interval, interval_us)
+            interval_us = np.where(advance, steps_us[next_step], interval_us)
+
+            new_state = np.where(graduate, _REVIEW, new_state)
+            new_step = np.where(graduate, NO_STEP, new_step)
+            new_step = np.where(again, 0, new_step)
+            new_step = np.where(hard, card_step, new_step)
+            new_step = np.where(advance, card_step + 1, new_step)
+
+        # Review: solo Again cambia de estado
+        if len(self._relearning_steps_us) > 0:
+            review_again = (state == _REVIEW) & is_again
+            interval_us = np.where(review_again, self._relearning_steps_us[0], interval_us)
+            new_state = np.where(review_again, _RELEARNING, new_state)
+            new_step = np.where(review_again, 0, new_step)
+
+        return new_stability, new_difficulty, new_state, new_step, interval_us
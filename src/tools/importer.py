@@ -0,0 +1,118 @@
+"""
+Importación de listas de palabras desde archivos.
+
+Acepta CSV, TSV y exportaciones de texto de Anki ("Notes in Plain Text").
+El archivo se lee en streaming y se procesa en bloques de tamaño fijo, así la
+memoria no crece con el tamaño del archivo.
+"""
+
+from __future__ import annotations
+import csv
+import re
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Iterable, Iterator, TextIO
+
+from tools.sql_tool import add_cards
+from tools.validator_tool import validate_words
+
+CHUNK_SIZE = 5000
+# cabeceras habituales de la primera columna
+_HEADER_NAMES = {"word", "words", "front", "term", "phrase"}
+_HTML_TAG = re.compile(r"<[^>]+>")
+# ejemplos de palabras inválidas que se devuelven en el reporte
+_MAX_INVALID_EXAMPLES = 50
+
+
+@dataclass
+class ImportReport:
+    added: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+    invalid_examples: list[str] = field(default_factory=list)
+
+
+def _anki_options(stream: TextIO) -> tuple[dict, str | None]:
+    """Lee las líneas `#clave:valor` del encabezado de una exportación de Anki."""
+    options = {}
+    for line in stream:
+        if not line.startswith("#"):
+            return options, line
+        key, _, value = line[1:].strip().partition(":")
+        options[key.strip().lower()] = value.strip()
+    return options, None
+
+
+_ANKI_SEPARATORS = {"tab": "\t", "comma": ",", "semicolon": ";", "space": " ", "pipe": "|", "colon": ":"}
+
+
+def iter_words(stream: TextIO, file_format: str | None = None) -> Iterator[str]:
+    """
+    Devuelve la primera columna de cada fila del archivo.
+
+    :param stream: archivo de texto abierto.
+    :param file_format: "csv", "tsv" o "anki"; si es None se detecta a partir del contenido.
+    """
+    options, first_line = _anki_options(stream)
+    if first_line is None:
+        return
+    if file_format is None:
+        if options:
+            file_format = "anki"
+        else:
+            file_format = "tsv" if "\t" in first_line else "csv"
+
+    if file_format == "anki":
+        separator = _ANKI_SEPARATORS.get(options.get("separator", "tab").lower(), "\t")
+        strip_html = options.get("html", "false").lower() == "true"
+    else:
+        separator = "\t" if file_format == "tsv" else ","
+        strip_html = False
+
+    def lines():
+        yield first_line
+        yield from stream
+
+    for i, row in enumerate(csv.reader(lines(), delimiter=separator)):
+        if not row:
+            continue
+        word = row[0]
+        if strip_html:
+            word = _HTML_TAG.sub("", word).replace("&nbsp;", " ")
+        word = " ".join(word.split())
+        if not word or (i == 0 and word.lower() in _HEADER_NAMES):
+            continue
+        yield word
+
+
+def _chunks(words: Iterable[str], size: int) -> Iterator[list[str]]:
+    iterator = iter(words)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def import_words(session, words: Iterable[str], chunk_size: int = CHUNK_SIZE, validate: bool = True) -> ImportReport:
+    """
+    Valida e inserta palabras en bloques de `chunk_size`.
+
+    Cada bloque se deduplica y se inserta con `add_cards` (un INSERT OR IGNORE
+    por bloque); las palabras que ya estaban en el deck cuentan como duplicadas.
+    """
+    report = ImportReport()
+    for chunk in _chunks(words, chunk_size):
+        unique = list(dict.fromkeys(chunk))
+        report.duplicates += len(chunk) - len(unique)
+        if validate:
+            unique, invalid = validate_words(unique)
+            report.invalid += len(invalid)
+            room = _MAX_INVALID_EXAMPLES - len(report.invalid_examples)
+            report.invalid_examples.extend(invalid[:max(room, 0)])
+        added = add_cards(session, unique)
+        report.added += added
+        report.duplicates += len(unique) - added
+    return report
+
+
+def import_file(session, stream: TextIO, file_format: str | None = None, **kwargs) -> ImportReport:
+    """Importa un archivo CSV/TSV/Anki; ver `iter_words` e `import_words`."""
+    return import_words(session, iter_words(stream, file_format), **kwargs)
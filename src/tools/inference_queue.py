@@ -0,0 +1,412 @@
+"""
+Cola de inferencia con batching continuo para el modelo de texto.
+
+Todas las sesiones de Streamlit comparten el mismo modelo. En vez de llamar a
+`generate` cada una por su cuenta (y turnarse la GPU), encolan pedidos aquí y
+un hilo en segundo plano los decodifica juntos: las secuencias nuevas se
+prellenan y se suman al batch entre dos pasos de decodificación, las que
+terminan salen del batch, y cada pedido recibe su texto en streaming.
+
+El KV cache de todo el batch es un `DynamicCache` con padding a la izquierda;
+al sumar secuencias nuevas los caches se alinean por la derecha y se
+concatenan, y al sacar las terminadas se recortan las columnas de padding que
+ya no usa ninguna fila.
+
+Los pedidos pueden declarar un prefijo compartido (`prefix_length`, p. ej. las
+instrucciones fijas de `generate_text`): su KV cache se calcula una vez y se
+copia en cada fila, así el prellenado solo procesa el resto del prompt.
+"""
+
+from __future__ import annotations
+import atexit
+import queue
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from threading import Event, Lock, Thread
+from typing import Callable, Iterator, Sequence
+
+import torch
+import torch.nn.functional as F
+from transformers import DynamicCache
+
+# secuencias decodificadas a la vez como máximo
+MAX_BATCH_SIZE = 8
+# prefijos de prompt con el KV cache guardado (los menos usados se descartan)
+MAX_PREFIXES = 8
+
+
+@dataclass
+class GenerationRequest:
+    """
+    Un pedido de generación. El texto se lee con `stream()` a medida que se
+    genera o completo con `result()`.
+
+    :param logits_processor: `processor(input_ids, scores)` de transformers para
+        esta secuencia (input_ids de forma [1, L] con el prompt sin padding).
+    :param prefix_length: tokens del principio del prompt compartidos con otros
+        pedidos (instrucciones fijas); su KV cache se calcula una sola vez.
+    :param on_done: `on_done(request)` al terminar, desde el hilo de decodificación
+        (p. ej. `queue.put` para esperar varios pedidos a medida que terminan).
+    """
+    prompt_ids: list[int]
+    max_new_tokens: int
+    do_sample: bool = True
+    temperature: float = 1.0
+    top_p: float = 1.0
+    top_k: int = 0
+    repetition_penalty: float = 1.0
+    logits_processor: Callable | None = None
+    prefix_length: int = 0
+    on_done: Callable | None = None
+    generated: list[int] = field(default_factory=list)
+    text: str = ""
+    error: BaseException | None = None
+    cancelled: bool = False
+    _chunks: queue.Queue = field(default_factory=queue.Queue, repr=False)
+    _done: Event = field(default_factory=Event, repr=False)
+    _emitted: int = 0
+
+    def stream(self) -> Iterator[str]:
+        """Fragmentos de texto nuevos hasta terminar la secuencia."""
+        try:
+            while (chunk := self._chunks.get()) is not None:
+                yield chunk
+        finally:
+            # el consumidor dejó de leer (p. ej. un rerun de Streamlit): la fila se libera
+            if not self._done.is_set():
+                self.cancelled = True
+        if self.error is not None:
+            raise self.error
+
+    def result(self) -> str:
+        """Texto generado completo (espera a que termine)."""
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    def _emit(self, tokenizer) -> None:
+        text = tokenizer.decode(self.generated, skip_special_tokens=True)
+        # un carácter de varios bytes a medio generar se emite cuando se completa
+        if len(text) > self._emitted and not text.endswith("�"):
+            self._chunks.put(text[self._emitted:])
+            self._emitted = len(text)
+
+    def _finish(self, tokenizer, error: BaseException | None = None) -> None:
+        self.text = tokenizer.decode(self.generated, skip_special_tokens=True)
+        if error is None and len(self.text) > self._emitted:
+            self._chunks.put(self.text[self._emitted:])
+        self.error = error
+        self._chunks.put(None)
+        self._done.set()
+        if self.on_done is not None:
+            self.on_done(self)
+
+
+def _pad_left(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    # agrega columnas a la izquierda de `dim` (negativo) hasta `length`
+    missing = length - tensor.shape[dim]
+    if missing == 0:
+        return tensor
+    padding = [0, 0] * (-dim - 1) + [missing, 0]
+    return F.pad(tensor, padding)
+
+
+def _cache_from(layers: Sequence[tuple[torch.Tensor, torch.Tensor]]) -> DynamicCache:
+    cache = DynamicCache()
+    for layer_idx, (keys, values) in enumerate(layers):
+        cache.update(keys, values, layer_idx)
+    return cache
+
+
+def _cache_layers(cache: DynamicCache) -> list[tuple[torch.Tensor, torch.Tensor]]:
+    return [(layer.keys, layer.values) for layer in cache.layers]
+
+
+class InferenceQueue:
+    """
+    Planificador de generación compartido por todas las sesiones para un modelo.
+
+    Los valores por defecto de muestreo (temperature, top_p, top_k,
+    repetition_penalty, do_sample) son los de `model.generation_config`.
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size: int = MAX_BATCH_SIZE):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        eos = model.generation_config.eos_token_id
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = set([eos] if isinstance(eos, int) else eos)
+        pad = tokenizer.pad_token_id
+        self.pad_token_id = pad if pad is not None else min(self.eos_token_ids)
+        self._pending: queue.Queue[GenerationRequest] = queue.Queue()
+        self._thread: Thread | None = None
+        self._thread_lock = Lock()
+        # estado del batch en curso; solo lo usa el hilo de decodificación
+        self._rows: list[GenerationRequest] = []
+        self._cache: DynamicCache | None = None
+        self._mask: torch.Tensor | None = None  # [B, L] columnas del cache que son tokens reales
+        self._next: torch.Tensor | None = None  # [B] último token muestreado, todavía fuera del cache
+        self._seen: torch.Tensor | None = None  # [B, V] tokens ya vistos (repetition_penalty)
+        self._prefixes: OrderedDict[tuple[int, ...], list[tuple[torch.Tensor, torch.Tensor]]] = OrderedDict()
+
+    @property
+    def idle(self) -> bool:
+        """Sin secuencias en curso ni pedidos en espera (lectura aproximada desde otro hilo)."""
+        return not self._rows and self._pending.empty()
+
+    def submit(self, prompt_ids: Sequence[int], max_new_tokens: int, **options) -> GenerationRequest:
+        """
+        Encola un pedido y devuelve en el acto; el texto llega por el pedido.
+
+        :param options: do_sample, temperature, top_p, top_k, repetition_penalty, logits_processor, prefix_length, on_done.
+        """
+        if not prompt_ids:
+            raise ValueError("prompt_ids is empty")
+        if options.get("prefix_length"):
+            # al menos un token fuera del prefijo, para tener los logits del primer paso
+            options["prefix_length"] = min(options["prefix_length"], len(prompt_ids) - 1)
+        defaults = self.model.generation_config
+        for name in ("do_sample", "temperature", "top_p", "top_k", "repetition_penalty"):
+            if options.get(name) is None and getattr(defaults, name, None) is not None:
+                options[name] = getattr(defaults, name)
+        options = {name: value for name, value in options.items() if value is not None}
+        request = GenerationRequest(list(prompt_ids), max_new_tokens, **options)
+        self._pending.put(request)
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, name="inference-queue", daemon=True)
+                self._thread.start()
+        return request
+
+    def generate(self, prompts: Sequence[Sequence[int]], max_new_tokens: int, **options) -> list[str]:
+        """Encola varios prompts a la vez y espera los textos, en el mismo orden."""
+        requests = [self.submit(prompt, max_new_tokens, **options) for prompt in prompts]
+        return [request.result() for request in requests]
+
+    def close(self):
+        """Detiene el hilo de decodificación; las secuencias en curso terminan con el texto que ya tienen."""
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                self._pending.put(None)
+                self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            # sin secuencias en curso el hilo espera bloqueado al próximo pedido
+            new = [] if self._rows else [self._pending.get()]
+            while len(self._rows) + len(new) < self.max_batch_size:
+                try:
+                    new.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            # None: pedido de cierre (ver `close`)
+            stop = None in new
+            new = [request for request in new if request is not None]
+            try:
+                with torch.inference_mode():
+                    if new:
+                        self._admit(new)
+                    if self._rows:
+                        self._step()
+            except Exception as e:
+                # un error del modelo termina los pedidos en curso; el hilo sigue atendiendo
+                failed = {id(request): request for request in self._rows + new}
+                for request in failed.values():
+                    if not request._done.is_set():
+                        request._finish(self.tokenizer, error=e)
+                self._reset()
+            if stop:
+                for request in self._rows:
+                    request._finish(self.tokenizer)
+                self._reset()
+                return
+
+    def _reset(self):
+        self._rows, self._cache, self._mask, self._next, self._seen = [], None, None, None, None
+
+    def _admit(self, requests: list[GenerationRequest]):
+        """Prellena los pedidos nuevos (agrupados por prefijo) y los suma al batch en curso."""
+        for request in requests:
+            if request.cancelled:
+                request._finish(self.tokenizer)
+        groups: dict[tuple[int, ...], list[GenerationRequest]] = {}
+        for request in requests:
+            if not request.cancelled:
+                groups.setdefault(tuple(request.prompt_ids[:request.prefix_length]), []).append(request)
+        for prefix, group in groups.items():
+            cache, mask, seen, logits = self._prefill(group, prefix)
+            self._merge(group, cache, mask, seen, self._sample(logits, group, seen))
+
+    def _prefix_layers(self, prefix: tuple[int, ...]) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        """KV cache de un prefijo compartido; se calcula una vez y se reutiliza."""
+        layers = self._prefixes.get(prefix)
+        if layers is None:
+            cache = DynamicCache()
+            self.model(input_ids=torch.tensor([prefix], device=self.model.device), past_key_values=cache, use_cache=True, logits_to_keep=1)
+            layers = self._prefixes[prefix] = _cache_layers(cache)
+            if len(self._prefixes) > MAX_PREFIXES:
+                self._prefixes.popitem(last=False)
+        else:
+            self._prefixes.move_to_end(prefix)
+        return layers
+
+    def _prefill(self, requests: list[GenerationRequest], prefix: tuple[int, ...]):
+        """
+        Prellena un grupo de pedidos con el mismo prefijo. El cache del prefijo
+        se copia en cada fila y solo se calcula el resto del prompt; el padding
+        de los restos queda entre el prefijo y el resto (enmascarado).
+        """
+        device = self.model.device
+        suffixes = [request.prompt_ids[len(prefix):] for request in requests]
+        length = max(len(suffix) for suffix in suffixes)
+        input_ids = torch.full((len(requests), length), self.pad_token_id, dtype=torch.long, device=device)
+        suffix_mask = torch.zeros((len(requests), length), dtype=torch.long, device=device)
+        for i, suffix in enumerate(suffixes):
+            input_ids[i, length - len(suffix):] = torch.tensor(suffix, device=device)
+            suffix_mask[i, length - len(suffix):] = 1
+        if prefix:
+            cache = _cache_from([
+                (keys.expand(len(requests), -1, -1, -1), values.expand(len(requests), -1, -1, -1))
+                for keys, values in self._prefix_layers(prefix)
+            ])
+        else:
+            cache = DynamicCache()
+        mask = torch.cat([suffix_mask.new_ones((len(requests), len(prefix))), suffix_mask], dim=1)
+        position_ids = (mask.cumsum(-1) - 1).clamp(min=0)[:, len(prefix):]
+        logits = self.model(
+            input_ids=input_ids,
+            attention_mask=mask,
+            position_ids=position_ids,
+            past_key_values=cache,
+            use_cache=True,
+            logits_to_keep=1,
+        ).logits[:, -1]
+        seen = torch.zeros((len(requests), logits.shape[-1]), dtype=torch.bool, device=device)
+        seen.scatter_(1, input_ids, suffix_mask.bool())
+        if prefix:
+            seen[:, list(prefix)] = True
+        return cache, mask, seen, logits
+
+    def _merge(self, requests: list[GenerationRequest], cache: DynamicCache, mask: torch.Tensor, seen: torch.Tensor, tokens: torch.Tensor):
+        if not self._rows:
+            self._rows, self._cache, self._mask, self._seen = requests, cache, mask, seen
+        else:
+            # alinea los dos caches por la derecha (padding a la izquierda) y los apila
+            length = max(self._mask.shape[1], mask.shape[1])
+            self._cache = _cache_from([
+                (
+                    torch.cat([_pad_left(old_keys, length, -2), _pad_left(new_keys, length, -2)]),
+                    torch.cat([_pad_left(old_values, length, -2), _pad_left(new_values, length, -2)]),
+                )
+                for (old_keys, old_values), (new_keys, new_values) in zip(_cache_layers(self._cache), _cache_layers(cache))
+            ])
+            self._mask = torch.cat([_pad_left(self._mask, length, -1), _pad_left(mask, length, -1)])
+            self._seen = torch.cat([self._seen, seen])
+            self._rows = self._rows + requests
+            tokens = torch.cat([self._next, tokens])
+        self._record(tokens, first=len(self._rows) - len(requests))
+
+    def _step(self):
+        """Un paso de decodificación de todo el batch."""
+        mask = torch.cat([self._mask, self._mask.new_ones((len(self._rows), 1))], dim=1)
+        logits = self.model(
+            input_ids=self._next[:, None],
+            attention_mask=mask,
+            # posición del token nuevo: cantidad de tokens reales anteriores
+            position_ids=self._mask.sum(-1, keepdim=True),
+            past_key_values=self._cache,
+            use_cache=True,
+        ).logits[:, -1]
+        self._mask = mask
+        self._record(self._sample(logits, self._rows, self._seen))
+
+    def _sample(self, logits: torch.Tensor, requests: list[GenerationRequest], seen: torch.Tensor) -> torch.Tensor:
+        # mismo orden que `generate`: repetition_penalty, processors, temperature, top_k y top_p
+        device = logits.device
+        logits = logits.float()
+        penalty = torch.tensor([request.repetition_penalty for request in requests], device=device)[:, None]
+        logits = torch.where(seen, torch.where(logits > 0, logits / penalty, logits * penalty), logits)
+        for i, request in enumerate(requests):
+            if request.logits_processor is not None:
+                input_ids = torch.tensor([request.prompt_ids + request.generated], device=device)
+                logits[i:i + 1] = request.logits_processor(input_ids, logits[i:i + 1])
+        greedy = logits.argmax(-1)
+
+        temperature = torch.tensor(
+            [request.temperature if request.do_sample and request.temperature > 0 else 1.0 for request in requests],
+            device=device,
+        )[:, None]
+        sorted_logits, sorted_ids = (logits / temperature).sort(dim=-1, descending=True)
+        top_k = torch.tensor([request.top_k or logits.shape[-1] for request in requests], device=device)[:, None]
+        sorted_logits = sorted_logits.masked_fill(torch.arange(logits.shape[-1], device=device)[None] >= top_k, -float("inf"))
+        probs = sorted_logits.softmax(-1)
+        top_p = torch.tensor([request.top_p for request in requests], device=device)[:, None]
+        # se conserva siempre el token más probable
+        sorted_logits = sorted_logits.masked_fill(probs.cumsum(-1) - probs > top_p, -float("inf"))
+        sampled = sorted_ids.gather(1, torch.multinomial(sorted_logits.softmax(-1), 1)).squeeze(-1)
+
+        do_sample = torch.tensor([request.do_sample for request in requests], device=device)
+        return torch.where(do_sample, sampled, greedy)
+
+    def _record(self, tokens: torch.Tensor, first: int = 0):
+        """Agrega los tokens de las filas desde `first`, emite el texto y saca las filas terminadas."""
+        self._next = tokens
+        rows = torch.arange(first, len(self._rows), device=tokens.device)
+        self._seen[rows, tokens[first:]] = True
+        keep = []
+        for i, request in enumerate(self._rows):
+            if i >= first:
+                token = int(tokens[i])
+                if token not in self.eos_token_ids:
+                    request.generated.append(token)
+                    request._emit(self.tokenizer)
+                if token in self.eos_token_ids or len(request.generated) >= request.max_new_tokens:
+                    request._finish(self.tokenizer)
+            if request.cancelled and not request._done.is_set():
+                request._finish(self.tokenizer)
+            if not request._done.is_set():
+                keep.append(i)
+        if len(keep) < len(self._rows):
+            self._select(keep)
+
+    def _select(self, keep: list[int]):
+        if not keep:
+            self._reset()
+            return
+        index = torch.tensor(keep, device=self._mask.device)
+        mask = self._mask[index]
+        # columnas de padding a la izquierda que ya no usa ninguna fila
+        start = int(mask.any(0).nonzero()[0])
+        self._cache = _cache_from([
+            (keys[index, :, start:], values[index, :, start:]) for keys, values in _cache_layers(self._cache)
+        ])
+        self._mask = mask[:, start:]
+        self._next = self._next[index]
+        self._seen = self._seen[index]
+        self._rows = [self._rows[i] for i in keep]
+
+
+# una cola por modelo cargado, compartida por todo el proceso
+_queues: dict[int, InferenceQueue] = {}
+_queues_lock = Lock()
+
+
+def shared_queue(model, tokenizer) -> InferenceQueue:
+    """Cola de inferencia del modelo (se crea la primera vez)."""
+    with _queues_lock:
+        if id(model) not in _queues:
+            _queues[id(model)] = InferenceQueue(model, tokenizer)
+        return _queues[id(model)]
+
+
+@atexit.register
+def close_all() -> None:
+    """Detiene los hilos de decodificación (también al cerrar la app)."""
+    with _queues_lock:
+        queues = list(_queues.values())
+    for inference_queue in queues:
+        inference_queue.close()
@@ -1,10 +1,29 @@
-from typing import List, Tuple
-from transformers import GenerationConfig, TextIteratorStreamer
-import torch
-from threading import Thread
+import logging
+import queue
+from threading import Lock
+from typing import Callable, Iterator, List, Tuple
+from utils.config import DICT_TRANSLATOR, AUDIO_PIPELINE, TEXT_MODEL, TEXT_TOKENIZER, VOICE
+from tools.inference_queue import shared_queue
+from tools.required_words import RequiredWordsProcessor, WordMatcher
+from tools.sql_tool import CardRow
 
-from utils.config import DEVICE, DICT_TRANSLATOR, AUDIO_PIPELINE, TEXT_MODEL, TEXT_TOKENIZER, VOICE
-from tools.sql_tool import Deck
+logger = logging.getLogger(__name__)
+
+# pedidos máximos por palabra; las que no aparecen quedan para otra sesión
+MAX_GENERATION_ROUNDS = 3
+# instrucciones fijas de todos los párrafos; van primero para que el KV cache
+# de ese prefijo se calcule una sola vez (ver `InferenceQueue`)
+PARAGRAPH_INSTRUCTIONS = (
+    "You write short paragraphs for English learners. "
+    "Each paragraph MUST include the EXACT words the user asks for. "
+    "Do NOT use derivatives, variations, or related forms. "
+    "Example: If the word is 'run', don't use 'running' or 'ran'. "
+    "Write in simple English. Output ONLY the paragraph."
+)
+# tokens máximos del resumen de la conversación del chatbot
+SUMMARY_MAX_TOKENS = 150
+# el pipeline de Kokoro se usa también desde el hilo de pre-generación; una llamada a la vez
+_audio_lock = Lock()
 
 class Chatbot:
     def __init__(self):
@@ -58,20 +77,15 @@ Always prioritize clarity and efficiency.
             add_generation_prompt=True,
             enable_thinking=False
         )
-        # Generar resumen
-        inputs = self.tokenizer(summary_template, return_tensors="pt").to(DEVICE)
-        
-        with torch.inference_mode():
-            output_ids = self.model.generate(
-                **inputs,
-                do_sample=True,
-                temperature=0.3
-            )
-            summary = self.tokenizer.decode(
-                output_ids[0][len(inputs.input_ids[0]):],
-                skip_special_tokens=True
-            )
-            summary = summary.split("<think>")[-1].strip()
+        # Generar resumen (en la cola compartida con las demás sesiones)
+        prompt_ids = self.tokenizer(summary_template).input_ids
+        summary = shared_queue(self.model, self.tokenizer).submit(
+            prompt_ids,
+            max_new_tokens=SUMMARY_MAX_TOKENS,
+            do_sample=True,
+            temperature=0.3
+        ).result()
+        summary = summary.split("<think>")[-1].strip()
         # Agregar resumen como mensaje del sistema
         summary_msg = {
             "role": "system", 
@@ -96,26 +110,12 @@ Always prioritize clarity and efficiency.
             enable_thinking=False
         )
         # Tokenizar entrada
-        inputs = self.tokenizer(text, return_tensors="pt").to(DEVICE)
-        # Configurar streamer
-        streamer = TextIteratorStreamer(
-            self.tokenizer,
-            skip_prompt=True,
-            skip_special_tokens=True
-        )
-        # Generar respuesta en un hilo separado
-        generation_thread = Thread(
-            target=self.model.generate,
-            kwargs={
-                **inputs,
-                "streamer": streamer,
-                "max_new_tokens": 200
-            }
-        )
-        generation_thread.start()
+        prompt_ids = self.tokenizer(text).input_ids
+        # la cola de inferencia genera junto con las demás sesiones y devuelve el texto en streaming
+        request = shared_queue(self.model, self.tokenizer).submit(prompt_ids, max_new_tokens=200)
         # Stream tokens
         response = ""
-        for token in streamer:
+        for token in request.stream():
             response += token
             yield token
         # Agregar respuesta completa al historial
@@ -171,92 +171,166 @@ def calculate_token_settings(text_length: str, remaining_list: List[List]) -> Tu
     return num_tokens, words_interval
 
 
-def generate_text(topic: str,
-                  grouped_cards: List[List[Deck]],
-                  temperature: float,
-                  text_length: str
-                  ) -> Tuple[List[List[str]], List[List[Deck]], List[str]]:
+def _paragraph_prompts(prompts: List[str]) -> Tuple[int, List[List[int]]]:
     """
-    Genera un texto breve a partir de una lista de palabras clave.
+    Tokeniza los pedidos de párrafo con las instrucciones fijas delante, como
+    mensaje de sistema, para que todos compartan el mismo prefijo de tokens.
+
+    :return: (largo del prefijo compartido, ids de cada prompt).
+    """
+    system = [{"role": "system", "content": PARAGRAPH_INSTRUCTIONS}]
+    templates = [
+        TEXT_TOKENIZER.apply_chat_template(
+            system + [{"role": "user", "content": prompt}],
+            tokenize=False,
+            add_generation_prompt=True,
+            enable_thinking=False
+        ) for prompt in prompts
+    ]
+    prefix_text = TEXT_TOKENIZER.apply_chat_template(system, tokenize=False)
+    if not all(template.startswith(prefix_text) for template in templates):
+        # plantilla que no deja el mensaje de sistema al principio: sin prefijo compartido
+        return 0, [TEXT_TOKENIZER(template).input_ids for template in templates]
+    # el prefijo se tokeniza aparte para que sus ids sean idénticos en todos los prompts
+    prefix_ids = TEXT_TOKENIZER(prefix_text).input_ids
+    return len(prefix_ids), [
+        prefix_ids + TEXT_TOKENIZER(template[len(prefix_text):], add_special_tokens=False).input_ids
+        for template in templates
+    ]
+
+
+def generate_paragraphs(topic: str,
+                        grouped_cards: List[List[CardRow]],
+                        temperature: float,
+                        text_length: str,
+                        cancel_hook: Callable[[Callable[[], None]], None] | None = None,
+                        failed_words: List[str] | None = None
+                        ) -> Iterator[Tuple[List[str], List[CardRow], str]]:
+    """
+    Genera un párrafo por grupo y devuelve cada uno en cuanto pasa la validación,
+    en el orden en que terminan.
+
+    Todos los grupos se encolan juntos en la cola de inferencia. La decodificación
+    se restringe con `RequiredWordsProcessor` para que cada párrafo incluya todas
+    las palabras de su grupo. Si aun así faltan palabras, el párrafo se acepta
+    para las que sí incluye y solo las que faltan se vuelven a pedir, como un
+    grupo nuevo; si no incluye ninguna, el grupo se parte en dos. Cada palabra
+    pasa por `MAX_GENERATION_ROUNDS` pedidos como máximo y después se omite. Si
+    se deja de iterar, los pedidos pendientes se cancelan.
 
-    :param text_pipeline: Pipeline de generación de texto.
     :param topic: Tema del texto.
-    :param words_list: Lista de listas de palabras clave.
+    :param grouped_cards: Tarjetas agrupadas; un párrafo por grupo.
+    :param cancel_hook: recibe, al empezar, una función que cancela la generación
+        desde otro hilo: los pedidos pendientes se liberan y la iteración termina
+        aunque esté esperando un párrafo.
+    :param failed_words: si se pasa, se le agregan las palabras que se omitieron.
+    :return: (palabras, tarjetas, texto) de cada párrafo generado.
     """
-    
-    remaining_list = [[entry.word for entry in group] for group in grouped_cards]
-    num_tokens, words_interval = calculate_token_settings(text_length, remaining_list)
-    gen_config = GenerationConfig(
-            max_new_tokens=num_tokens,
+    if not grouped_cards:
+        return
+    sampling = dict(
             do_sample=True,
             temperature=temperature,
             top_p=0.95,
-            repetition_penalty=1.15,
-            pad_token_id=TEXT_TOKENIZER.eos_token_id,
-            eos_token_id=TEXT_TOKENIZER.eos_token_id
+            top_k=50,
+            repetition_penalty=1.15
     )
-    # Extraer solo las palabras de cada grupo
-    
-    texts = []
-    reordered_words = []
-    reordered_cards = []
-    
-    while True:
-        if len(remaining_list) == 0:
-            break
+    inference_queue = shared_queue(TEXT_MODEL, TEXT_TOKENIZER)
+    # todas las palabras en un solo autómata; cada texto se recorre una vez
+    matcher = WordMatcher(entry.word for group in grouped_cards for entry in group)
+    # los pedidos terminados llegan aquí desde el hilo de decodificación (None: cancelado)
+    finished = queue.Queue()
+    in_flight = {}
+
+    def cancel():
+        for _, _, request in list(in_flight.values()):
+            request.cancelled = True
+        finished.put(None)
+
+    def submit(groups: List[List[CardRow]], attempt: int):
+        words_list = [[entry.word for entry in group] for group in groups]
+        settings = [calculate_token_settings(text_length, [words]) for words in words_list]
         prompts = [
-            (
-                f"Generate a short paragraph ({words_interval}) about {topic} that MUST include "
-                f"these EXACT words: {', '.join(words)}!"
-                "Do NOT use derivatives, variations, or related forms. "
-                "Example: If the word is 'run', don't use 'running' or 'ran'. "
-                "Write in simple English. Output ONLY the paragraph."
-            )
-            for words, words_interval in zip(remaining_list, words_interval)
+            f"Generate a short paragraph ({words_interval}) about {topic} that MUST include "
+            f"these EXACT words: {', '.join(words)}!"
+            for words, (_, (words_interval,)) in zip(words_list, settings)
         ]
-        messages = [[{"role": "user", "content": p}] for p in prompts]
-        chat_templates = [
-            TEXT_TOKENIZER.apply_chat_template(
-                message,
-                tokenize=False,
-                add_generation_prompt=True,
-                enable_thinking=False
-            ) for message in messages
-        ]
-        with torch.inference_mode():
-            # 2. Tokeniza todo en batch
-            inputs = TEXT_TOKENIZER(
-                chat_templates,
-                return_tensors="pt",
-                padding=True,
-                truncation=True
-            ).to(DEVICE)
-            output_ids = TEXT_MODEL.generate(
-                **inputs,
-                generation_config=gen_config
-            )
-            # 4. Decodifica los resultados
-            generated_texts = TEXT_TOKENIZER.batch_decode(
-                output_ids,
-                skip_special_tokens=True
+        prefix_length, prompt_ids = _paragraph_prompts(prompts)
+        for group, words, (num_tokens, _), ids in zip(groups, words_list, settings, prompt_ids):
+            request = inference_queue.submit(
+                ids,
+                max_new_tokens=num_tokens,
+                prefix_length=prefix_length,
+                # bloquea el EOS y empuja hacia las palabras que faltan
+                logits_processor=RequiredWordsProcessor(
+                    TEXT_TOKENIZER,
+                    [words],
+                    prompt_length=len(ids),
+                    max_new_tokens=num_tokens,
+                    eos_token_id=list(inference_queue.eos_token_ids),
+                ),
+                on_done=finished.put,
+                **sampling
             )
-            generated_texts = [generated_text.split("</think>")[-1].strip()
-                               for generated_text in generated_texts]
-            to_remove = []
-            
-            for i, (cards, words, text) in enumerate(
-                zip(grouped_cards, remaining_list, generated_texts)
-            ):
-                if all(word.lower() in text.lower() for word in words):
-                    texts.append(text)
-                    reordered_words.append(words)
-                    reordered_cards.append(cards)
-                    to_remove.append(i)
-            # Eliminar después de iterar (en orden inverso para no desordenar los índices)
-            for i in sorted(to_remove, reverse=True):
-                del remaining_list[i]
-                del words_interval[i]
-                del grouped_cards[i]
+            in_flight[id(request)] = group, attempt, request
+
+    failed = []
+    submit(grouped_cards, 1)
+    if cancel_hook is not None:
+        cancel_hook(cancel)
+    try:
+        while in_flight:
+            request = finished.get()
+            if request is None or request.cancelled:
+                break
+            group, attempt, _ = in_flight.pop(id(request))
+            text = request.result().split("</think>")[-1].strip()
+            missing = set(matcher.missing([entry.word for entry in group], text))
+            accepted = [entry for entry in group if entry.word not in missing]
+            rest = [entry for entry in group if entry.word in missing]
+            if accepted:
+                yield [entry.word for entry in accepted], accepted, text
+            if not rest:
+                continue
+            if attempt >= MAX_GENERATION_ROUNDS:
+                failed.append([entry.word for entry in rest])
+                if failed_words is not None:
+                    failed_words.extend(entry.word for entry in rest)
+            elif accepted or len(rest) == 1:
+                # otro párrafo solo con las palabras que faltaron
+                submit([rest], attempt + 1)
+            else:
+                # ninguna palabra: grupos más chicos son más fáciles de cumplir
+                half = (len(rest) + 1) // 2
+                submit([rest[:half], rest[half:]], attempt + 1)
+    finally:
+        # el consumidor dejó de iterar: se liberan las filas de la cola
+        for _, _, request in in_flight.values():
+            request.cancelled = True
+    if failed:
+        logger.warning("Could not include all the words after %d attempts: %s", MAX_GENERATION_ROUNDS, failed)
+
+
+def generate_text(topic: str,
+                  grouped_cards: List[List[CardRow]],
+                  temperature: float,
+                  text_length: str,
+                  cancel_hook: Callable[[Callable[[], None]], None] | None = None
+                  ) -> Tuple[List[List[str]], List[List[CardRow]], List[str]]:
+    """
+    Genera un texto breve a partir de una lista de palabras clave (ver
+    `generate_paragraphs`) y espera a que terminen todos los grupos.
+
+    :param topic: Tema del texto.
+    :param grouped_cards: Tarjetas agrupadas; un párrafo por grupo.
+    :param cancel_hook: como en `generate_paragraphs`; al cancelar se devuelven los grupos ya generados.
+    :return: (palabras, tarjetas, textos) de los grupos generados.
+    """
+    reordered_words, reordered_cards, texts = [], [], []
+    for words, cards, text in generate_paragraphs(topic, grouped_cards, temperature, text_length, cancel_hook):
+        reordered_words.append(words)
+        reordered_cards.append(cards)
+        texts.append(text)
     return reordered_words, reordered_cards, texts
 
 
@@ -266,11 +340,12 @@ def generate_audio(texts: str):
 
     :param text: Texto a convertir en audio.
     """
-    generator = AUDIO_PIPELINE(
-            texts, voice=VOICE,
-            speed=1, split_pattern=None
-    )
-    return [next(generator)[2].cpu().numpy() for _ in texts]
+    with _audio_lock:
+        generator = AUDIO_PIPELINE(
+                texts, voice=VOICE,
+                speed=1, split_pattern=None
+        )
+        return [next(generator)[2].cpu().numpy() for _ in texts]
 
 def translate_to_spanish(text:str):
     return DICT_TRANSLATOR(text)[0]["translation_text"]
\ No newline at end of file
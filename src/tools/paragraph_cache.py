@@ -0,0 +1,185 @@
+"""
+Caché en disco de los párrafos de estudio generados (y de su audio).
+
+Clave: (modelo, tema, palabras del grupo sin importar el orden, largo del
+texto, temperatura redondeada a `TEMPERATURE_STEP`). Los párrafos se guardan
+en `CACHE_DB_PATH`, fuera de la lista de decks; cuando el total pasa de
+`MAX_CACHE_BYTES` se borran los usados hace más tiempo (LRU).
+
+`prepared_groups` guarda además qué tarjetas de un deck forman cada párrafo
+preparado en segundo plano (ver `tools.pregeneration`), para que la sesión
+de estudio arme los mismos grupos y solo tenga que leerlos.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Sequence
+
+import numpy as np
+from sqlalchemy import Column, Float, Index, Integer, LargeBinary, MetaData, String, Table, create_engine, delete, event, func, insert, select, update
+
+from tools.sql_tool import SQLITE_PRAGMAS
+
+# en un subdirectorio, aparte de los decks (db/*.db y `SHARED_DB_PATH`): se puede borrar sin tocarlos
+CACHE_DB_PATH = Path("db") / "cache" / "paragraphs.sqlite"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+TEMPERATURE_STEP = 0.1
+# "reuse": usar el párrafo guardado si existe; "fresh": generar siempre (y reemplazar el guardado)
+CACHE_POLICIES = ("reuse", "fresh")
+# guardar también el audio de cada párrafo (el TTS se omite al reutilizarlo)
+CACHE_AUDIO = True
+
+metadata = MetaData()
+paragraphs = Table(
+    "paragraphs",
+    metadata,
+    Column("key", String, primary_key=True),  # sha256 de la clave
+    Column("model", String, nullable=False),
+    Column("topic", String, nullable=False),
+    Column("words", String, nullable=False),  # lista JSON ordenada
+    Column("text_length", String, nullable=False),
+    Column("temperature", Float, nullable=False),  # redondeada a TEMPERATURE_STEP
+    Column("text", String, nullable=False),
+    Column("audio", LargeBinary),  # muestras float32 mono
+    Column("size", Integer, nullable=False),  # bytes de texto + audio
+    Column("last_used", Integer, nullable=False),  # epoch en segundos
+    Index("ix_paragraphs_last_used", "last_used"),
+)
+prepared_groups = Table(
+    "prepared_groups",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("deck", String, nullable=False),  # `deck_key` de la sesión del deck
+    Column("key", String, nullable=False),  # párrafo en `paragraphs`
+    Column("card_ids", String, nullable=False),  # lista JSON, en el orden del párrafo
+    Index("ix_prepared_groups_deck", "deck"),
+)
+
+_engine = None
+_engine_lock = Lock()
+
+
+def _set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+
+def cache_engine():
+    """Engine de la caché; la base de datos se crea la primera vez."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            CACHE_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+            engine = create_engine(f"sqlite:///{CACHE_DB_PATH}")
+            event.listen(engine, "connect", _set_pragmas)
+            metadata.create_all(engine)
+            _engine = engine
+        return _engine
+
+
+def temperature_bucket(temperature: float) -> float:
+    return round(round(temperature / TEMPERATURE_STEP) * TEMPERATURE_STEP, 2)
+
+
+def paragraph_key(model: str, topic: str, words: Sequence[str], text_length: str, temperature: float) -> str:
+    """Clave de un párrafo; el orden de las palabras y las mayúsculas del tema no importan."""
+    parts = [model, topic.strip().lower(), sorted(words), text_length, temperature_bucket(temperature)]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def get_paragraphs(keys: Sequence[str]) -> dict[str, tuple[str, np.ndarray | None]]:
+    """
+    Párrafos guardados de las claves que estén en la caché (y los marca como usados).
+
+    :return: clave -> (texto, audio o None).
+    """
+    if not keys:
+        return {}
+    found = {}
+    with cache_engine().begin() as conn:
+        rows = conn.execute(select(paragraphs.c.key, paragraphs.c.text, paragraphs.c.audio).where(paragraphs.c.key.in_(keys)))
+        for key, text, audio in rows:
+            found[key] = text, None if audio is None else np.frombuffer(audio, dtype=np.float32)
+        if found:
+            conn.execute(update(paragraphs).where(paragraphs.c.key.in_(found)).values(last_used=int(time.time())))
+    return found
+
+
+def put_paragraph(
+    model: str,
+    topic: str,
+    words: Sequence[str],
+    text_length: str,
+    temperature: float,
+    text: str,
+    audio: np.ndarray | None = None,
+) -> str:
+    """Guarda (o reemplaza) un párrafo y descarta los menos usados si la caché se pasa de tamaño."""
+    key = paragraph_key(model, topic, words, text_length, temperature)
+    audio_bytes = None if audio is None else np.asarray(audio, dtype=np.float32).tobytes()
+    row = {
+        "key": key,
+        "model": model,
+        "topic": topic.strip().lower(),
+        "words": json.dumps(sorted(words)),
+        "text_length": text_length,
+        "temperature": temperature_bucket(temperature),
+        "text": text,
+        "audio": audio_bytes,
+        "size": len(text.encode()) + len(audio_bytes or b""),
+        "last_used": int(time.time()),
+    }
+    with cache_engine().begin() as conn:
+        conn.execute(insert(paragraphs).prefix_with("OR REPLACE"), row)
+        _evict(conn)
+    return key
+
+
+def _evict(conn, max_bytes: int = MAX_CACHE_BYTES):
+    # se conservan los más recientes mientras el total acumulado quepa en max_bytes
+    running = (
+        select(paragraphs.c.key, func.sum(paragraphs.c.size).over(order_by=(paragraphs.c.last_used.desc(), paragraphs.c.key)).label("total"))
+        .subquery()
+    )
+    conn.execute(delete(paragraphs).where(paragraphs.c.key.in_(select(running.c.key).where(running.c.total > max_bytes))))
+    conn.execute(delete(prepared_groups).where(prepared_groups.c.key.not_in(select(paragraphs.c.key))))
+
+
+def get_prepared_groups(deck: str) -> list[tuple[int, str, list[int]]]:
+    """
+    Grupos preparados del deck cuyo párrafo sigue en la caché.
+
+    :param deck: `deck_key` de la sesión.
+    :return: (id, clave del párrafo, ids de las tarjetas) en el orden en que se prepararon.
+    """
+    query = (
+        select(prepared_groups.c.id, prepared_groups.c.key, prepared_groups.c.card_ids)
+        .join(paragraphs, paragraphs.c.key == prepared_groups.c.key)
+        .where(prepared_groups.c.deck == deck)
+        .order_by(prepared_groups.c.id)
+    )
+    with cache_engine().connect() as conn:
+        return [(group_id, key, json.loads(card_ids)) for group_id, key, card_ids in conn.execute(query)]
+
+
+def add_prepared_group(deck: str, key: str, card_ids: Sequence[int]) -> None:
+    with cache_engine().begin() as conn:
+        conn.execute(insert(prepared_groups).values(deck=deck, key=key, card_ids=json.dumps(list(card_ids))))
+
+
+def discard_prepared_groups(group_ids: Sequence[int]) -> None:
+    if group_ids:
+        with cache_engine().begin() as conn:
+            conn.execute(delete(prepared_groups).where(prepared_groups.c.id.in_(group_ids)))
+
+
+def clear_cache():
+    with cache_engine().begin() as conn:
+        conn.execute(delete(prepared_groups))
+        conn.execute(delete(paragraphs))
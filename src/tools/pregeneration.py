@@ -0,0 +1,250 @@
+"""
+Pre-generación en segundo plano de las próximas sesiones de estudio.
+
+Un hilo revisa cada deck estudiado con párrafos reutilizables (ver
+`remember_config`), toma las tarjetas que vencen en las próximas
+`LOOKAHEAD_HOURS` horas, las agrupa y genera el párrafo y el audio de cada
+grupo con la última configuración de estudio del deck. Los párrafos van a la
+caché de `tools.paragraph_cache` y los grupos a `prepared_groups`, así
+`build_batches` arma la sesión leyendo de la caché.
+
+El hilo solo trabaja cuando el modelo está libre: espera a que la cola de
+inferencia esté vacía y a que pasen `IDLE_SECONDS` desde la última generación
+pedida por el usuario (ver `interactive`), y genera de a un grupo para no
+demorar más de un párrafo a quien empiece a estudiar.
+"""
+
+from __future__ import annotations
+import atexit
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+from typing import Callable
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, delete, insert, select
+
+from tools.inference_queue import shared_queue
+from tools.llm_tools import generate_audio, generate_text
+from tools.paragraph_cache import (
+    CACHE_AUDIO,
+    add_prepared_group,
+    cache_engine,
+    discard_prepared_groups,
+    get_prepared_groups,
+    paragraph_key,
+    put_paragraph,
+)
+from tools.sql_tool import deck_key, deck_selection, flush_reviews, get_due_cards, open_deck
+from utils.config import MODEL_NAME, TEXT_MODEL, TEXT_TOKENIZER
+
+logger = logging.getLogger(__name__)
+
+# ventana de tarjetas a preparar
+LOOKAHEAD_HOURS = 12
+# tarjetas de la ventana que se preparan por deck como máximo
+MAX_LOOKAHEAD_CARDS = 200
+# segundos sin generaciones del usuario antes de usar el modelo
+IDLE_SECONDS = 30
+# cada cuánto se revisa si el modelo está libre
+POLL_SECONDS = 5
+# pausa después de una pasada completa por todos los decks
+PASS_INTERVAL_SECONDS = 300
+# espera máxima al hilo al cerrar la app (es un daemon: lo que quede se corta)
+STOP_TIMEOUT_SECONDS = 5
+
+metadata = MetaData()
+# última configuración de estudio de cada deck (la que se usa para preparar sus párrafos)
+pregeneration_decks = Table(
+    "pregeneration_decks",
+    metadata,
+    Column("deck", String, primary_key=True),  # nombre del deck, como en `deck_selection`
+    Column("topic", String, nullable=False),
+    Column("group_size", Integer, nullable=False),
+    Column("temperature", Float, nullable=False),
+    Column("text_length", String, nullable=False),
+)
+
+_lock = Lock()
+_thread: Thread | None = None
+_stop = Event()
+# cancela el párrafo en curso (ver `cancel_hook` de `generate_paragraphs`)
+_cancel_generation: Callable[[], None] | None = None
+_interactive = 0
+_last_activity = 0.0
+_next_pass = 0.0
+_tables_ready = False
+
+
+def _engine():
+    global _tables_ready
+    engine = cache_engine()
+    if not _tables_ready:
+        metadata.create_all(engine)
+        _tables_ready = True
+    return engine
+
+
+def remember_config(deck_name: str, topic: str, group_size: int, temperature: float, text_length: str) -> None:
+    """Guarda la configuración de estudio del deck; la próxima pasada prepara sus grupos con ella."""
+    global _next_pass
+    row = dict(deck=deck_name, topic=topic, group_size=group_size, temperature=temperature, text_length=text_length)
+    with _engine().begin() as conn:
+        conn.execute(insert(pregeneration_decks).prefix_with("OR REPLACE"), row)
+    _next_pass = 0.0
+
+
+def forget_deck(deck_name: str) -> None:
+    """Deja de preparar párrafos para el deck."""
+    with _engine().begin() as conn:
+        conn.execute(delete(pregeneration_decks).where(pregeneration_decks.c.deck == deck_name))
+
+
+@contextmanager
+def interactive():
+    """Marca una generación pedida por el usuario: mientras dure, el hilo no empieza grupos nuevos."""
+    global _interactive, _last_activity
+    with _lock:
+        _interactive += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _interactive -= 1
+            _last_activity = time.monotonic()
+
+
+def _set_cancel_generation(cancel: Callable[[], None] | None) -> None:
+    global _cancel_generation
+    with _lock:
+        _cancel_generation = cancel
+    # `stop_pregeneration` pudo llegar antes de que la generación registrara su cancelación
+    if cancel is not None and _stop.is_set():
+        cancel()
+
+
+def _idle() -> bool:
+    with _lock:
+        if _interactive or time.monotonic() - _last_activity < IDLE_SECONDS:
+            return False
+    return shared_queue(TEXT_MODEL, TEXT_TOKENIZER).idle
+
+
+def prepare_deck(deck_name: str, topic: str, group_size: int, temperature: float, text_length: str) -> bool:
+    """
+    Prepara los grupos del deck que todavía no tienen párrafo, de a uno y mientras el modelo esté libre.
+
+    :return: True si no quedó nada por preparar.
+    """
+    _, session = open_deck(deck_name)
+    try:
+        deck = deck_key(session)
+        now = datetime.now(timezone.utc)
+        window_end = now + timedelta(hours=LOOKAHEAD_HOURS)
+        # las calificaciones pendientes del buffer del deck se escriben antes de leer
+        flush_reviews(session)
+        upcoming = get_due_cards(session, now=window_end, limit=MAX_LOOKAHEAD_CARDS, order="due")
+        words = {card.id: card.word for card in upcoming}
+        # se descartan los grupos con tarjetas ya repasadas (fuera de la ventana), con
+        # palabras editadas o preparados con otra configuración
+        covered, stale = set(), []
+        for group_id, key, card_ids in get_prepared_groups(deck):
+            if all(card_id in words for card_id in card_ids) and key == paragraph_key(
+                MODEL_NAME, topic, [words[card_id] for card_id in card_ids], text_length, temperature
+            ):
+                covered.update(card_ids)
+            else:
+                stale.append(group_id)
+        discard_prepared_groups(stale)
+
+        pending = [card for card in upcoming if card.id not in covered]
+        # las vencidas ya se agrupan aparte: un grupo con una tarjeta que todavía no
+        # vence no sirve para la sesión que empiece ahora
+        naive_now = now.replace(tzinfo=None)
+        due_now = [card for card in pending if card.due <= naive_now]
+        later = pending[len(due_now):]
+        groups = [part[i:i + group_size] for part in (due_now, later) for i in range(0, len(part), group_size)]
+        for group in groups:
+            if _stop.is_set() or not _idle():
+                return False
+            # se puede estar estudiando el deck mientras tanto: las tarjetas calificadas
+            # o editadas desde la lectura se omiten (`get_due_cards` escribe el buffer antes)
+            current = set(get_due_cards(session, now=window_end, ids=[card.id for card in group]))
+            group = [card for card in group if card in current]
+            if not group:
+                continue
+            # el grupo puede quedar repartido en varios párrafos; las palabras que no
+            # se lograron incluir se reintentan en la próxima pasada
+            try:
+                _, groups_cards, texts = generate_text(
+                    topic, [group], temperature, text_length, cancel_hook=_set_cancel_generation
+                )
+            finally:
+                _set_cancel_generation(None)
+            if _stop.is_set():
+                # cancelado al cerrar la app: no se guardan párrafos a medias ni se genera el audio
+                return False
+            for cards, text, audio in zip(groups_cards, texts, generate_audio(texts) if texts else []):
+                key = put_paragraph(
+                    MODEL_NAME, topic, [card.word for card in cards], text_length, temperature, text,
+                    audio if CACHE_AUDIO else None,
+                )
+                add_prepared_group(deck, key, [card.id for card in cards])
+        return True
+    finally:
+        session.close()
+
+
+def _prepare_all() -> bool:
+    with _engine().connect() as conn:
+        configs = conn.execute(select(pregeneration_decks)).all()
+    decks = set(deck_selection())
+    done = True
+    for deck_name, topic, group_size, temperature, text_length in configs:
+        if deck_name not in decks:
+            # deck borrado
+            forget_deck(deck_name)
+            continue
+        if not prepare_deck(deck_name, topic, group_size, temperature, text_length):
+            done = False
+            break
+    return done
+
+
+def _run():
+    global _next_pass
+    while not _stop.wait(POLL_SECONDS):
+        if time.monotonic() < _next_pass or not _idle():
+            continue
+        try:
+            done = _prepare_all()
+        except Exception:
+            logger.exception("Background pre-generation failed")
+            done = True
+        if done:
+            _next_pass = time.monotonic() + PASS_INTERVAL_SECONDS
+
+
+def start_pregeneration() -> None:
+    """Arranca el hilo de pre-generación (una sola vez por proceso)."""
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _stop.clear()
+            _thread = Thread(target=_run, name="pregeneration", daemon=True)
+            _thread.start()
+
+
+@atexit.register
+def stop_pregeneration() -> None:
+    """Detiene el hilo y cancela el párrafo que se esté generando."""
+    global _thread
+    _stop.set()
+    with _lock:
+        thread, _thread = _thread, None
+        cancel = _cancel_generation
+    if cancel is not None:
+        cancel()
+    if thread is not None:
+        thread.join(STOP_TIMEOUT_SECONDS)
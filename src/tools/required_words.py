@@ -0,0 +1,168 @@
+"""
+Decodificación con palabras obligatorias para `generate_text`.
+
+`RequiredWordsProcessor` sigue, fila por fila del batch, qué palabras del
+grupo ya aparecieron en el texto generado. Mientras falte alguna bloquea el
+fin de secuencia (EOS) y empuja al modelo hacia las que faltan, cada vez más
+fuerte a medida que se gastan los tokens; cuando los tokens que quedan son
+justo los necesarios para escribirlas, las fuerza.
+
+`WordMatcher` decide si una palabra aparece en el texto: como palabra completa
+("run" no está en "brunch") y buscando todas las palabras en una sola pasada.
+"""
+
+from __future__ import annotations
+from collections import deque
+from typing import Iterable, Sequence
+
+import torch
+from transformers import LogitsProcessor
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class WordMatcher:
+    """
+    Busca varias palabras (o frases) a la vez, sin distinguir mayúsculas y solo
+    como palabras completas.
+
+    Es un autómata de Aho-Corasick: se construye una vez con todas las palabras
+    y cada texto se recorre una sola vez, sin importar cuántas sean.
+    """
+
+    def __init__(self, words: Iterable[str]):
+        # trie: transiciones, enlace de fallo y palabras que terminan en cada estado
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[str]] = [[]]
+        for word in {word.lower() for word in words if word.strip()}:
+            state = 0
+            for char in word:
+                if char not in self._goto[state]:
+                    self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = self._goto[state][char]
+            self._out[state].append(word)
+        # enlaces de fallo por niveles (el sufijo más largo que también es prefijo)
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, child in self._goto[state].items():
+                pending.append(child)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str) -> set[str]:
+        """Palabras (en minúsculas) que aparecen en `text` como palabras completas."""
+        lowered = text.lower()
+        found = set()
+        state = 0
+        for end, char in enumerate(lowered, start=1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for word in self._out[state]:
+                if word not in found and self._bounded(lowered, end - len(word), end):
+                    found.add(word)
+        return found
+
+    @staticmethod
+    def _bounded(text: str, start: int, end: int) -> bool:
+        # sin letras ni dígitos pegados a los extremos (si la palabra empieza o termina con una)
+        if start > 0 and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+            return False
+        return not (end < len(text) and _is_word_char(text[end - 1]) and _is_word_char(text[end]))
+
+    def missing(self, words: Sequence[str], text: str) -> list[str]:
+        """Palabras de `words` que no aparecen en `text`."""
+        found = self.find(text)
+        return [word for word in words if word.strip() and word.lower() not in found]
+
+
+def missing_words(words: Sequence[str], text: str) -> list[str]:
+    """Palabras de `words` que no aparecen en `text` (sin distinguir mayúsculas, como palabras completas)."""
+    return WordMatcher(words).missing(words, text)
+
+
+class RequiredWordsProcessor(LogitsProcessor):
+    """
+    :param words: palabras obligatorias de cada fila del batch.
+    :param prompt_length: largo del prompt (con el padding a la izquierda, igual en todas las filas).
+    :param max_new_tokens: tokens que puede generar cada fila.
+    :param eos_token_id: id o ids que terminan la secuencia.
+    :param boost: logits que se suman, al final del presupuesto, a los tokens que empiezan una palabra faltante.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        words: Sequence[Sequence[str]],
+        prompt_length: int,
+        max_new_tokens: int,
+        eos_token_id: int | Sequence[int],
+        boost: float = 8.0,
+    ):
+        self.tokenizer = tokenizer
+        self.words = [list(group) for group in words]
+        self.prompt_length = prompt_length
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_ids = [eos_token_id] if isinstance(eos_token_id, int) else list(eos_token_id)
+        self.boost = boost
+        # (tokens, empieza con espacio) de cada forma de escribir la palabra, de la más corta a la más larga
+        self._variants = {word: self._encode_variants(word) for group in self.words for word in group}
+        self._matcher = WordMatcher(self._variants)
+
+    def _encode_variants(self, word: str) -> list[tuple[tuple[int, ...], bool]]:
+        variants = {word, word.capitalize(), " " + word, " " + word.capitalize()}
+        encoded = {(tuple(self.tokenizer.encode(variant, add_special_tokens=False)), variant.startswith(" ")) for variant in variants}
+        return sorted((entry for entry in encoded if entry[0]), key=lambda entry: len(entry[0]))
+
+    def _continuation(self, tokens: list[int], missing: list[str]) -> int | None:
+        # siguiente token de una palabra faltante que quedó a medio escribir
+        for word in missing:
+            for sequence, _ in self._variants[word]:
+                for k in range(len(sequence) - 1, 0, -1):
+                    if len(tokens) >= k and tuple(tokens[-k:]) == sequence[:k]:
+                        return sequence[k]
+        return None
+
+    def _start_variants(self, word: str, text: str) -> list[tuple[int, ...]]:
+        # con espacio delante salvo al empezar el texto o después de un espacio
+        spaced = bool(text) and not text[-1].isspace()
+        sequences = [sequence for sequence, starts_with_space in self._variants[word] if starts_with_space == spaced]
+        return sequences or [sequence for sequence, _ in self._variants[word]]
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        generated = input_ids[:, self.prompt_length:]
+        used = generated.shape[1]
+        remaining = self.max_new_tokens - used
+        for row, words in enumerate(self.words):
+            tokens = generated[row].tolist()
+            text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+            missing = [word for word in self._matcher.missing(words, text) if self._variants[word]]
+            if not missing:
+                continue
+            scores[row, self.eos_token_ids] = -float("inf")
+            continuation = self._continuation(tokens, missing)
+            starts = {word: self._start_variants(word, text) for word in missing}
+            # cota por arriba: cada palabra con su forma más larga
+            needed = sum(len(sequence) for word in missing for sequence in starts[word][-1:])
+            if remaining <= needed:
+                # sin margen: se escribe la palabra token por token
+                target = continuation if continuation is not None else starts[missing[0]][0][0]
+                forced = torch.full_like(scores[row], -float("inf"))
+                forced[target] = 0.0
+                scores[row] = forced
+            elif continuation is not None:
+                scores[row, continuation] += self.boost
+            else:
+                first_tokens = list({sequence[0] for word in missing for sequence in starts[word]})
+                scores[row, first_tokens] += self.boost * used / self.max_new_tokens
+        return scores
@@ -0,0 +1,97 @@
+"""
+Buffer de escritura diferida (write-behind) para las calificaciones.
+
+Las calificaciones se acumulan en memoria y se escriben en disco juntas, en
+una sola transacción (UPDATE de tarjetas + historial), al terminar el grupo
+de estudio o cuando vence el temporizador. Como cada escritura es atómica, un
+corte nunca deja tarjetas e historial a medio actualizar; lo que se pierde
+como máximo es lo calificado en los últimos `interval` segundos.
+"""
+
+from __future__ import annotations
+import atexit
+from threading import Lock, RLock, Timer
+from typing import Callable
+
+
+class ReviewBuffer:
+    """
+    Cambios pendientes de un deck.
+
+    :param write: función `write(card_rows, log_rows)` que escribe todo en una transacción.
+    :param interval: segundos máximos que un cambio queda pendiente; 0 desactiva el temporizador.
+    """
+
+    def __init__(self, write: Callable[[list[dict], list[dict]], None], interval: float = 2.0):
+        self._write = write
+        self.interval = interval
+        # card_id -> última fila pendiente (una calificación posterior reemplaza a la anterior)
+        self._cards: dict[int, dict] = {}
+        self._logs: list[dict] = []
+        # RLock: la escritura se hace con el lock tomado, así flush() devuelve con todo en disco
+        self._lock = RLock()
+        self._timer: Timer | None = None
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def add(self, card_rows: list[dict], log_rows: list[dict]) -> None:
+        with self._lock:
+            for row in card_rows:
+                self._cards[row["card_id"]] = row
+            self._logs.extend(log_rows)
+            if self.interval and self._timer is None:
+                self._timer = Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def pending(self) -> dict[int, dict]:
+        """Copia de las filas de tarjetas pendientes (card_id -> fila), sin escribirlas."""
+        with self._lock:
+            return dict(self._cards)
+
+    def flush(self) -> None:
+        """Escribe los cambios pendientes; si la escritura falla quedan pendientes."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._cards and not self._logs:
+                return
+            card_rows, log_rows = list(self._cards.values()), self._logs
+            self._cards, self._logs = {}, []
+            try:
+                self._write(card_rows, log_rows)
+            except Exception:
+                # los cambios hechos mientras tanto son más nuevos que los que fallaron
+                self._cards = {row["card_id"]: row for row in card_rows} | self._cards
+                self._logs = log_rows + self._logs
+                raise
+
+
+# un buffer por deck abierto (clave: URL de la base de datos)
+_buffers: dict[str, ReviewBuffer] = {}
+_buffers_lock = Lock()
+
+
+def loaded_buffer(key: str) -> ReviewBuffer | None:
+    return _buffers.get(key)
+
+
+def register_buffer(key: str, buffer: ReviewBuffer) -> ReviewBuffer:
+    with _buffers_lock:
+        return _buffers.setdefault(key, buffer)
+
+
+def discard_buffer(key: str) -> None:
+    with _buffers_lock:
+        _buffers.pop(key, None)
+
+
+@atexit.register
+def flush_all() -> None:
+    """Escribe los cambios pendientes de todos los decks (también al cerrar la app)."""
+    with _buffers_lock:
+        buffers = list(_buffers.values())
+    for buffer in buffers:
+        buffer.flush()
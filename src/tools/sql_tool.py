@@ -1,106 +1,958 @@
-from sqlalchemy import create_engine, String, Column, Integer, DateTime, Float, Enum
-from sqlalchemy.orm import sessionmaker
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import bindparam, column, create_engine, delete, event, func, inspect, insert, literal, literal_column, select, table, text, tuple_, update, String, Column, ForeignKey, Index, Integer, SmallInteger, Float, TypeDecorator
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.orm.attributes import set_committed_value
 from pathlib import Path
-from typing import List
+from threading import Lock
+from typing import Iterable, List, NamedTuple, Sequence
 
-from utils.config import Base, State, Rating, INITIAL_CARDS_VALUES
+from tools.due_queue import DueQueue, discard_queue, loaded_queue, register_queue
+from tools.fsrs_scheduler import Scheduler, validate_steps
+from tools.review_buffer import ReviewBuffer, discard_buffer, loaded_buffer, register_buffer
+from utils.fsrs_config import INITIAL_CARDS_VALUES, Rating, State
+
+# base de datos con varios decks; no termina en .db para no listarse como archivo de deck
+SHARED_DB_PATH = Path("db") / "decks.sqlite"
+
+# segundos máximos que una calificación queda sin escribir en disco
+WRITE_BEHIND_SECONDS = 2.0
+
+# versión del esquema, guardada en PRAGMA user_version (ver `_ensure_schema`)
+# 1: State/Rating como SMALLINT y las fechas de `deck` como segundos desde epoch
+SCHEMA_VERSION = 1
+
+Base = declarative_base()
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = timedelta(seconds=1)
+
+
+class EpochDateTime(TypeDecorator):
+    """
+    Datetime guardado como INTEGER: segundos desde epoch (UTC). Los naive se
+    asumen UTC y al leer se devuelven naive en UTC, como con el texto ISO anterior.
+    """
+    impl = Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return (value - _EPOCH) // _SECOND
+        # None o segundos ya convertidos
+        return value
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else _EPOCH + timedelta(seconds=value)
+
+
+class IntEnumType(TypeDecorator):
+    """IntEnum guardado como SMALLINT (acepta el miembro o su valor)."""
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum_class):
+        super().__init__()
+        self.enum_class = enum_class
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else int(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.enum_class(value)
+
+
+class DeckInfo(Base):
+    """Decks guardados en la base de datos (uno solo en los archivos `db/<nombre>.db`)."""
+    __tablename__ = "decks"
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
 
 
 class Deck(Base):
     __tablename__ = "deck"
     id = Column(Integer, primary_key=True)
-    word = Column(String, unique=True, index=True)
-    last_review = Column(DateTime)
-    review_datetime = Column(DateTime)
+    # los archivos de un solo deck usan siempre el deck 1
+    deck_id = Column(Integer, ForeignKey("decks.id"), nullable=False, default=1, server_default="1")
+    word = Column(String)
+    last_review = Column(EpochDateTime)
+    review_datetime = Column(EpochDateTime)
     days_since_last_review = Column(Integer)
-    due = Column(DateTime)
+    due = Column(EpochDateTime, index=True)
     stability = Column(Float)
     difficulty = Column(Float)
-    state = Column(Enum(State, native_enum=False, create_constraint=True))  # Entero (1, 2, 3)
-    rating = Column(Enum(Rating, native_enum=False, create_constraint=True))  # Entero (1, 2, 3,
+    state = Column(IntEnumType(State), index=True)  # Entero (1, 2, 3)
+    rating = Column(IntEnumType(Rating))  # Entero (1, 2, 3, 4)
     step = Column(Integer)
+    __table_args__ = (
+        Index("ix_deck_deck_id_word", "deck_id", "word", unique=True),
+        Index("ix_deck_deck_id_due", "deck_id", "due"),
+    )
+
+
+class CardRow(NamedTuple):
+    """Campos de programación de una tarjeta, leídos sin el ORM (ver `get_due_cards`)."""
+    id: int
+    word: str
+    state: State
+    stability: float
+    difficulty: float
+    step: int | None
+    last_review: datetime | None
+    due: datetime | None
+
+
+class ReviewLog(Base):
+    """Historial de repasos: una fila por calificación."""
+    __tablename__ = "review_log"
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, nullable=False)
+    ts = Column(Integer, nullable=False)  # epoch en segundos (UTC)
+    rating = Column(SmallInteger, nullable=False)  # Rating (1, 2, 3, 4)
+    elapsed_days = Column(Integer, nullable=False)
+    __table_args__ = (
+        Index("ix_review_log_card_id_ts", "card_id", "ts"),
+        Index("ix_review_log_ts", "ts"),
+    )
+
+
+class DeckConfig(Base):
+    """Configuración de cada deck (id = id del deck)."""
+    __tablename__ = "deck_config"
+    id = Column(Integer, primary_key=True)
+    parameters = Column(String)  # lista JSON con los 19 pesos FSRS
+    desired_retention = Column(Float)
+    learning_steps = Column(String)  # lista JSON de segundos
+    relearning_steps = Column(String)  # lista JSON de segundos
+    maximum_interval = Column(Integer)
+
+class DeckStat(Base):
+    """
+    Estadísticas de cada deck mantenidas por triggers sobre `deck`: una fila por
+    (tipo, grupo) con el número de tarjetas y la suma de sus difficulty.
+    """
+    __tablename__ = "deck_stats"
+    deck_id = Column(Integer, primary_key=True)
+    kind = Column(String, primary_key=True)  # "total", "state", "stability" o "due_day"
+    bucket = Column(String, primary_key=True)
+    cards = Column(Integer, nullable=False, default=0)
+    difficulty_sum = Column(Float, nullable=False, default=0.0)
+
+class DeckVersion(Base):
+    """Contador de escrituras en las tarjetas de cada deck, incrementado por triggers (ver `deck_version`)."""
+    __tablename__ = "deck_versions"
+    deck_id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+@dataclass
+class DeckStats:
+    total: int
+    by_state: dict[str, int]
+    due_today: int
+    overdue: int
+    stability_histogram: dict[str, int]  # grupos en días, de menor a mayor
+    mean_difficulty: float | None
+
+def _ensure_schema(engine):
+    with engine.connect() as conn:
+        version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+        # decks creados antes de la versión 1 (fechas como texto ISO y enums por nombre)
+        legacy = version < SCHEMA_VERSION and inspect(conn).has_table("deck")
+    # crea las tablas nuevas en decks antiguos
+    Base.metadata.create_all(engine)
+    # agrega las columnas nuevas a tablas que ya existían
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}{default}'))
+    if legacy:
+        with engine.begin() as conn:
+            # pysqlite no abre la transacción antes del DDL: la migración entera es atómica
+            conn.exec_driver_sql("BEGIN")
+            _migrate_compact_storage(conn)
+    # y los índices agregados a tablas que ya existían
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    _ensure_search_index(engine)
+    _ensure_stats_triggers(engine)
+    _ensure_version_triggers(engine)
+    if version < SCHEMA_VERSION:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    if legacy:
+        # devuelve al sistema el espacio de la tabla vieja (fuera de una transacción)
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+
+def _migrate_compact_storage(conn):
+    """
+    Pasa `deck` a la versión 1 del esquema. SQLite no cambia el tipo de una
+    columna con ALTER, así que la tabla se copia en una nueva convirtiendo los
+    valores; índices, búsqueda y estadísticas se vuelven a crear después
+    (ver `_ensure_schema`).
+    """
+    # los triggers y la búsqueda apuntan a la tabla vieja
+    for name in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'deck'")).scalars().all():
+        conn.execute(text(f'DROP TRIGGER "{name}"'))
+    conn.execute(text("DROP TABLE IF EXISTS deck_fts"))
+    conn.execute(text("ALTER TABLE deck RENAME TO deck_legacy"))
+    # los índices siguen con la tabla renombrada y sus nombres chocarían con los nuevos
+    legacy_indexes = conn.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'deck_legacy' AND sql IS NOT NULL"
+    )).scalars().all()
+    for name in legacy_indexes:
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    # la tabla nueva tampoco tiene el UNIQUE de `word` de los primeros decks
+    Deck.__table__.create(conn)
+    columns, values = [], []
+    for column in Deck.__table__.columns:
+        columns.append(column.name)
+        if isinstance(column.type, EpochDateTime):
+            values.append(f"CAST(strftime('%s', {column.name}) AS INTEGER)")
+        elif isinstance(column.type, IntEnumType):
+            cases = " ".join(f"WHEN '{member.name}' THEN {member.value}" for member in column.type.enum_class)
+            values.append(f"CASE {column.name} {cases} END")
+        else:
+            values.append(column.name)
+    conn.execute(text(
+        f"INSERT INTO deck ({', '.join(columns)}) SELECT {', '.join(values)} FROM deck_legacy ORDER BY id"
+    ))
+    conn.execute(text("DROP TABLE deck_legacy"))
+
+# índice de búsqueda por subcadenas (FTS5 trigram), sincronizado con `deck` por triggers
+_SEARCH_INDEX_DDL = (
+    "CREATE VIRTUAL TABLE deck_fts USING fts5(word, content='deck', content_rowid='id', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS deck_fts_ai AFTER INSERT ON deck BEGIN
+        INSERT INTO deck_fts(rowid, word) VALUES (new.id, new.word);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS deck_fts_ad AFTER DELETE ON deck BEGIN
+        INSERT INTO deck_fts(deck_fts, rowid, word) VALUES ('delete', old.id, old.word);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS deck_fts_au AFTER UPDATE OF word ON deck BEGIN
+        INSERT INTO deck_fts(deck_fts, rowid, word) VALUES ('delete', old.id, old.word);
+        INSERT INTO deck_fts(rowid, word) VALUES (new.id, new.word);
+    END""",
+    # indexa las palabras que ya estaban en el deck
+    "INSERT INTO deck_fts(deck_fts) VALUES ('rebuild')",
+)
+
+_deck_fts = table("deck_fts", column("rowid"), column("rank"))
+
+def _ensure_search_index(engine):
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'deck_fts'")).first():
+            return
+        try:
+            for statement in _SEARCH_INDEX_DDL:
+                conn.execute(text(statement))
+        except OperationalError:
+            # SQLite sin FTS5 o sin el tokenizer trigram (< 3.34): get_card usa LIKE
+            conn.rollback()
+
+# grupos del histograma de stability (límite superior en días, etiqueta)
+STABILITY_BUCKETS = ((1, "<1d"), (7, "1-7d"), (30, "7-30d"), (90, "30-90d"), (365, "90-365d"))
+_STABILITY_LAST_BUCKET = "365d+"
+
+def _stability_bucket_sql(stability: str) -> str:
+    cases = " ".join(f"WHEN {stability} < {limit} THEN '{label}'" for limit, label in STABILITY_BUCKETS)
+    return f"CASE WHEN {stability} IS NULL THEN '' {cases} ELSE '{_STABILITY_LAST_BUCKET}' END"
+
+def _state_bucket_sql(state: str) -> str:
+    # el grupo de estado es el nombre, como en `DeckStats.by_state`
+    cases = " ".join(f"WHEN {member.value} THEN '{member.name}'" for member in State)
+    return f"CASE {state} {cases} ELSE '' END"
+
+def _stats_rows_sql(card: str, sign: str) -> str:
+    # filas de deck_stats que aporta (sign = "+") o quita (sign = "-") una tarjeta
+    return f"""INSERT INTO deck_stats (deck_id, kind, bucket, cards, difficulty_sum) VALUES
+            ({card}.deck_id, 'total', '', {sign}1, {sign}coalesce({card}.difficulty, 0)),
+            ({card}.deck_id, 'state', {_state_bucket_sql(f"{card}.state")}, {sign}1, 0),
+            ({card}.deck_id, 'stability', {_stability_bucket_sql(f"{card}.stability")}, {sign}1, 0),
+            ({card}.deck_id, 'due_day', coalesce(date({card}.due, 'unixepoch'), ''), {sign}1, 0)
+        ON CONFLICT (deck_id, kind, bucket) DO UPDATE SET
+            cards = cards + excluded.cards,
+            difficulty_sum = difficulty_sum + excluded.difficulty_sum;"""
+
+# los días sin tarjetas se borran para que el histograma no crezca sin límite
+_DROP_EMPTY_DUE_DAY = """DELETE FROM deck_stats
+        WHERE deck_id = old.deck_id AND kind = 'due_day' AND bucket = coalesce(date(old.due, 'unixepoch'), '') AND cards = 0;"""
+
+_STATS_TRIGGERS_DDL = (
+    f"""CREATE TRIGGER deck_stats_ai AFTER INSERT ON deck BEGIN
+        {_stats_rows_sql("new", "+")}
+    END""",
+    f"""CREATE TRIGGER deck_stats_ad AFTER DELETE ON deck BEGIN
+        {_stats_rows_sql("old", "-")}
+        {_DROP_EMPTY_DUE_DAY}
+    END""",
+    f"""CREATE TRIGGER deck_stats_au AFTER UPDATE OF deck_id, due, stability, difficulty, state ON deck BEGIN
+        {_stats_rows_sql("old", "-")}
+        {_stats_rows_sql("new", "+")}
+        {_DROP_EMPTY_DUE_DAY}
+    END""",
+)
+
+def _ensure_stats_triggers(engine):
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'deck_stats_ai'")).first():
+            return
+        for statement in _STATS_TRIGGERS_DDL:
+            conn.execute(text(statement))
+        # las tarjetas que ya estaban en el deck
+        _rebuild_stats(conn)
+
+def _bump_version_sql(card: str) -> str:
+    return f"""INSERT INTO deck_versions (deck_id, version) VALUES ({card}.deck_id, 1)
+        ON CONFLICT (deck_id) DO UPDATE SET version = version + 1;"""
+
+_VERSION_TRIGGERS_DDL = (
+    f"""CREATE TRIGGER deck_versions_ai AFTER INSERT ON deck BEGIN
+        {_bump_version_sql("new")}
+    END""",
+    f"""CREATE TRIGGER deck_versions_ad AFTER DELETE ON deck BEGIN
+        {_bump_version_sql("old")}
+    END""",
+    f"""CREATE TRIGGER deck_versions_au AFTER UPDATE ON deck BEGIN
+        {_bump_version_sql("old")}
+        {_bump_version_sql("new")}
+    END""",
+)
+
+def _ensure_version_triggers(engine):
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'deck_versions_ai'")).first():
+            return
+        for statement in _VERSION_TRIGGERS_DDL:
+            conn.execute(text(statement))
+
+def deck_version(session) -> int:
+    """
+    Número que cambia con cada alta, baja o modificación de una tarjeta del deck
+    (también las hechas desde otra sesión). No incluye las calificaciones que
+    siguen en el buffer, ver `pending_reviews`.
+    """
+    version = session.execute(
+        select(DeckVersion.version).where(DeckVersion.deck_id == session_deck_id(session))
+    ).scalar()
+    return version or 0
+
+def _rebuild_stats(conn):
+    conn.execute(delete(DeckStat))
+    conn.execute(text(f"""
+        INSERT INTO deck_stats (deck_id, kind, bucket, cards, difficulty_sum)
+        SELECT deck_id, 'total', '', count(*), total(difficulty) FROM deck GROUP BY deck_id
+        UNION ALL
+        SELECT deck_id, 'state', {_state_bucket_sql("state")}, count(*), 0 FROM deck GROUP BY 1, 3
+        UNION ALL
+        SELECT deck_id, 'stability', {_stability_bucket_sql("stability")}, count(*), 0 FROM deck GROUP BY 1, 3
+        UNION ALL
+        SELECT deck_id, 'due_day', coalesce(date(due, 'unixepoch'), ''), count(*), 0 FROM deck GROUP BY 1, 3
+    """))
+
+def rebuild_stats(session):
+    """Recalcula desde cero las estadísticas de todos los decks de la base de datos (reparación)."""
+    flush_reviews(session)
+    _rebuild_stats(session.connection())
+    session.commit()
+
+def get_deck_stats(session, now: datetime | None = None) -> DeckStats:
+    """
+    Estadísticas del deck leídas de `deck_stats`, sin recorrer `deck`: el costo
+    depende del número de grupos (días con vencimientos), no de las tarjetas.
+    """
+    flush_reviews(session)
+    if now is None:
+        now = datetime.now(timezone.utc)
+    today = now.astimezone(timezone.utc).date().isoformat()
+    rows = session.execute(
+        select(DeckStat.kind, DeckStat.bucket, DeckStat.cards, DeckStat.difficulty_sum)
+        .where(DeckStat.deck_id == session_deck_id(session), DeckStat.cards != 0)
+    ).all()
+    total, difficulty_sum, due_today, overdue = 0, 0.0, 0, 0
+    by_state = {state.name: 0 for state in State}
+    histogram = {label: 0 for _, label in STABILITY_BUCKETS}
+    histogram[_STABILITY_LAST_BUCKET] = 0
+    for kind, bucket, cards, bucket_difficulty in rows:
+        if kind == "total":
+            total, difficulty_sum = cards, bucket_difficulty
+        elif kind == "state" and bucket in by_state:
+            by_state[bucket] = cards
+        elif kind == "stability" and bucket in histogram:
+            histogram[bucket] = cards
+        elif kind == "due_day" and bucket:
+            if bucket == today:
+                due_today += cards
+            elif bucket < today:
+                overdue += cards
+    return DeckStats(
+        total=total,
+        by_state=by_state,
+        due_today=due_today,
+        overdue=overdue,
+        stability_histogram=histogram,
+        mean_difficulty=difficulty_sum / total if total else None,
+    )
+
+def _has_search_index(session) -> bool:
+    return session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'deck_fts'")).first() is not None
+
+# pragmas de cada conexión nueva
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # los lectores no bloquean al escritor (ni al buffer de calificaciones)
+    "synchronous": "NORMAL",  # con WAL sigue siendo seguro ante caídas de la app
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # en KiB: 64 MiB
+    "busy_timeout": 5000,
+}
+
+# un engine y un sessionmaker por archivo de deck, compartidos por todo el proceso
+_engines: dict[Path, tuple] = {}
+_engines_lock = Lock()
+
+def _set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def deck_engine(db_path: Path) -> tuple:
+    """(engine, sessionmaker) del deck; se crean y se migran solo la primera vez."""
+    key = db_path.resolve()
+    with _engines_lock:
+        if key not in _engines:
+            engine = create_engine(f'sqlite:///{db_path}')
+            event.listen(engine, "connect", _set_pragmas)
+            _ensure_schema(engine)
+            # las calificaciones se escriben con write-behind (ver `review_cards`); sin
+            # expirar en cada commit, las tarjetas cargadas conservan su estado en memoria
+            _engines[key] = engine, sessionmaker(bind=engine, expire_on_commit=False)
+        return _engines[key]
+
+def close_engine(db_path: Path):
+    """Cierra las conexiones del deck y lo quita del registro (p. ej. antes de borrar el archivo)."""
+    with _engines_lock:
+        entry = _engines.pop(Path(db_path).resolve(), None)
+    if entry is not None:
+        # al cerrarse la última conexión SQLite integra el WAL y borra los archivos -wal/-shm
+        entry[0].dispose()
+
+def session_deck_id(session) -> int:
+    # id del deck de la sesión dentro de su base de datos
+    return session.info.get("deck_id", 1)
+
+def deck_key(session) -> str:
+    """Identifica el deck de la sesión en todo el proceso (base de datos + deck_id)."""
+    return f"{session.bind.url}#{session_deck_id(session)}"
+
+def shared_deck_id(deck_name: str) -> int | None:
+    engine, _ = deck_engine(SHARED_DB_PATH)
+    with engine.connect() as conn:
+        return conn.execute(select(DeckInfo.id).where(DeckInfo.name == deck_name)).scalar()
 
 def new_deck_db(deck_name):
-    db_path = Path("db") / f"{deck_name}.db"
-    if db_path.exists():
+    """Crea un deck en la base de datos compartida."""
+    if (Path("db") / f"{deck_name}.db").exists() or shared_deck_id(deck_name) is not None:
         return "deck already exists"
-    engine = create_engine(f'sqlite:///{db_path}', echo=True)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    engine, Session = deck_engine(SHARED_DB_PATH)
+    with engine.begin() as conn:
+        deck_id = conn.execute(insert(DeckInfo).values(name=deck_name)).inserted_primary_key[0]
+    session = Session(info={"deck_id": deck_id})
     return session
 
 def open_deck(deck_name):
-    db_path = Path("db") / deck_name
-    engine = create_engine(f'sqlite:///{db_path}')
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    """
+    Abre un deck: `<nombre>.db` es un archivo de un solo deck en db/ y
+    cualquier otro nombre es un deck de la base de datos compartida.
+
+    :return: (ruta de la base de datos, sesión del deck)
+    """
+    if deck_name.endswith(".db"):
+        db_path = Path("db") / deck_name
+        deck_id = 1
+    else:
+        db_path = SHARED_DB_PATH
+        deck_id = shared_deck_id(deck_name)
+        if deck_id is None:
+            raise ValueError(f"Deck {deck_name!r} not found")
+    _, Session = deck_engine(db_path)
+    session = Session(info={"deck_id": deck_id})
     return db_path, session
 
-def add_cards(session, words: List[str]):
-    for word in words:
-        # Check if the word exists (case-sensitive)
-        if not session.query(Deck).filter(Deck.word == word).first():
-            card = Deck(word=word,
-                        last_review=INITIAL_CARDS_VALUES["last_review"],
-                        review_datetime=INITIAL_CARDS_VALUES["review_datetime"],
-                        days_since_last_review=INITIAL_CARDS_VALUES["days_since_last_review"],
-                        due=INITIAL_CARDS_VALUES["due"],
-                        stability=INITIAL_CARDS_VALUES["stability"],
-                        difficulty=INITIAL_CARDS_VALUES["difficulty"],
-                        state=INITIAL_CARDS_VALUES["state"],
-                        rating=INITIAL_CARDS_VALUES["rating"],
-                        step=INITIAL_CARDS_VALUES["step"])
-            session.add(card)
+def add_cards(session, words: Iterable[str]) -> int:
+    """
+    Agrega tarjetas nuevas con un único INSERT OR IGNORE ... SELECT sobre
+    json_each, en una transacción. Las palabras que ya existen (case-sensitive)
+    se ignoran.
+
+    :return: número de tarjetas agregadas.
+    """
+    words = list(dict.fromkeys(words))
+    if not words:
+        return 0
+    table = Deck.__table__
+    new_words = func.json_each(json.dumps(words)).table_valued("value")
+    statement = insert(table).prefix_with("OR IGNORE").from_select(
+        [*INITIAL_CARDS_VALUES, "deck_id", "word"],
+        select(
+            *(literal(value, table.c[column].type) for column, value in INITIAL_CARDS_VALUES.items()),
+            literal(session_deck_id(session)),
+            new_words.c.value,
+        ),
+    )
+    last_id = session.execute(select(func.max(Deck.id))).scalar() or 0
+    added = session.execute(statement).rowcount
     session.commit()
+    queue = loaded_queue(deck_key(session))
+    if queue is not None and added:
+        # los ids nuevos son mayores que el último id existente
+        new_cards = select(Deck.id, Deck.due).where(Deck.deck_id == session_deck_id(session), Deck.id > last_id)
+        for card_id, due in session.execute(new_cards):
+            queue.push(card_id, due)
+    return added
 
-def update_card(session, word, last_review=None, review_datetime=None, days_since_last_review=None, due=None, stability=None, difficulty=None, state=None, rating=None, step=None, new_word=None, restore=False):
+def update_card(session, word, last_review=None, review_datetime=None, days_since_last_review=None, due=None, stability=None, difficulty=None, state=None, rating=None, step=None, new_word=None, restore=False) -> bool:
+    """
+    Edita una tarjeta buscada por palabra: la renombra (`new_word`), la vuelve a su
+    estado inicial (`restore`) o reemplaza sus campos de programación.
+
+    :return: False si la palabra no está en el deck (no se cambia nada).
+    """
+    # una calificación pendiente no debe pisar este cambio
+    flush_reviews(session)
     # Check if the word exists (case-sensitive)
-    card = session.query(Deck).filter(Deck.word == word).first()
-    if card:
-        if restore:
-            # Restore the card to its initial state
-            card.last_review = INITIAL_CARDS_VALUES["last_review"]
-            card.review_datetime = INITIAL_CARDS_VALUES["review_datetime"]
-            card.days_since_last_review = INITIAL_CARDS_VALUES["days_since_last_review"]
-            card.due = INITIAL_CARDS_VALUES["due"]
-            card.stability = INITIAL_CARDS_VALUES["stability"]
-            card.difficulty = INITIAL_CARDS_VALUES["difficulty"]
-            card.state = INITIAL_CARDS_VALUES["state"]
-            card.rating = INITIAL_CARDS_VALUES["rating"]
-            card.step = INITIAL_CARDS_VALUES["step"]
+    card = session.query(Deck).filter(Deck.deck_id == session_deck_id(session), Deck.word == word).first()
+    if card is None:
+        return False
+    if restore:
+        # Restore the card to its initial state
+        card.last_review = INITIAL_CARDS_VALUES["last_review"]
+        card.review_datetime = INITIAL_CARDS_VALUES["review_datetime"]
+        card.days_since_last_review = INITIAL_CARDS_VALUES["days_since_last_review"]
+        card.due = INITIAL_CARDS_VALUES["due"]
+        card.stability = INITIAL_CARDS_VALUES["stability"]
+        card.difficulty = INITIAL_CARDS_VALUES["difficulty"]
+        card.state = INITIAL_CARDS_VALUES["state"]
+        card.rating = INITIAL_CARDS_VALUES["rating"]
+        card.step = INITIAL_CARDS_VALUES["step"]
+    else:
+        if new_word:
+            card.word = new_word
         else:
-            if new_word:
-                card.word = new_word
-            else:
-                card.last_review = last_review
-                card.review_datetime = review_datetime
-                card.days_since_last_review = days_since_last_review
-                card.due = due
-                card.stability = stability
-                card.difficulty = difficulty
-                card.state = state
-                card.rating = rating
-                card.step = step
+            card.last_review = last_review
+            card.review_datetime = review_datetime
+            card.days_since_last_review = days_since_last_review
+            card.due = due
+            card.stability = stability
+            card.difficulty = difficulty
+            card.state = state
+            card.rating = rating
+            card.step = step
+    session.commit()
+    queue = loaded_queue(deck_key(session))
+    if queue is not None:
+        queue.push(card.id, card.due)
+    return True
+
+def delete_card(session, card):
+    flush_reviews(session)
+    card_id = card.id
+    session.delete(card)
+    session.commit()
+    queue = loaded_queue(deck_key(session))
+    if queue is not None:
+        queue.remove(card_id)
+
+def get_due_queue(session) -> DueQueue:
+    """Índice de vencimientos del deck; se carga de la base de datos la primera vez."""
+    key = deck_key(session)
+    queue = loaded_queue(key)
+    if queue is None:
+        flush_reviews(session)
+        entries = session.execute(select(Deck.id, Deck.due).where(Deck.deck_id == session_deck_id(session))).all()
+        queue = register_queue(key, DueQueue(entries))
+    return queue
+
+def close_due_queue(session):
+    """Olvida el índice de vencimientos y el buffer de escritura del deck (p. ej. al borrar el deck)."""
+    flush_reviews(session)
+    discard_queue(deck_key(session))
+    discard_buffer(deck_key(session))
+
+def next_due(session) -> datetime | None:
+    """Fecha de vencimiento más próxima del deck, leída del índice en memoria."""
+    return get_due_queue(session).peek()
+
+def next_due_cards(session, limit: int | None = None, now: datetime | None = None) -> List[CardRow]:
+    """
+    Próximas tarjetas vencidas por orden de vencimiento. Los ids salen del índice
+    en memoria en O(k log n) (ver `get_due_queue`) y solo esas filas se leen, por id.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    card_ids = get_due_queue(session).next_due(limit, now=now)
+    cards = {}
+    for i in range(0, len(card_ids), 500):
+        for card in get_due_cards(session, now=now, ids=card_ids[i:i + 500]):
+            cards[card.id] = card
+    return [cards[card_id] for card_id in card_ids if card_id in cards]
+
+DUE_ORDERS = ("due", "random", "priority")
+
+def get_due_cards(
+    session,
+    now: datetime | None = None,
+    limit: int | None = None,
+    order: str = "due",
+    after: tuple[datetime, int] | None = None,
+    state: State | None = None,
+    ids: Sequence[int] | None = None,
+) -> List[CardRow]:
+    """
+    Tarjetas vencidas, ordenadas y limitadas en la base de datos (usa el índice de `due`).
+
+    Se leen con Core (sin el ORM ni el identity map) como `CardRow`; las
+    calificaciones se guardan por id con `review_cards`.
+
+    :param limit: máximo de tarjetas a cargar (límite de la sesión).
+    :param order: "due" (las más antiguas primero), "random" (muestra aleatoria) o
+        "priority" (menor retrievability primero: más días de atraso por día de stability).
+    :param after: (due, id) de la última tarjeta de la página anterior; solo con order="due".
+    :param state: solo las tarjetas en ese estado.
+    :param ids: solo las tarjetas con esos ids.
+    """
+    if order not in DUE_ORDERS:
+        raise ValueError(f"order must be one of {DUE_ORDERS}")
+    flush_reviews(session)
+    if now is None:
+        now = datetime.now(timezone.utc)
+    # las fechas se guardan en UTC sin zona horaria
+    now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    table = Deck.__table__
+    query = select(*(table.c[name] for name in CardRow._fields)).where(
+        Deck.deck_id == session_deck_id(session), Deck.due <= now
+    )
+    if state is not None:
+        query = query.where(Deck.state == state)
+    if ids is not None:
+        query = query.where(Deck.id.in_(ids))
+    if order == "due":
+        if after is not None:
+            after_due, after_id = after
+            if after_due.tzinfo is not None:
+                after_due = after_due.astimezone(timezone.utc).replace(tzinfo=None)
+            # paginación por clave: sigue después de (due, id) sin OFFSET
+            query = query.where(tuple_(Deck.due, Deck.id) > tuple_(literal(after_due, Deck.due.type), after_id))
+        query = query.order_by(Deck.due, Deck.id)
+    elif after is not None:
+        raise ValueError('after is only supported with order="due"')
+    elif order == "random":
+        query = query.order_by(func.random())
     else:
-        print(f"Card with word '{word}' not found.")
-    session.commit()        
-
-def get_card(session, search_input):
-    # recuperar todas las coincidencias que contenga esa palabra
-    matches = (
-        session
-        .query(Deck)
-        .filter(Deck.word.ilike(f"%{search_input}%"))
-        .order_by(Deck.word)
-        .all()
+        overdue_days = (literal(now, Deck.due.type) - Deck.due) / 86400.0
+        query = query.order_by((overdue_days / func.max(Deck.stability, 0.01)).desc(), Deck.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [CardRow(*row) for row in session.execute(query)]
+
+def _write_reviews(engine, card_rows: list[dict], log_rows: list[dict]):
+    # tarjetas e historial en una sola transacción
+    table = Deck.__table__
+    with engine.begin() as conn:
+        if card_rows:
+            conn.execute(update(table).where(table.c.id == bindparam("card_id")), card_rows)
+        if log_rows:
+            conn.execute(insert(ReviewLog), log_rows)
+
+def get_review_buffer(session) -> ReviewBuffer:
+    """Buffer de escritura diferida del deck."""
+    key = deck_key(session)
+    buffer = loaded_buffer(key)
+    if buffer is None:
+        engine = session.bind
+        buffer = register_buffer(
+            key, ReviewBuffer(lambda cards, logs: _write_reviews(engine, cards, logs), WRITE_BEHIND_SECONDS)
+        )
+    return buffer
+
+def pending_reviews(session) -> dict[int, dict]:
+    """Calificaciones del deck que todavía no se escribieron (card_id -> columnas), sin escribirlas."""
+    buffer = loaded_buffer(deck_key(session))
+    return {} if buffer is None else buffer.pending()
+
+def flush_reviews(session):
+    """Escribe en disco las calificaciones pendientes del deck."""
+    buffer = loaded_buffer(deck_key(session))
+    if buffer is not None:
+        buffer.flush()
+
+def review_cards(session, cards: Sequence[CardRow | Deck], rating, **columns):
+    """
+    Guarda el resultado del programador para un grupo de tarjetas (write-behind).
+
+    El UPDATE por id y el historial quedan en el buffer del deck (ver
+    `flush_reviews`); el índice de vencimientos y las tarjetas ORM que estén en
+    la sesión se actualizan en el acto.
+
+    :param cards: tarjetas calificadas; solo se usa su id.
+    :param columns: una secuencia por columna de `Deck` (last_review, review_datetime, due, ...),
+        en el orden de `cards`.
+    """
+    if not cards:
+        return
+    queue = loaded_queue(deck_key(session))
+    mapper = inspect(Deck)
+    card_rows = []
+    log_rows = []
+    for i, card in enumerate(cards):
+        values = {name: column[i] for name, column in columns.items()}
+        values["rating"] = rating
+        loaded = session.identity_map.get(mapper.identity_key_from_primary_key([card.id]))
+        if loaded is not None:
+            for name, value in values.items():
+                # sin marcar la tarjeta como modificada: el UPDATE lo hace el buffer
+                set_committed_value(loaded, name, value)
+        card_rows.append({"card_id": card.id, **values})
+        log_rows.append({
+            "card_id": card.id,
+            "ts": int(values["review_datetime"].timestamp()),
+            "rating": int(rating),
+            "elapsed_days": values["days_since_last_review"],
+        })
+        if queue is not None:
+            queue.push(card.id, values["due"])
+    get_review_buffer(session).add(card_rows, log_rows)
+
+def get_review_log(session, since: datetime, until: datetime | None = None, card_id: int | None = None):
+    """
+    Repasos en el rango [since, until) ordenados por fecha, usando los índices por ts.
+    """
+    flush_reviews(session)
+    query = (
+        select(ReviewLog)
+        .join(Deck, Deck.id == ReviewLog.card_id)
+        .where(Deck.deck_id == session_deck_id(session), ReviewLog.ts >= int(since.timestamp()))
+    )
+    if until is not None:
+        query = query.where(ReviewLog.ts < int(until.timestamp()))
+    if card_id is not None:
+        query = query.where(ReviewLog.card_id == card_id)
+    return session.scalars(query.order_by(ReviewLog.ts)).all()
+
+def get_parameters(session) -> tuple:
+    """Devuelve los pesos FSRS del deck, o los de por defecto si no se ajustaron."""
+    return get_scheduler(session).parameters
+
+# programador de cada deck (ver `deck_key`) junto con la fila de `DeckConfig` con la que se construyó
+_schedulers: dict[str, tuple[tuple | None, Scheduler]] = {}
+_schedulers_lock = Lock()
+
+def _build_scheduler(config) -> Scheduler:
+    scheduler = Scheduler()
+    if config is None:
+        return scheduler
+    settings = scheduler.settings()
+    if config.parameters:
+        settings["parameters"] = json.loads(config.parameters)
+    if config.desired_retention is not None:
+        settings["desired_retention"] = config.desired_retention
+    if config.learning_steps is not None:
+        settings["learning_steps"] = json.loads(config.learning_steps)
+    if config.relearning_steps is not None:
+        settings["relearning_steps"] = json.loads(config.relearning_steps)
+    if config.maximum_interval is not None:
+        settings["maximum_interval"] = config.maximum_interval
+    try:
+        return Scheduler.from_settings(settings)
+    except ValueError:
+        # pasos guardados antes de validarlos: se usan los de por defecto
+        defaults = scheduler.settings()
+        settings["learning_steps"] = defaults["learning_steps"]
+        settings["relearning_steps"] = defaults["relearning_steps"]
+        return Scheduler.from_settings(settings)
+
+def get_scheduler(session) -> Scheduler:
+    """
+    Programador del deck con su configuración guardada.
+
+    Se comparte entre todas las sesiones del proceso que abren el deck. Cada
+    llamada lee la fila de `DeckConfig` (por clave primaria) y el programador se
+    vuelve a construir solo si cambió, así un cambio guardado desde otra sesión
+    u otro proceso se ve en la siguiente calificación.
+    """
+    config = session.execute(
+        select(
+            DeckConfig.parameters,
+            DeckConfig.desired_retention,
+            DeckConfig.learning_steps,
+            DeckConfig.relearning_steps,
+            DeckConfig.maximum_interval,
+        ).where(DeckConfig.id == session_deck_id(session))
+    ).first()
+    stamp = None if config is None else tuple(config)
+    key = deck_key(session)
+    with _schedulers_lock:
+        cached = _schedulers.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    scheduler = _build_scheduler(config)
+    with _schedulers_lock:
+        _schedulers[key] = stamp, scheduler
+    return scheduler
+
+def _deck_config(session) -> DeckConfig:
+    config = session.get(DeckConfig, session_deck_id(session))
+    if config is None:
+        config = DeckConfig(id=session_deck_id(session))
+        session.add(config)
+    return config
+
+def save_parameters(session, parameters):
+    config = _deck_config(session)
+    config.parameters = json.dumps([float(w) for w in parameters])
+    session.commit()
+
+def save_scheduler_settings(session, desired_retention: float, learning_steps: Sequence[float], relearning_steps: Sequence[float], maximum_interval: int):
+    """
+    Guarda la configuración del programador del deck.
+
+    :param learning_steps: pasos de aprendizaje en segundos (al menos uno).
+    :param relearning_steps: pasos de reaprendizaje en segundos.
+    :raises ValueError: si los pasos no son válidos, ver `validate_steps`.
+    """
+    learning_steps = [float(step) for step in learning_steps]
+    relearning_steps = [float(step) for step in relearning_steps]
+    validate_steps(
+        [timedelta(seconds=step) for step in learning_steps],
+        [timedelta(seconds=step) for step in relearning_steps],
     )
-    cards = matches
-    card_names = [card.word for card in matches]
+    config = _deck_config(session)
+    config.desired_retention = float(desired_retention)
+    config.learning_steps = json.dumps(learning_steps)
+    config.relearning_steps = json.dumps(relearning_steps)
+    config.maximum_interval = int(maximum_interval)
+    session.commit()
+
+def get_card(session, search_input, limit: int = 50):
+    """
+    Busca tarjetas cuya palabra contenga `search_input` (sin distinguir mayúsculas).
+
+    Usa el índice trigram: primero la coincidencia exacta, luego las que empiezan
+    por la búsqueda y después el resto por relevancia. Con menos de 3 caracteres
+    (el mínimo del trigram) se recorre la tabla con LIKE, con el mismo orden.
+
+    :return: (tarjetas, palabras), como mucho `limit`; vacías si la búsqueda está vacía.
+    """
+    flush_reviews(session)
+    if not search_input:
+        return [], []
+    if len(search_input) < 3 or not _has_search_index(session):
+        query = (
+            select(Deck)
+            .where(Deck.deck_id == session_deck_id(session), Deck.word.ilike(f"%{search_input}%"))
+            .order_by(
+                (func.lower(Deck.word) == search_input.lower()).desc(),
+                Deck.word.ilike(f"{search_input}%").desc(),
+                func.length(Deck.word),
+                Deck.word,
+            )
+        )
+    else:
+        phrase = '"' + search_input.replace('"', '""') + '"'
+        matches = (
+            select(_deck_fts.c.rowid.label("id"), _deck_fts.c.rank)
+            .where(literal_column("deck_fts").op("MATCH")(phrase))
+            .subquery()
+        )
+        query = (
+            select(Deck)
+            .join(matches, matches.c.id == Deck.id)
+            .where(Deck.deck_id == session_deck_id(session))
+            .order_by(
+                (func.lower(Deck.word) == search_input.lower()).desc(),
+                Deck.word.ilike(f"{search_input}%").desc(),
+                matches.c.rank,
+                Deck.word,
+            )
+        )
+    cards = list(session.scalars(query.limit(limit)))
+    card_names = [card.word for card in cards]
     return cards, card_names
 
+def autocomplete_words(session, prefix: str, limit: int = 10) -> List[str]:
+    """
+    Palabras que empiezan por `prefix` en orden alfabético, con un recorrido
+    por rango del índice (deck_id, word) (distingue mayúsculas, como la columna).
+    """
+    if not prefix:
+        return []
+    query = (
+        select(Deck.word)
+        .where(Deck.deck_id == session_deck_id(session), Deck.word >= prefix, Deck.word < prefix + "\U0010ffff")
+        .order_by(Deck.word)
+        .limit(limit)
+    )
+    return list(session.scalars(query))
+
 def deck_selection():
     # retrieve files from db folder
     db_folder = Path("db")
     db_files = [f.name for f in db_folder.glob("*.db")]
-    return db_files
\ No newline at end of file
+    # y los decks de la base de datos compartida
+    if SHARED_DB_PATH.exists():
+        engine, _ = deck_engine(SHARED_DB_PATH)
+        with engine.connect() as conn:
+            db_files += conn.execute(select(DeckInfo.name).order_by(DeckInfo.name)).scalars().all()
+    return db_files
+
+def delete_deck(deck_name):
+    """Borra un deck: el archivo si es un `.db`, o sus filas en la base de datos compartida."""
+    if deck_name.endswith(".db"):
+        db_path = Path("db") / deck_name
+        close_engine(db_path)
+        db_path.unlink()
+        return
+    deck_id = shared_deck_id(deck_name)
+    if deck_id is None:
+        return
+    engine, _ = deck_engine(SHARED_DB_PATH)
+    cards = select(Deck.id).where(Deck.deck_id == deck_id)
+    with engine.begin() as conn:
+        conn.execute(delete(ReviewLog).where(ReviewLog.card_id.in_(cards)))
+        conn.execute(delete(Deck).where(Deck.deck_id == deck_id))
+        conn.execute(delete(DeckConfig).where(DeckConfig.id == deck_id))
+        conn.execute(delete(DeckStat).where(DeckStat.deck_id == deck_id))
+        # la fila de `deck_versions` se conserva: un deck nuevo con el mismo id sigue
+        # la numeración y no coincide con los pronósticos guardados del borrado
+        conn.execute(delete(DeckInfo).where(DeckInfo.id == deck_id))
+
+def due_counts(now: datetime | None = None) -> dict[str, int]:
+    """
+    Tarjetas vencidas de cada deck de la base de datos compartida, en una sola
+    consulta agrupada sobre el índice (deck_id, due).
+    """
+    if not SHARED_DB_PATH.exists():
+        return {}
+    if now is None:
+        now = datetime.now(timezone.utc)
+    now = now.astimezone(timezone.utc).replace(tzinfo=None)
+    engine, _ = deck_engine(SHARED_DB_PATH)
+    due = (
+        select(Deck.deck_id, func.count().label("due"))
+        .where(Deck.due <= now)
+        .group_by(Deck.deck_id)
+        .subquery()
+    )
+    query = select(DeckInfo.name, func.coalesce(due.c.due, 0)).outerjoin(due, due.c.deck_id == DeckInfo.id)
+    with engine.connect() as conn:
+        return dict(conn.execute(query).all())
\ No newline at end of file
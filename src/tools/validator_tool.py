@@ -1,24 +1,29 @@
 from utils.config import nlp
 
+def _is_valid(doc) -> bool:
+    # Validamos que cada token importante no sea OOV (fuera del vocabulario)
+    return all(token.is_alpha and not token.is_oov for token in doc if not token.is_stop)
+
 def validate_word(word: str) -> bool:
     # evitar dobles espacios
     word = ' '.join(word.split())
     
     doc = nlp(word)
-    # Validamos que cada token importante no sea OOV (fuera del vocabulario)
-    return all(token.is_alpha and not token.is_oov for token in doc if not token.is_stop)
+    return _is_valid(doc)
 
 def validate_words(words: list) -> list:
     """
     Valida una lista de palabras o words, asegurando que cada una sea válida según las reglas definidas.
+    Solo se usan atributos léxicos, así que basta con el tokenizer procesando por lotes.
     
     :param words: Lista de palabras o words a validar.
     :return: Lista de palabras o words válidas.
     """
     valid_words = []
     invalid_words = []
-    for word in words:
-        if validate_word(word):
+    normalized = (' '.join(word.split()) for word in words)
+    for word, doc in zip(words, nlp.tokenizer.pipe(normalized, batch_size=1000)):
+        if _is_valid(doc):
             valid_words.append(word)
         else:
             invalid_words.append(word)
@@ -1,9 +1,9 @@
+import importlib.util
+import logging
+import os
 import torch
-from sqlalchemy.orm import declarative_base
 import json
 from pathlib import Path
-from datetime import datetime, timezone
-from enum import IntEnum
 import streamlit as st
 from transformers import (
     pipeline,
@@ -13,6 +13,10 @@ from transformers import (
 from kokoro import KPipeline
 import spacy
 
+from utils.fsrs_config import DEFAULT_PARAMETERS, DECAY, FACTOR, INITIAL_CARDS_VALUES, State, Rating
+
+logger = logging.getLogger(__name__)
+
 
 # cargar los parametros de user_preferences.json
 # Ruta relativa desde la raíz del proyecto
@@ -36,13 +40,25 @@ def load_user_preferences():
             data = json.load(f)
             return {
                 "model": data.get("model", "Qwen/Qwen3-4B-FP8"),
-                "voice": data.get("voice", "femenina")
+                "voice": data.get("voice", "femenina"),
+                "cpu_precision": data.get("cpu_precision", "int8"),
             }
 
 
 pref = load_user_preferences()
 
-MODEL_NAME = pref["model"]
+DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# sin CUDA el modelo de texto corre en la CPU (ver `load_text_model`)
+CPU_MODE = DEVICE.type == "cpu"
+# precisión del modelo de texto en la CPU (preferencia del usuario): "int8" (pesos de las
+# capas lineales en int8 con torchao), "bfloat16" (si la CPU lo soporta, si no float32) o "float32"
+CPU_PRECISIONS = ("int8", "bfloat16", "float32")
+CPU_PRECISION = pref["cpu_precision"] if pref["cpu_precision"] in CPU_PRECISIONS else "int8"
+# hilos de torch: los núcleos disponibles para el proceso (respeta el cpuset del contenedor)
+CPU_THREADS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+
+# los checkpoints FP8 necesitan kernels de CUDA; en la CPU se usa el modelo base
+MODEL_NAME = pref["model"].removesuffix("-FP8") if CPU_MODE else pref["model"]
 
 if VOICE := pref["voice"] == "femenina":
     VOICE = "af_heart"
@@ -50,9 +66,50 @@ else:
     VOICE = "am_adam"
 
 
-Base = declarative_base()
+def _cpu_bf16_supported() -> bool:
+    try:
+        return torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def load_text_model():
+    """
+    Modelo de texto en la GPU (float16) o, sin CUDA, en la CPU con `CPU_PRECISION`.
+
+    En la CPU decodificar está limitado por la lectura de los pesos, así que int8
+    (solo los pesos, con torchao; las activaciones quedan en bfloat16 o float32) es
+    lo más rápido. Sin torchao se usa bfloat16 y, si la CPU no lo soporta, float32.
+    """
+    if not CPU_MODE:
+        return AutoModelForCausalLM.from_pretrained(
+            MODEL_NAME,
+            device_map="cuda:0",
+            trust_remote_code=True,
+            dtype =torch.float16,
+            # dtype=torch.float8_e4m3fn,
+        )
+    torch.set_num_threads(CPU_THREADS)
+    precision = CPU_PRECISION
+    if precision == "int8" and importlib.util.find_spec("torchao") is None:
+        logger.warning("torchao is not installed; the text model is not quantized to int8")
+        precision = "bfloat16"
+    dtype = torch.bfloat16 if precision != "float32" and _cpu_bf16_supported() else torch.float32
+    if precision == "bfloat16" and dtype == torch.float32:
+        precision = "float32"
+    model = AutoModelForCausalLM.from_pretrained(
+        MODEL_NAME,
+        trust_remote_code=True,
+        dtype=dtype,
+    )
+    if precision == "int8":
+        from torchao.quantization import Int8WeightOnlyConfig, quantize_
+
+        # todas las capas lineales, lm_head incluida (con el vocabulario de Qwen es la más grande)
+        quantize_(model, Int8WeightOnlyConfig())
+    logger.info("Text model %s on CPU (%s, %s, %d threads)", MODEL_NAME, precision, dtype, CPU_THREADS)
+    return model.eval()
 
-DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
         
 @st.cache_resource
 def load_base_resources():
@@ -63,16 +120,10 @@ def load_base_resources():
             model="Helsinki-NLP/opus-mt-en-es",
             device=DEVICE,
             # dtype=torch.float8_e4m3fn,
-            dtype =torch.float16,
+            dtype =torch.float32 if CPU_MODE else torch.float16,
         ),
         # text section
-        "text_model": AutoModelForCausalLM.from_pretrained(
-            MODEL_NAME,
-            device_map="cuda:0",
-            trust_remote_code=True,
-            dtype =torch.float16,
-            # dtype=torch.float8_e4m3fn,
-        ),
+        "text_model": load_text_model(),
         "text_tokenizer": AutoTokenizer.from_pretrained(
             MODEL_NAME,
             trust_remote_code=True,
@@ -90,62 +141,3 @@ DICT_TRANSLATOR = _resources["dict_translator"]
 AUDIO_PIPELINE = _resources["audio_pipeline"]
 TEXT_MODEL = _resources["text_model"]
 TEXT_TOKENIZER = _resources["text_tokenizer"]
-
-
-# Cards
-DEFAULT_PARAMETERS = (
-    0.40255,
-    1.18385,
-    3.173,
-    15.69105,
-    7.1949,
-    0.5345,
-    1.4604,
-    0.0046,
-    1.54575,
-    0.1192,
-    1.01925,
-    1.9395,
-    0.11,
-    0.29605,
-    2.2698,
-    0.2315,
-    2.9898,
-    0.51655,
-    0.6621,
-)
-
-DECAY = -0.5
-FACTOR = 0.9 ** (1 / DECAY) - 1
-
-
-class State(IntEnum):
-    """
-    Enum representing the learning state of a Card object.
-    """
-
-    Learning = 1
-    Review = 2
-    Relearning = 3
-
-
-class Rating(IntEnum):
-    """
-    Enum representing the four possible ratings when reviewing a card.
-    """
-    Again = 1
-    Hard = 2
-    Good = 3
-    Easy = 4
-
-INITIAL_CARDS_VALUES = {
-    "last_review": None,
-    "review_datetime": None,
-    "days_since_last_review": None,
-    "due": datetime.now(timezone.utc),
-    "stability": 1.18385,
-    "difficulty": 6.488305,
-    "state": State.Learning,
-    "rating": Rating.Hard,
-    "step": 1
-}
\ No newline at end of file
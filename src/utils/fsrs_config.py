@@ -0,0 +1,68 @@
+"""
+Constantes de FSRS y valores iniciales de las tarjetas.
+
+Están separadas de `utils.config` para poder usar el programador y la base de
+datos sin cargar los modelos (benchmarks, scripts, tests).
+"""
+from datetime import datetime, timezone
+from enum import IntEnum
+
+
+DEFAULT_PARAMETERS = (
+    0.40255,
+    1.18385,
+    3.173,
+    15.69105,
+    7.1949,
+    0.5345,
+    1.4604,
+    0.0046,
+    1.54575,
+    0.1192,
+    1.01925,
+    1.9395,
+    0.11,
+    0.29605,
+    2.2698,
+    0.2315,
+    2.9898,
+    0.51655,
+    0.6621,
+)
+
+DECAY = -0.5
+FACTOR = 0.9 ** (1 / DECAY) - 1
+
+
+class State(IntEnum):
+    """
+    Enum representing the learning state of a Card object.
+    """
+
+    Learning = 1
+    Review = 2
+    Relearning = 3
+
+
+class Rating(IntEnum):
+    """
+    Enum representing the four possible ratings when reviewing a card.
+    """
+    Again = 1
+    Hard = 2
+    Good = 3
+    Easy = 4
+
+
+# Cards
+INITIAL_CARDS_VALUES = {
+    "last_review": None,
+    "review_datetime": None,
+    "days_since_last_review": None,
+    "due": datetime.now(timezone.utc),
+    "stability": 1.18385,
+    "difficulty": 6.488305,
+    "state": State.Learning,
+    "rating": Rating.Hard,
+    "step": 1
+}
@@ -0,0 +1,15 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def deck(tmp_path, monkeypatch):
+    # los decks `.db` viven en db/ relativo al directorio de trabajo
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "db").mkdir()
+    # el buffer, el índice de vencimientos y las cachés se comparten por URL de la base
+    # de datos (relativa): un nombre por test para que no se mezclen entre tests
+    name = f"{tmp_path.name}.db"
+    sqlite3.connect(f"db/{name}").close()
+    return name
@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+from tools.deck_snapshot import export_deck, import_deck
+from tools.sql_tool import add_cards, open_deck
+
+
+def _review_count(db_path) -> int:
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT count(*) FROM review_log").fetchone()[0]
+
+
+def _new_deck(name: str):
+    sqlite3.connect(f"db/{name}").close()
+    _, session = open_deck(name)
+    return session
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    # los decks `.db` viven en db/ relativo al directorio de trabajo
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "db").mkdir()
+    session = _new_deck("source.db")
+    add_cards(session, ["apple", "banana", "cherry"])
+    with sqlite3.connect("db/source.db") as conn:
+        conn.executemany(
+            "INSERT INTO review_log (card_id, ts, rating, elapsed_days) "
+            "SELECT id, ?, 3, 1 FROM deck WHERE word = ?",
+            [(1_700_000_000, "apple"), (1_700_100_000, "apple"), (1_700_000_000, "banana")],
+        )
+    cards, history = tmp_path / "cards.parquet", tmp_path / "history.parquet"
+    assert export_deck(session, cards, history) == (3, 3)
+    yield session, cards, history
+    session.close()
+
+
+def test_reimport_into_same_deck_keeps_history(snapshot):
+    session, cards, history = snapshot
+    for _ in range(2):
+        assert import_deck(session, cards, history) == (0, 0)
+    assert _review_count("db/source.db") == 3
+
+
+def test_import_skips_history_of_existing_words(snapshot):
+    _, cards, history = snapshot
+    target = _new_deck("target.db")
+    add_cards(target, ["apple"])
+    # apple ya está: se agregan banana y cherry, con el único repaso de banana
+    assert import_deck(target, cards, history) == (2, 1)
+    assert import_deck(target, cards, history) == (0, 0)
+    assert _review_count("db/target.db") == 1
+    target.close()
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta, timezone
+
+from tools.due_queue import DueQueue
+
+NOW = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def test_next_due_follows_pushes_and_removals():
+    queue = DueQueue((card_id, NOW - timedelta(minutes=card_id)) for card_id in range(1, 6))
+    assert queue.next_due(now=NOW) == [5, 4, 3, 2, 1]
+    assert queue.next_due(limit=2, now=NOW) == [5, 4]
+
+    # calificada con Again: vuelve en 10 minutos; la entrada anterior queda obsoleta
+    queue.push(5, NOW + timedelta(minutes=10))
+    queue.remove(4)
+    assert queue.next_due(now=NOW) == [3, 2, 1]
+    assert queue.next_due(now=NOW + timedelta(minutes=11)) == [3, 2, 1, 5]
+    assert queue.peek() == NOW - timedelta(minutes=3)
+    assert len(queue) == 4
+
+
+def test_naive_datetimes_are_utc():
+    queue = DueQueue([(1, NOW.replace(tzinfo=None))])
+    assert queue.peek() == NOW
+    assert queue.next_due(now=NOW) == []
+    assert queue.next_due(now=NOW + timedelta(seconds=1)) == [1]
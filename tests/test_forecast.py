@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from tools.forecast import DeckColumns, forecast_deck, simulate_reviews
+from tools.fsrs_scheduler import NO_STEP, to_datetime64
+from tools.sql_tool import add_cards, get_due_cards, open_deck, pending_reviews, review_cards, update_card
+from utils.fsrs_config import Rating, State
+
+NOW = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+
+
+def _columns(n: int, seed: int = 0) -> DeckColumns:
+    rng = np.random.default_rng(seed)
+    last_review = [NOW - timedelta(days=int(days)) for days in rng.integers(1, 30, n)]
+    state = rng.choice([State.Learning, State.Review, State.Relearning], n).astype(np.int64)
+    return DeckColumns(
+        state=state,
+        # solo las tarjetas en Review no tienen paso
+        step=np.where(state == State.Review, NO_STEP, 0),
+        stability=rng.uniform(0.5, 50, n),
+        difficulty=rng.uniform(1, 10, n),
+        last_review=to_datetime64(last_review),
+        due=to_datetime64([review + timedelta(days=int(days)) for review, days in zip(last_review, rng.integers(0, 40, n))]),
+    )
+
+
+def test_seeded_forecast_is_reproducible():
+    columns = _columns(500)
+    first = simulate_reviews(columns, horizon_days=60, n_simulations=2, seed=7, start=NOW)
+    again = simulate_reviews(columns, horizon_days=60, n_simulations=2, seed=7, start=NOW)
+    other = simulate_reviews(columns, horizon_days=60, n_simulations=2, seed=8, start=NOW)
+
+    np.testing.assert_array_equal(first.reviews, again.reviews)
+    np.testing.assert_array_equal(first.study_minutes, again.study_minutes)
+    assert not np.array_equal(first.reviews, other.reviews)
+    assert first.dates[0] == np.datetime64("2025-01-01")
+    # el primer día se repasan al menos todas las tarjetas atrasadas
+    overdue = np.count_nonzero(columns.due < to_datetime64([NOW])[0])
+    assert first.reviews[0] >= overdue
+    # la simulación no modifica las columnas del deck
+    np.testing.assert_array_equal(columns.due, _columns(500).due)
+
+
+def test_forecast_cache_follows_edits_and_pending_ratings(deck):
+    _, session = open_deck(deck)
+    add_cards(session, ["apple", "banana", "cherry"])
+    first = forecast_deck(session, horizon_days=30)
+    assert forecast_deck(session, horizon_days=30) is first
+
+    # edición desde la pestaña Database: no cambia cantidad, ids ni last_review
+    update_card(
+        session, "apple", last_review=None, review_datetime=None, days_since_last_review=None,
+        due=datetime.now(timezone.utc) + timedelta(days=20), stability=40.0, difficulty=5.0,
+        state=State.Review, rating=Rating.Good, step=None,
+    )
+    edited = forecast_deck(session, horizon_days=30)
+    assert edited is not first
+    assert edited.reviews.sum() < first.reviews.sum()
+
+    now = datetime.now(timezone.utc)
+    banana = next(card for card in get_due_cards(session) if card.word == "banana")
+    review_cards(
+        session, [banana], Rating.Good,
+        last_review=[now], review_datetime=[now], days_since_last_review=[0], due=[now + timedelta(days=25)],
+        stability=[40.0], difficulty=[5.0], state=[State.Review], step=[None],
+    )
+    rated = forecast_deck(session, horizon_days=30)
+    # la calificación cuenta sin escribir el buffer
+    assert pending_reviews(session)
+    assert rated is not edited
+    assert rated.reviews.sum() < edited.reviews.sum()
@@ -0,0 +1,36 @@
+import numpy as np
+import torch
+
+from tools.fsrs_optimizer import fit_parameters
+from utils.fsrs_config import DEFAULT_PARAMETERS, Rating
+
+
+def _synthetic_logs(cards: int, reviews: int, recall: float, seed: int = 0):
+    # un deck que se recuerda mucho mejor de lo que predicen los pesos por defecto
+    rng = np.random.default_rng(seed)
+    elapsed_days = rng.integers(1, 60, (cards, reviews))
+    elapsed_days[:, 0] = 0
+    ratings = np.where(rng.random((cards, reviews)) < recall, Rating.Good, Rating.Again).astype(np.int64)
+    lengths = rng.integers(2, reviews + 1, cards)
+    mask = np.arange(reviews)[None, :] < lengths[:, None]
+    return np.where(mask, ratings, 0), np.where(mask, elapsed_days, 0), lengths
+
+
+def test_fit_lowers_the_loss_and_keeps_the_initial_state_weights():
+    threads = torch.get_num_threads()
+    parameters, initial_loss, final_loss = fit_parameters(
+        *_synthetic_logs(cards=400, reviews=8, recall=0.97), epochs=3, batch_size=128
+    )
+
+    assert final_loss < initial_loss
+    assert len(parameters) == len(DEFAULT_PARAMETERS)
+    # w0-w5 no se usan al programar: quedan como estaban
+    assert parameters[:6] == DEFAULT_PARAMETERS[:6]
+    assert parameters[6:] != DEFAULT_PARAMETERS[6:]
+    # el ajuste no cambia la configuración de hilos del proceso (la usa el modelo de texto)
+    assert torch.get_num_threads() == threads
+
+
+def test_fit_is_reproducible():
+    logs = _synthetic_logs(cards=200, reviews=6, recall=0.9, seed=1)
+    assert fit_parameters(*logs, epochs=2, batch_size=64) == fit_parameters(*logs, epochs=2, batch_size=64)
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from benchmarks.scheduler_benchmark import VARIANTS, make_population, make_rating_stream, scalar_columns
+from tools.fsrs_scheduler import NO_STEP, Scheduler, learning_scheduler, learning_scheduler_batch, to_datetime64
+from utils.fsrs_config import Rating, State
+
+NOW = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "learning_steps, re_learning_steps",
+    [
+        ((), (timedelta(minutes=10),)),
+        ((timedelta(0),), ()),
+        ((timedelta(minutes=1),), (timedelta(minutes=-10),)),
+    ],
+)
+def test_invalid_steps_are_rejected(learning_steps, re_learning_steps):
+    with pytest.raises(ValueError):
+        Scheduler(learning_steps=learning_steps, re_learning_steps=re_learning_steps)
+
+
+@pytest.mark.parametrize("rating", list(Rating))
+@pytest.mark.parametrize("state", [State.Review, State.Relearning])
+def test_no_relearning_steps_match_scalar(state, rating):
+    # una tarjeta en Relearning de cuando el deck tenía pasos de reaprendizaje
+    card = SimpleNamespace(
+        state=state,
+        stability=5.0,
+        difficulty=6.0,
+        step=None if state == State.Review else 0,
+        last_review=NOW - timedelta(days=3),
+    )
+    scheduler = Scheduler(re_learning_steps=())
+    expected = learning_scheduler(
+        state=card.state,
+        stability=card.stability,
+        difficulty=card.difficulty,
+        rating=rating,
+        days_since_last_review=None,
+        review_datetime=NOW,
+        last_review=card.last_review,
+        step=card.step,
+        re_learning_steps=(),
+    )
+    columns = dict(
+        state=[card.state],
+        stability=[card.stability],
+        difficulty=[card.difficulty],
+        step=[NO_STEP if card.step is None else card.step],
+        last_review=to_datetime64([card.last_review]),
+        rating=rating,
+    )
+
+    assert expected[6] == State.Review
+    assert scheduler.review(card, rating, NOW) == expected
+    # `review_many` con un grupo chico califica de a una; `learning_scheduler_batch` usa numpy
+    for result in (
+        scheduler.review_many(**columns, now=NOW),
+        learning_scheduler_batch(**columns, review_datetime=NOW, re_learning_steps=()),
+    ):
+        _, _, _, due, stability, difficulty, new_state, _, step = result
+        assert (new_state[0], step[0]) == (State.Review, NO_STEP)
+        assert (stability[0], difficulty[0]) == (expected[4], expected[5])
+        assert due[0] == to_datetime64([expected[3]])[0]
+
+
+def assert_same_columns(expected: dict, actual: dict):
+    # comparación exacta, bit a bit
+    for column, values in expected.items():
+        np.testing.assert_array_equal(np.asarray(actual[column]), values, err_msg=column)
+
+
+@pytest.mark.parametrize("variant", VARIANTS)
+@pytest.mark.parametrize("rating", list(Rating))
+def test_variants_match_scalar(variant, rating):
+    # los tres estados, con y sin paso, repasadas hoy, hace meses o nunca
+    population = make_population(1000, NOW, seed=0)
+    ratings = np.full(len(population), rating)
+    assert_same_columns(scalar_columns(population, ratings, NOW), VARIANTS[variant](population, ratings, NOW))
+
+
+@pytest.mark.parametrize("variant", VARIANTS)
+def test_variants_match_scalar_over_review_streams(variant):
+    # cada camino avanza su propia copia de las tarjetas con los resultados anteriores
+    population = make_population(200, NOW, seed=1)
+    rng = np.random.default_rng(0)
+    cards = {"scalar": population.take(slice(None)), variant: population.take(slice(None))}
+    review_datetime = NOW
+    for ratings in make_rating_stream(len(population), 20, seed=1):
+        expected = scalar_columns(cards["scalar"], ratings, review_datetime)
+        actual = VARIANTS[variant](cards[variant], ratings, review_datetime)
+        assert_same_columns(expected, actual)
+        for name, columns in (("scalar", expected), (variant, actual)):
+            cards[name].state = np.asarray(columns["state"])
+            cards[name].stability = np.asarray(columns["stability"])
+            cards[name].difficulty = np.asarray(columns["difficulty"])
+            cards[name].step = np.asarray(columns["step"])
+            cards[name].last_review = np.full(len(population), to_datetime64([review_datetime])[0])
+        # siguiente repaso entre unos minutos y un par de meses después
+        review_datetime += timedelta(seconds=float(rng.exponential(5 * 86400)))
+
+
+@pytest.mark.parametrize("rating", list(Rating))
+@pytest.mark.parametrize("state", [State.Learning, State.Relearning])
+def test_missing_step_is_the_first_step(state, rating):
+    # una tarjeta en (re)aprendizaje sin paso se califica como si estuviera en el paso 0
+    def one_card(step):
+        population = make_population(1, NOW)
+        population.state[:] = state
+        population.step[:] = step
+        return population
+
+    ratings = np.full(1, rating)
+    expected = scalar_columns(one_card(0), ratings, NOW)
+    assert_same_columns(expected, scalar_columns(one_card(NO_STEP), ratings, NOW))
+    for variant in VARIANTS.values():
+        assert_same_columns(expected, variant(one_card(NO_STEP), ratings, NOW))
@@ -0,0 +1,112 @@
+import pytest
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from tools.inference_queue import InferenceQueue
+
+PAD, EOS, VOCAB = 0, 1, 64
+
+
+@pytest.fixture(scope="module")
+def model_and_tokenizer():
+    # modelo causal mínimo con pesos aleatorios y un vocabulario de palabras "wN"
+    vocab = {"<pad>": PAD, "<eos>": EOS, **{f"w{i}": i for i in range(2, VOCAB)}}
+    backend = Tokenizer(models.WordLevel(vocab, unk_token="<pad>"))
+    backend.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    backend.decoder = decoders.WordPiece()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, pad_token="<pad>", eos_token="<eos>")
+    torch.manual_seed(0)
+    # pesos grandes: con los de fábrica los logits casi no dependen de las posiciones
+    # y un error de alineación del cache no cambiaría el argmax
+    config = LlamaConfig(
+        vocab_size=VOCAB, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=4, num_key_value_heads=2, initializer_range=0.5,
+        pad_token_id=PAD, bos_token_id=EOS, eos_token_id=EOS,
+    )
+    model = LlamaForCausalLM(config).eval()
+    model.generation_config.do_sample = False
+    return model, tokenizer
+
+
+def random_prompts(lengths, seed=1):
+    generator = torch.Generator().manual_seed(seed)
+    return [torch.randint(2, VOCAB, (length,), generator=generator).tolist() for length in lengths]
+
+
+def reference(model, prompt, max_new_tokens):
+    # `generate` de a una secuencia, sin padding, como referencia
+    output = model.generate(torch.tensor([prompt]), max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=PAD)
+    return [token for token in output[0, len(prompt):].tolist() if token != EOS]
+
+
+def run(inference_queue, prompts, max_new_tokens, **options):
+    requests = [inference_queue.submit(prompt, max_new_tokens, **options) for prompt in prompts]
+    for request in requests:
+        request.result()
+    return requests
+
+
+def test_greedy_batch_matches_generate(model_and_tokenizer):
+    model, tokenizer = model_and_tokenizer
+    inference_queue = InferenceQueue(model, tokenizer)
+    prompts = random_prompts([3, 7, 5, 12])
+    try:
+        requests = run(inference_queue, prompts, 10)
+    finally:
+        inference_queue.close()
+    for request, prompt in zip(requests, prompts):
+        expected = reference(model, prompt, 10)
+        assert request.generated == expected
+        assert request.result() == tokenizer.decode(expected, skip_special_tokens=True)
+
+
+def test_rows_joining_and_leaving_mid_decode_match_generate(model_and_tokenizer):
+    # con dos filas como máximo, los pedidos en espera entran al batch cuando sale uno
+    # (que termina antes por su max_new_tokens) y se alinean con el cache en curso
+    model, tokenizer = model_and_tokenizer
+    inference_queue = InferenceQueue(model, tokenizer, max_batch_size=2)
+    prompts = random_prompts([4, 9, 2, 6, 11], seed=2)
+    lengths = [3, 12, 5, 8, 4]
+    try:
+        requests = [inference_queue.submit(prompt, n) for prompt, n in zip(prompts, lengths)]
+        for request in requests:
+            request.result()
+    finally:
+        inference_queue.close()
+    for request, prompt, n in zip(requests, prompts, lengths):
+        assert request.generated == reference(model, prompt, n)
+
+
+def test_stream_yields_the_full_text(model_and_tokenizer):
+    model, tokenizer = model_and_tokenizer
+    inference_queue = InferenceQueue(model, tokenizer)
+    try:
+        request = inference_queue.submit(random_prompts([5])[0], 6)
+        assert "".join(request.stream()) == request.result()
+    finally:
+        inference_queue.close()
+
+
+def test_prefix_cache_matches_generate(model_and_tokenizer):
+    model, tokenizer = model_and_tokenizer
+    inference_queue = InferenceQueue(model, tokenizer)
+    prefix, other_prefix = random_prompts([6, 4], seed=3)
+    suffixes = random_prompts([3, 7, 1, 5], seed=4)
+    # dos prefijos y un pedido sin prefijo en el mismo batch, y un prompt que es solo el prefijo
+    prompts = [prefix + suffix for suffix in suffixes] + [other_prefix + suffixes[0], suffixes[1], prefix]
+    prefix_lengths = [len(prefix)] * len(suffixes) + [len(other_prefix), 0, len(prefix)]
+    try:
+        requests = [
+            inference_queue.submit(prompt, 8, prefix_length=length) for prompt, length in zip(prompts, prefix_lengths)
+        ]
+        for request in requests:
+            request.result()
+        assert set(inference_queue._prefixes) == {tuple(prefix), tuple(other_prefix), tuple(prefix[:-1])}
+        # el segundo pedido con el mismo prefijo reutiliza el cache guardado
+        again = run(inference_queue, prompts[:2], 8, prefix_length=len(prefix))
+        assert len(inference_queue._prefixes) == 3
+    finally:
+        inference_queue.close()
+    for request, prompt in zip(requests + again, prompts + prompts[:2]):
+        assert request.generated == reference(model, prompt, 8)
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import subprocess
+import sys
+import textwrap
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from tools.review_buffer import ReviewBuffer, discard_buffer, flush_all, register_buffer
+from tools.sql_tool import add_cards, flush_reviews, get_due_cards, open_deck, review_cards
+from utils.fsrs_config import Rating, State
+
+SRC = Path(__file__).resolve().parents[1] / "src"
+
+
+class Recorder:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.writes = []
+
+    def __call__(self, cards, logs):
+        if self.fail:
+            raise OSError("disk full")
+        self.writes.append((cards, logs))
+
+
+def test_flush_writes_everything_in_one_call():
+    write = Recorder()
+    buffer = ReviewBuffer(write, interval=0)
+    buffer.add([{"card_id": 1, "due": 1}, {"card_id": 2, "due": 1}], [{"card_id": 1}, {"card_id": 2}])
+    # una calificación posterior de la misma tarjeta reemplaza a la pendiente
+    buffer.add([{"card_id": 1, "due": 2}], [{"card_id": 1}])
+    assert len(buffer) == 2 and write.writes == []
+
+    buffer.flush()
+    buffer.flush()
+    assert write.writes == [
+        ([{"card_id": 1, "due": 2}, {"card_id": 2, "due": 1}], [{"card_id": 1}, {"card_id": 2}, {"card_id": 1}])
+    ]
+    assert len(buffer) == 0
+
+
+def test_failed_write_keeps_changes_pending():
+    write = Recorder(fail=True)
+    buffer = ReviewBuffer(write, interval=0)
+    buffer.add([{"card_id": 1, "due": 1}], [{"card_id": 1, "ts": 1}])
+    with pytest.raises(OSError):
+        buffer.flush()
+    assert buffer.pending() == {1: {"card_id": 1, "due": 1}}
+
+    buffer.add([{"card_id": 1, "due": 2}], [{"card_id": 1, "ts": 2}])
+    write.fail = False
+    buffer.flush()
+    assert write.writes == [([{"card_id": 1, "due": 2}], [{"card_id": 1, "ts": 1}, {"card_id": 1, "ts": 2}])]
+
+
+def test_timer_flushes_and_flush_all_writes_registered_buffers():
+    write = Recorder()
+    buffer = ReviewBuffer(write, interval=0.05)
+    buffer.add([{"card_id": 1}], [])
+    deadline = time.monotonic() + 5
+    while not write.writes and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(write.writes) == 1
+
+    registered = register_buffer("test://flush_all", ReviewBuffer(write, interval=0))
+    try:
+        registered.add([{"card_id": 2}], [])
+        flush_all()
+        assert write.writes[-1] == ([{"card_id": 2}], [])
+    finally:
+        discard_buffer("test://flush_all")
+
+
+def _rate(session, cards, now, due):
+    n = len(cards)
+    review_cards(
+        session, cards, Rating.Good,
+        last_review=[now] * n, review_datetime=[now] * n, days_since_last_review=[0] * n, due=[due] * n,
+        stability=[3.0] * n, difficulty=[5.0] * n, state=[State.Review] * n, step=[None] * n,
+    )
+
+
+def test_ratings_reach_the_database_on_flush(deck):
+    _, session = open_deck(deck)
+    add_cards(session, ["apple", "banana"])
+    cards = get_due_cards(session)
+    _rate(session, cards, datetime.now(timezone.utc), datetime(2100, 1, 1, tzinfo=timezone.utc))
+
+    with sqlite3.connect(f"db/{deck}") as conn:
+        assert conn.execute("SELECT count(*) FROM review_log").fetchone()[0] == 0
+    flush_reviews(session)
+    with sqlite3.connect(f"db/{deck}") as conn:
+        assert conn.execute("SELECT count(*) FROM review_log").fetchone()[0] == 2
+        assert conn.execute("SELECT DISTINCT state, stability FROM deck").fetchall() == [(int(State.Review), 3.0)]
+
+
+def test_pending_ratings_are_written_at_exit(deck):
+    # un proceso que califica y termina sin escribir el buffer (el temporizador es de 2 s)
+    script = textwrap.dedent(f"""
+        from datetime import datetime, timezone
+        from tools.sql_tool import add_cards, get_due_cards, open_deck, review_cards
+        from utils.fsrs_config import Rating, State
+
+        _, session = open_deck({deck!r})
+        add_cards(session, ["apple"])
+        now = datetime.now(timezone.utc)
+        review_cards(
+            session, get_due_cards(session), Rating.Easy,
+            last_review=[now], review_datetime=[now], days_since_last_review=[0],
+            due=[datetime(2100, 1, 1, tzinfo=timezone.utc)],
+            stability=[9.0], difficulty=[4.0], state=[State.Review], step=[None],
+        )
+    """)
+    subprocess.run([sys.executable, "-c", script], check=True, env={**os.environ, "PYTHONPATH": str(SRC)}, timeout=60)
+    with sqlite3.connect(f"db/{deck}") as conn:
+        assert conn.execute("SELECT stability FROM deck").fetchall() == [(9.0,)]
+        assert conn.execute("SELECT rating FROM review_log").fetchall() == [(int(Rating.Easy),)]
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tools.sql_tool import (
+    add_cards,
+    autocomplete_words,
+    delete_card,
+    get_card,
+    get_due_cards,
+    get_due_queue,
+    get_scheduler,
+    next_due_cards,
+    open_deck,
+    review_cards,
+    save_scheduler_settings,
+    update_card,
+)
+from utils.fsrs_config import Rating, State
+
+
+def test_scheduler_follows_settings_saved_from_another_session(deck):
+    _, study = open_deck(deck)
+    _, manage = open_deck(deck)
+    before = get_scheduler(study)
+    assert get_scheduler(study) is before
+
+    save_scheduler_settings(
+        manage, desired_retention=0.85, learning_steps=[120], relearning_steps=[], maximum_interval=100
+    )
+
+    after = get_scheduler(study)
+    assert after is not before
+    assert after.desired_retention == 0.85
+    assert after.learning_steps == (timedelta(minutes=2),)
+    assert after.re_learning_steps == ()
+    assert get_scheduler(manage) is after
+
+
+def test_save_scheduler_settings_rejects_empty_learning_steps(deck):
+    _, session = open_deck(deck)
+    with pytest.raises(ValueError):
+        save_scheduler_settings(
+            session, desired_retention=0.9, learning_steps=[], relearning_steps=[600], maximum_interval=100
+        )
+    assert get_scheduler(session).learning_steps
+
+
+def test_due_index_follows_writes(deck):
+    _, session = open_deck(deck)
+    add_cards(session, ["apple", "banana", "cherry"])
+    get_due_queue(session)
+    apple, banana, cherry = get_due_cards(session, order="due")
+
+    now = datetime.now(timezone.utc)
+    review_cards(
+        session, [apple], Rating.Good,
+        last_review=[now], review_datetime=[now], days_since_last_review=[0], due=[now + timedelta(days=1)],
+        stability=[2.0], difficulty=[5.0], state=[State.Review], step=[None],
+    )
+    # la calificación sigue en el buffer y el índice ya la tiene en cuenta
+    assert [card.id for card in next_due_cards(session)] == [banana.id, cherry.id]
+
+    add_cards(session, ["date"])
+    delete_card(session, get_card(session, "banana")[0][0])
+    expected = [card.id for card in get_due_cards(session, order="due")]
+    assert [card.id for card in next_due_cards(session)] == expected
+    assert [card.word for card in next_due_cards(session, limit=1)] == ["cherry"]
+
+
+WORDS = ["up", "upset", "turned up", "made it up", "cup", "Upper", "pick-up", "apple", "Apply", "happen", "application"]
+
+
+@pytest.mark.parametrize("query", ["up", "U", "p", "app", "APP", "ppl", "it up", "pick-", "zzz"])
+def test_search_matches_substring_semantics(deck, query):
+    _, session = open_deck(deck)
+    add_cards(session, WORDS)
+    cards, words = get_card(session, query)
+
+    # la búsqueda original: LIKE '%q%' sin distinguir mayúsculas, sin límite
+    assert sorted(words) == sorted(word for word in WORDS if query.lower() in word.lower())
+    assert [card.word for card in cards] == words
+    if query.lower() in (word.lower() for word in WORDS):
+        assert words[0].lower() == query.lower()
+
+
+def test_search_limit_and_autocomplete(deck):
+    _, session = open_deck(deck)
+    add_cards(session, WORDS)
+    assert get_card(session, "") == ([], [])
+    assert len(get_card(session, "p", limit=3)[1]) == 3
+    assert autocomplete_words(session, "app") == ["apple", "application"]
+
+
+def test_update_card_reports_missing_words(deck, capsys):
+    _, session = open_deck(deck)
+    add_cards(session, ["apple"])
+    assert update_card(session, "apple", new_word="apples")
+    assert not update_card(session, "apple", restore=True)
+    assert get_card(session, "apple")[1] == ["apples"]
+    assert capsys.readouterr().out == ""